@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""concurrent throughput of drivers.service_stack against a stub driver.
+
+A stub driver is served from a background thread, it answers every request
+after --latency seconds. The service_stack of the onecontainer_api on the
+python path is called --requests times, --concurrency calls at a time from
+one event loop, a blocking service_stack (before the pooled transport) is
+called as it is, an async one is awaited. Run it from two checkouts to
+compare them, see benchmarks/Readme.md.
+
+usage: python benchmarks/bench_service_stack.py --requests 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import inspect
+import threading
+import time
+
+from aiohttp import web
+
+from onecontainer_api import config, schemas
+from onecontainer_api.routers import drivers
+
+try:
+    from onecontainer_api import transport
+except ImportError:
+    # before the pooled transport
+    transport = None
+
+DRIVER = schemas.DriverBase(name="bench-driver", version="0.1.0", app="bench",
+                            app_version_match=">=0.1.0", scope="ai", source_type="native")
+SERVICE = schemas.Service(id="benchsvc", name="bench", version="v1", app="bench",
+                          app_version="0.1.0", locations={"node1": "127.0.0.1:0"}, meta={})
+
+
+def serve_stub(port: int, latency: float):
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return web.json_response({"status": "ok"})
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    loop.run_forever()
+
+
+async def service_call():
+    output = drivers.service_stack(DRIVER, SERVICE, "get", "/ping", sync=True)
+    if inspect.isawaitable(output):
+        output = await output
+    return output
+
+
+async def run(total: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await service_call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(total)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=config.DRIVER_PORT)
+    args = parser.parse_args()
+
+    config.DRIVER_PORT = args.port
+    drivers.get_driver_ip = lambda driver: "127.0.0.1"
+    threading.Thread(target=serve_stub, args=(args.port, args.latency), daemon=True).start()
+    time.sleep(0.5)
+
+    loop = asyncio.get_event_loop()
+    # first call connects and resolves the driver
+    loop.run_until_complete(run(1, 1))
+    elapsed = loop.run_until_complete(run(args.requests, args.concurrency))
+    mode = "async" if transport else "blocking"
+    print(f"{mode}: {args.requests} requests in {elapsed:.2f}s -> {args.requests / elapsed:.1f} req/s")
+    if transport:
+        loop.run_until_complete(transport.close())
+
+if __name__ == "__main__":
+    main()
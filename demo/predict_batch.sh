@@ -0,0 +1,3 @@
+#!/bin/bash
+
+curl -X POST -F image_files=@cat.jpg -F image_files=@cat.jpg localhost:8000/ai/$1/predict_batch | python3 -m json.tool
@@ -61,13 +61,14 @@ async def post_job(request: Request):
         item = QueueData(**await request.json())
     elif request.headers['content-type'].startswith('multipart/form-data'):
         form = await request.form()
+        uploads = form.getlist("data")
         item = QueueData(
             headers=json.loads(form.get('headers', "")),
             url=form["url"],
             name=form["name"],
             req_type=form.get("req_type"),
             ttl=int(form.get("ttl", "0")) or None,
-            data=form.get("data")
+            data=uploads if len(uploads) > 1 else form.get("data")
         )
     logger.debug(f"queue job: {item}")
     return enqueue_job(item)
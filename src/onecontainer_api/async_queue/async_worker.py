@@ -0,0 +1,248 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""asyncio worker for the job queues.
+
+A stock rq worker forks for each job and waits for its driver call, so a
+worker runs one job at a time. This worker dequeues jobs as long as a queue
+has fewer than --concurrency jobs running, and runs the driver calls of
+job_queue.worker jobs concurrently over one keep-alive aiohttp session.
+Other jobs run job.perform in a thread.
+
+Job states, results, retries and registries are written per job as an rq
+Worker writes them, so fetch_job, the dashboard and the supervisor see
+these jobs as any other, the worker itself is registered as busy while it
+runs jobs but has no current job. Redis calls run in a thread pool of one
+thread per job slot. On SIGTERM the worker stops dequeuing and exits once
+its running jobs are done.
+
+    python async_worker.py [--url redis://oca_redis:6379] [--name NAME] [--concurrency 256] queue...
+"""
+import argparse
+import asyncio
+import signal
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+from redis import Redis
+from redis.exceptions import WatchError
+from rq import Queue, Worker
+from rq.exceptions import DequeueTimeout
+from rq.job import JobStatus
+from rq.registry import FailedJobRegistry
+from rq.utils import utcformat, utcnow
+from rq.worker import WorkerStatus
+
+import blob_store
+import job_queue
+from job_schema import JOB_TIMEOUT, WORKER_FUNC
+from logger import logger
+
+JOB_CONCURRENCY = 256
+# seconds a dequeue blocks, and between worker heartbeats
+DEQUEUE_TIMEOUT = 1
+HEARTBEAT_INTERVAL = 30
+
+
+class AsyncWorker:
+
+    def __init__(self, queue_names, connection, name=None, concurrency=JOB_CONCURRENCY):
+        self.connection = connection
+        self.queues = [Queue(name, connection=connection) for name in queue_names]
+        # registers the worker, its state, heartbeats and job counts
+        self.rq = Worker(self.queues, connection=connection, name=name)
+        self.concurrency = concurrency
+        self.running = {queue.name: 0 for queue in self.queues}
+        self.stopping = False
+        self._slot_freed = None
+        self._tasks = set()
+        self._session = None
+        self._state = None
+        self._state_lock = None
+        # a thread per running job, and one for the dequeue
+        self._executor = ThreadPoolExecutor(concurrency * len(self.queues) + 1,
+                                            thread_name_prefix="bookkeeping")
+
+    def _call(self, func, *args):
+        """redis bookkeeping, run in a thread to keep the loop free."""
+        return asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    async def _update_state(self):
+        """busy while jobs run, idle otherwise, written once per change."""
+        async with self._state_lock:
+            state = WorkerStatus.BUSY if any(self.running.values()) else WorkerStatus.IDLE
+            if state != self._state:
+                await self._call(self.rq.set_state, state)
+                self._state = state
+
+    def _started(self, job, queue, timeout):
+        """Worker.prepare_job_execution of one job, without the worker current job."""
+        with self.connection.pipeline() as pipeline:
+            queue.started_job_registry.add(job, timeout, pipeline=pipeline)
+            job.set_status(JobStatus.STARTED, pipeline=pipeline)
+            pipeline.hset(job.key, "started_at", utcformat(utcnow()))
+            pipeline.execute()
+
+    def _succeeded(self, job, queue):
+        """Worker.handle_job_success of one job."""
+        with self.connection.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(job.dependents_key)
+                    queue.enqueue_dependents(job, pipeline=pipeline)
+                    self.rq.increment_successful_job_count(pipeline=pipeline)
+                    self.rq.increment_total_working_time(job.ended_at - job.started_at, pipeline)
+                    result_ttl = job.get_result_ttl(self.rq.default_result_ttl)
+                    if result_ttl != 0:
+                        job.set_status(JobStatus.FINISHED, pipeline=pipeline)
+                        job.save(pipeline=pipeline, include_meta=False)
+                        queue.finished_job_registry.add(job, result_ttl, pipeline)
+                    job.cleanup(result_ttl, pipeline=pipeline, remove_from_queue=False)
+                    queue.started_job_registry.remove(job, pipeline=pipeline)
+                    pipeline.execute()
+                    break
+                except WatchError:
+                    continue
+
+    def _failed(self, job, queue, exc_string):
+        """Worker.handle_job_failure of one job, retried while it has retries left."""
+        with self.connection.pipeline() as pipeline:
+            retry = bool(job.retries_left and job.retries_left > 0)
+            if retry:
+                retry_interval = job.get_retry_interval()
+                job.retries_left = job.retries_left - 1
+            else:
+                job.set_status(JobStatus.FAILED, pipeline=pipeline)
+                FailedJobRegistry(job.origin, job.connection).add(
+                    job, ttl=job.failure_ttl, exc_string=exc_string, pipeline=pipeline)
+            queue.started_job_registry.remove(job, pipeline=pipeline)
+            self.rq.increment_failed_job_count(pipeline)
+            if job.started_at and job.ended_at:
+                self.rq.increment_total_working_time(job.ended_at - job.started_at, pipeline)
+            if retry:
+                if retry_interval:
+                    job.set_status(JobStatus.SCHEDULED)
+                    scheduled = datetime.now(timezone.utc) + timedelta(seconds=retry_interval)
+                    queue.schedule_job(job, scheduled, pipeline=pipeline)
+                else:
+                    queue.enqueue_job(job, pipeline=pipeline)
+            pipeline.execute()
+
+    async def _dequeue(self):
+        """next job of a queue under its concurrency limit, None on timeout."""
+        queues = [queue for queue in self.queues if self.running[queue.name] < self.concurrency]
+        if not queues:
+            self._slot_freed.clear()
+            await self._slot_freed.wait()
+            return None
+        try:
+            return await self._call(Queue.dequeue_any, queues, DEQUEUE_TIMEOUT, self.connection)
+        except DequeueTimeout:
+            return None
+
+    async def _request(self, method, url, headers, data):
+        """job_queue.worker without blocking, same request and result."""
+        kwargs = {"headers": headers}
+        uploads = None
+        if method == "get":
+            kwargs["params"] = {k: v for k, v in (data or {}).items() if v is not None}
+        elif blob_store.is_upload(data) or job_queue._is_upload_list(data, blob_store.is_upload):
+            uploads = data if isinstance(data, list) else [data]
+        else:
+            kwargs["json"] = data
+        with ExitStack() as stack:
+            if uploads:
+                form = aiohttp.FormData()
+                for upload in uploads:
+                    fileobj = await self._call(blob_store.open_upload, self.connection, upload)
+                    form.add_field("img", stack.enter_context(fileobj), filename=upload["filename"])
+                kwargs["data"] = form
+            async with self._session.request(method.upper(), url, **kwargs) as resp:
+                result = await resp.json(content_type=None)
+        for upload in uploads or []:
+            await self._call(blob_store.release, self.connection, upload)
+        return result
+
+    async def _perform(self, job):
+        if job.func_name == WORKER_FUNC:
+            kwargs = dict(job.kwargs)
+            return await self._request(kwargs["method"], kwargs["url"], kwargs.get("headers"), kwargs.get("data"))
+        return await self._call(job.perform)
+
+    async def _run_job(self, job, queue):
+        try:
+            timeout = job.timeout if job.timeout and job.timeout > 0 else JOB_TIMEOUT
+            await self._call(self._started, job, queue, timeout)
+            job.started_at = utcnow()
+            job._result = await asyncio.wait_for(self._perform(job), timeout)
+            job.ended_at = utcnow()
+            await self._call(self._succeeded, job, queue)
+            logger.debug(f"{queue.name}: job {job.id} OK")
+        except Exception:
+            job.ended_at = utcnow()
+            exc_string = traceback.format_exc()
+            logger.error(f"{queue.name}: job {job.id} failed: {exc_string}")
+            await self._call(self._failed, job, queue, exc_string)
+        finally:
+            self.running[queue.name] -= 1
+            self._slot_freed.set()
+            await self._update_state()
+
+    async def _heartbeat(self):
+        while not self.stopping:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await self._call(self.rq.heartbeat)
+
+    def stop(self):
+        logger.debug(f"Worker {self.rq.name} stopping after {sum(self.running.values())} running jobs")
+        self.stopping = True
+        self._slot_freed.set()
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._slot_freed = asyncio.Event()
+        self._state_lock = asyncio.Lock()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+        await self._call(self.rq.register_birth)
+        await self._update_state()
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        connector = aiohttp.TCPConnector(limit=self.concurrency * len(self.queues), keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(connector=connector)
+        logger.debug(f"Worker {self.rq.name} running {self.concurrency} jobs per queue "
+                     f"of {', '.join(queue.name for queue in self.queues)}")
+        try:
+            while not self.stopping:
+                dequeued = await self._dequeue()
+                if not dequeued:
+                    continue
+                job, queue = dequeued
+                self.running[queue.name] += 1
+                await self._update_state()
+                task = asyncio.ensure_future(self._run_job(job, queue))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if self._tasks:
+                await asyncio.wait(self._tasks)
+        finally:
+            heartbeat.cancel()
+            await self._session.close()
+            await self._call(self.rq.register_death)
+            self._executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queues", nargs="+")
+    parser.add_argument("--url", help="redis url, REDISHOST and REDISPORT by default")
+    parser.add_argument("--name", help="worker name, unique")
+    parser.add_argument("--concurrency", type=int, default=JOB_CONCURRENCY, help="jobs running at once per queue")
+    args = parser.parse_args()
+    connection = Redis.from_url(args.url) if args.url else job_queue.CONN
+    asyncio.run(AsyncWorker(args.queues, connection, args.name, args.concurrency).run())
+
+
+if __name__ == "__main__":
+    main()
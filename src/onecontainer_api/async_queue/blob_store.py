@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""side storage for uploaded files of queued jobs.
+
+RQ pickles job kwargs into redis, so a job carrying a file would hold a full
+copy of it in the job payload. Uploads bigger than BLOB_INLINE_MAX are
+copied in chunks to a blob, in redis or in BLOB_DIR (a volume shared by the
+queue api and the workers), and the job only keeps a reference to it.
+
+Each blob has a reference count, released when a job using it succeeds,
+and a TTL, so blobs of jobs that never finish are removed as well.
+"""
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from job_schema import BLOB_CHUNK_SIZE, BLOB_INLINE_MAX, BLOB_TTL, UPLOAD_KEY
+from job_schema import blob_data_key as _data_key
+from job_schema import blob_refs_key as _refs_key
+from job_schema import blob_ref, inline_ref
+from logger import logger
+
+BLOB_STORE = os.environ.get("BLOB_STORE", "redis")
+BLOB_DIR = os.environ.get("BLOB_DIR", "/blobs")
+BLOB_SPOOL_MAX = 4 * 1024 * 1024
+
+
+def is_upload(data):
+    return isinstance(data, dict) and data.get(UPLOAD_KEY, False)
+
+
+def _chunks(fileobj):
+    chunk = fileobj.read(BLOB_CHUNK_SIZE)
+    while chunk:
+        yield chunk
+        chunk = fileobj.read(BLOB_CHUNK_SIZE)
+
+
+def _sweep_disk(ttl):
+    """remove disk blobs older than ttl, their jobs are gone."""
+    deadline = time.time() - ttl
+    for entry in os.scandir(BLOB_DIR):
+        if entry.is_file() and entry.stat().st_mtime < deadline:
+            os.remove(entry.path)
+
+
+def pack_upload(conn, fileobj, filename, ttl=None):
+    """reference to an uploaded file to be used as job data."""
+    ttl = ttl or BLOB_TTL
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    if size <= BLOB_INLINE_MAX:
+        return inline_ref(filename, fileobj.read())
+    blob_id = str(uuid.uuid4())
+    if BLOB_STORE == "disk":
+        _sweep_disk(ttl)
+        with open(os.path.join(BLOB_DIR, blob_id), "wb") as blob:
+            shutil.copyfileobj(fileobj, blob, BLOB_CHUNK_SIZE)
+    else:
+        for chunk in _chunks(fileobj):
+            conn.append(_data_key(blob_id), chunk)
+        conn.expire(_data_key(blob_id), ttl)
+    conn.set(_refs_key(blob_id), 1, ex=ttl)
+    logger.debug(f"upload {filename} stored in blob {blob_id} ({size} bytes)")
+    return blob_ref(filename, blob_id, BLOB_STORE, size)
+
+
+def retain(conn, ref):
+    """add a reference to a blob, for jobs sharing the same upload."""
+    if ref.get("blob"):
+        conn.incr(_refs_key(ref["blob"]))
+
+
+def release(conn, ref):
+    """drop a reference to a blob, the blob is removed with the last one."""
+    if not ref.get("blob"):
+        return
+    if conn.decr(_refs_key(ref["blob"])) <= 0:
+        conn.delete(_refs_key(ref["blob"]), _data_key(ref["blob"]))
+        if ref["store"] == "disk":
+            try:
+                os.remove(os.path.join(BLOB_DIR, ref["blob"]))
+            except FileNotFoundError:
+                pass
+
+
+def open_upload(conn, ref):
+    """file object with the content of an upload reference."""
+    if "content" in ref:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=BLOB_SPOOL_MAX)
+        fileobj.write(ref["content"])
+    elif ref["store"] == "disk":
+        return open(os.path.join(BLOB_DIR, ref["blob"]), "rb")
+    else:
+        fileobj = tempfile.SpooledTemporaryFile(max_size=BLOB_SPOOL_MAX)
+        for offset in range(0, ref["size"], BLOB_CHUNK_SIZE):
+            fileobj.write(conn.getrange(_data_key(ref["blob"]), offset, offset + BLOB_CHUNK_SIZE - 1))
+        if fileobj.tell() != ref["size"]:
+            raise FileNotFoundError(f"blob {ref['blob']} expired or incomplete")
+    fileobj.seek(0)
+    return fileobj
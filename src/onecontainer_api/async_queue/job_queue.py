@@ -2,6 +2,7 @@
 #  Copyright (c) 2020 Intel Corporation
 """queue implementation."""
 import os
+from contextlib import ExitStack
 from types import SimpleNamespace as SN
 
 from starlette.datastructures import UploadFile
@@ -12,6 +13,8 @@ from rq import Queue
 from rq.job import Job
 from rq.job import Retry
 
+import blob_store
+from job_schema import JOB_RESULT_TTL, JOB_RETRIES, job_kwargs
 from logger import logger
 
 
@@ -32,6 +35,10 @@ def fetch_job(job_id):
     return resp
 
 
+def _is_upload_list(data, is_upload):
+    return isinstance(data, list) and bool(data) and all(is_upload(x) for x in data)
+
+
 def worker(**kwargs):
     """post job to queue, all drivers behind url and port."""
     logger.debug("kwargs passed to worker: {}".format(kwargs))
@@ -44,28 +51,36 @@ def worker(**kwargs):
     data = kwargs.pop("data")
     if kwargs["method"] == "get":
         kwargs["params"] = data
+    elif blob_store.is_upload(data) or _is_upload_list(data, blob_store.is_upload):
+        uploads = data if isinstance(data, list) else [data]
+        with ExitStack() as stack:
+            kwargs["files"] = [
+                ('img', (upload["filename"], stack.enter_context(blob_store.open_upload(CONN, upload))))
+                for upload in uploads
+            ]
+            resp = requests.request(**kwargs).json()
+        for upload in uploads:
+            blob_store.release(CONN, upload)
+        return resp
     else:
-        if isinstance(data, UploadFile):
-            kwargs["files"] = {'img': (data.filename, data.file.read())}
-        else:
-            kwargs["json"] = data
+        kwargs["json"] = data
     return requests.request(**kwargs).json()
 
 
 def enqueue_job(item):
     """add job to queue."""
     logger.debug("job enqueued with worker req type: {}".format(item.req_type))
+    data = item.data
+    if isinstance(data, UploadFile):
+        data = blob_store.pack_upload(CONN, data.file, data.filename, item.ttl)
+    elif _is_upload_list(data, lambda x: isinstance(x, UploadFile)):
+        data = [blob_store.pack_upload(CONN, x.file, x.filename, item.ttl) for x in data]
     sq = Queue(item.name, connection=CONN)
     job = sq.enqueue(
         worker,
-        kwargs={
-            "data": item.data,
-            "method": item.req_type,
-            "url": item.url,
-            "headers": item.headers,
-        },
-        result_ttl=item.ttl if item.ttl else 18600,  # a day
-        retry=Retry(max=3),
+        kwargs=job_kwargs(item.req_type, item.url, item.headers, data),
+        result_ttl=item.ttl if item.ttl else JOB_RESULT_TTL,
+        retry=Retry(max=JOB_RETRIES),
     )
     return {
         "id": job.get_id(),
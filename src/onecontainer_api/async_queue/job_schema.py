@@ -0,0 +1,43 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""redis layout of queued jobs and of their uploads.
+
+Jobs are enqueued by job_queue and, straight to redis, by the gateway
+(onecontainer_api/jobs.py), both take the names, defaults and upload
+references from here. Stdlib only, the gateway imports it as
+onecontainer_api.async_queue.job_schema.
+"""
+import os
+
+# rq job of job_queue.worker with the driver call as kwargs
+WORKER_FUNC = "job_queue.worker"
+JOB_RETRIES = 3
+JOB_RESULT_TTL = 18600
+JOB_TIMEOUT = 180
+
+BLOB_INLINE_MAX = int(os.environ.get("BLOB_INLINE_MAX", 256 * 1024))
+BLOB_CHUNK_SIZE = 1024 * 1024
+BLOB_TTL = 18600
+UPLOAD_KEY = "__upload__"
+
+
+def job_kwargs(method, url, headers, data):
+    return {"data": data, "method": method, "url": url, "headers": headers}
+
+
+def blob_data_key(blob_id):
+    return f"oca:blob:{blob_id}"
+
+
+def blob_refs_key(blob_id):
+    return f"oca:blob:{blob_id}:refs"
+
+
+def inline_ref(filename, content):
+    """reference to an upload small enough to be kept in the job."""
+    return {UPLOAD_KEY: True, "filename": filename, "content": content}
+
+
+def blob_ref(filename, blob_id, store, size):
+    """reference to an upload stored in a blob."""
+    return {UPLOAD_KEY: True, "filename": filename, "blob": blob_id, "store": store, "size": size}
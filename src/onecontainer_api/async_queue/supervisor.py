@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""worker supervisor, scales the worker containers of each queue.
+
+Every SUPERVISOR_INTERVAL seconds the depth, the running jobs and the wait
+of the oldest job of every RQ queue are read, and the worker containers of
+the queue are scaled between its min and max:
+
+- one worker per WORKER_JOBS_PER_WORKER queued or running jobs,
+- one more when the oldest job waited more than WORKER_MAX_WAIT seconds,
+- down to min (0 by default) once the queue had no job for
+  WORKER_IDLE_TIMEOUT seconds.
+
+Only idle workers are removed, busy ones are stopped in a later round
+once their job is done. Workers are stopped with a SIGTERM, they finish
+the jobs they hold and exit while the supervisor goes on scaling, the ones
+still running after WORKER_STOP_TIMEOUT seconds are killed. Limits of a queue can be set with WORKER_LIMITS,
+a JSON {"queue": {"min": 1, "max": 8}}.
+
+    python supervisor.py
+"""
+import datetime
+import json
+import math
+import os
+import time
+import uuid
+
+import docker
+from rq import Queue, Worker
+from rq.job import Job
+
+from job_queue import CONN, REDIS_HOST, REDIS_PORT
+from logger import logger
+
+SUPERVISOR_INTERVAL = float(os.environ.get("SUPERVISOR_INTERVAL", 1))
+WORKER_IMAGE = os.environ.get("WORKER_IMAGE", "oca_worker")
+WORKER_NETWORK = os.environ.get("WORKER_NETWORK", "oca_network")
+# asyncio workers run many jobs each, a stock rq worker is
+# "rq worker --url redis://{host}:{port} --name {name} {queue}"
+WORKER_COMMAND = os.environ.get(
+    "WORKER_COMMAND", "python async_worker.py --url redis://{host}:{port} --name {name} {queue}")
+WORKER_MIN = int(os.environ.get("WORKER_MIN", 0))
+WORKER_MAX = int(os.environ.get("WORKER_MAX", 4))
+WORKER_JOBS_PER_WORKER = int(os.environ.get("WORKER_JOBS_PER_WORKER", 200))
+WORKER_MAX_WAIT = float(os.environ.get("WORKER_MAX_WAIT", 2))
+WORKER_IDLE_TIMEOUT = float(os.environ.get("WORKER_IDLE_TIMEOUT", 60))
+WORKER_STOP_TIMEOUT = int(os.environ.get("WORKER_STOP_TIMEOUT", 300))
+WORKER_LIMITS = json.loads(os.environ.get("WORKER_LIMITS", "{}"))
+
+LABEL = "oca_worker_queue"
+
+
+def _wait(queue):
+    """seconds the oldest queued job of a queue has been waiting."""
+    job_ids = queue.get_job_ids(0, 1)
+    if not job_ids:
+        return 0.0
+    try:
+        enqueued_at = Job.fetch(job_ids[0], connection=CONN).enqueued_at
+    except Exception:
+        return 0.0
+    if enqueued_at is None:
+        return 0.0
+    if enqueued_at.tzinfo is None:
+        now = datetime.datetime.utcnow()
+    else:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    return max((now - enqueued_at).total_seconds(), 0.0)
+
+
+def queue_stats(queue):
+    return {
+        "queued": len(queue),
+        "started": queue.started_job_registry.count,
+        "wait": _wait(queue),
+    }
+
+
+def limits(name):
+    queue_limits = WORKER_LIMITS.get(name, {})
+    return int(queue_limits.get("min", WORKER_MIN)), int(queue_limits.get("max", WORKER_MAX))
+
+
+def desired_workers(stats, current, idle_for, low, high):
+    """worker count of a queue for its stats, current workers and seconds without jobs."""
+    jobs = stats["queued"] + stats["started"]
+    if not jobs:
+        return low if idle_for >= WORKER_IDLE_TIMEOUT else min(max(current, low), high)
+    desired = math.ceil(jobs / WORKER_JOBS_PER_WORKER)
+    if stats["wait"] > WORKER_MAX_WAIT:
+        desired = max(desired, current + 1)
+    # only scale down when the queue is drained, busy workers keep their jobs
+    if stats["queued"]:
+        desired = max(desired, current)
+    return min(max(desired, low, 1), high)
+
+
+class Supervisor:
+
+    def __init__(self):
+        self.docker = docker.from_env()
+        self.last_job = {}
+        # name: deadline of the workers sent a SIGTERM
+        self.stopping = {}
+
+    def containers(self, queue_name):
+        """running worker containers of a queue, exited ones are removed.
+
+        Stopping workers are left out, they are killed once past their deadline.
+        """
+        running = []
+        now = time.monotonic()
+        for container in self.docker.containers.list(all=True, filters={"label": f"{LABEL}={queue_name}"}):
+            if container.status not in ("running", "created", "restarting"):
+                logger.debug(f"Removing exited worker {container.name}")
+                container.remove(force=True)
+                self.stopping.pop(container.name, None)
+            elif container.name in self.stopping:
+                if now > self.stopping[container.name]:
+                    logger.debug(f"Killing worker {container.name}, still running after {WORKER_STOP_TIMEOUT}s")
+                    container.kill()
+            else:
+                running.append(container)
+        return running
+
+    def start_worker(self, queue_name):
+        name = f"oca_worker_{queue_name}_{uuid.uuid4().hex[:8]}"
+        logger.debug(f"Starting worker {name}")
+        command = WORKER_COMMAND.format(host=REDIS_HOST, port=REDIS_PORT, name=name, queue=queue_name)
+        self.docker.containers.run(WORKER_IMAGE, command=command, name=name, detach=True,
+                                   network=WORKER_NETWORK, working_dir="/workspace",
+                                   labels={LABEL: queue_name})
+
+    def stop_workers(self, queue, containers, count):
+        """stop up to count idle workers of a queue, busy ones are left to a later round."""
+        busy = {worker.name for worker in Worker.all(connection=CONN, queue=queue)
+                if worker.get_state() == "busy"}
+        for container in [container for container in containers if container.name not in busy][:count]:
+            logger.debug(f"Stopping worker {container.name}")
+            # a worker taking a job meanwhile finishes it on SIGTERM, the
+            # container is removed by containers once it exited
+            try:
+                container.kill(signal="SIGTERM")
+            except docker.errors.APIError as exc:
+                # exited meanwhile
+                logger.debug(f"Can't stop worker {container.name}: {exc}")
+                continue
+            self.stopping[container.name] = time.monotonic() + WORKER_STOP_TIMEOUT
+
+    def scale(self, queue):
+        stats = queue_stats(queue)
+        now = time.monotonic()
+        if stats["queued"] or stats["started"] or queue.name not in self.last_job:
+            self.last_job[queue.name] = now
+        containers = self.containers(queue.name)
+        low, high = limits(queue.name)
+        desired = desired_workers(stats, len(containers), now - self.last_job[queue.name], low, high)
+        if desired > len(containers):
+            logger.debug(f"Scaling queue {queue.name} up to {desired} workers: {stats}")
+            for _ in range(desired - len(containers)):
+                self.start_worker(queue.name)
+        elif desired < len(containers):
+            logger.debug(f"Scaling queue {queue.name} down to {desired} workers: {stats}")
+            self.stop_workers(queue, containers, len(containers) - desired)
+
+    def run(self):
+        logger.debug(f"Supervising queue workers every {SUPERVISOR_INTERVAL}s")
+        while True:
+            for queue in Queue.all(connection=CONN):
+                try:
+                    self.scale(queue)
+                except Exception as exc:
+                    logger.error(f"Can't scale queue {queue.name}: {exc}")
+            time.sleep(SUPERVISOR_INTERVAL)
+
+
+if __name__ == "__main__":
+    Supervisor().run()
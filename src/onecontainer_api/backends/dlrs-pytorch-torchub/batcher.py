@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""dynamic batching of concurrent predict requests."""
+import asyncio
+
+import torch
+
+from logger import logger
+from model_hub import ModelRunner
+
+
+class DynamicBatcher:
+    """Group concurrent predictions into batched forward passes.
+
+    Requests wait at most max_delay seconds for others to join them, a batch
+    runs as soon as max_batch images are collected. While a batch runs,
+    new requests pile up in the queue and are collected by the next one,
+    so batches grow with the load. Images are grouped by model, in case the
+    served model changes between requests.
+    """
+
+    def __init__(self, max_batch: int = 16, max_delay: float = 0.005, executor=None,
+                 prepare=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.executor = executor
+        self.prepare = prepare
+        self.queue = None
+        self.task = None
+
+    async def submit(self, model, t_image):
+        """predict the class of a (1, C, H, W) image tensor.
+
+        prepare, if given, is applied to the stacked batch before the
+        forward pass, e.g. to normalize uint8 images.
+        """
+        loop = asyncio.get_event_loop()
+        if self.task is None:
+            self.queue = asyncio.Queue()
+            self.task = loop.create_task(self._run_forever())
+        future = loop.create_future()
+        await self.queue.put((model, t_image, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_event_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(items) < self.max_batch:
+            if not self.queue.empty():
+                items.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run_forever(self):
+        while True:
+            items = await self._collect()
+            groups = {}
+            for item in items:
+                groups.setdefault(id(item[0]), []).append(item)
+            for group in groups.values():
+                await self._run(group)
+
+    def _predict(self, model, t_images):
+        batch = torch.cat(t_images)
+        if self.prepare is not None:
+            batch = self.prepare(batch)
+        return ModelRunner(model, batch).predict_batch()
+
+    async def _run(self, group):
+        model = group[0][0]
+        futures = [future for _, _, future in group]
+        logger.debug(f"running batch of {len(group)} images")
+        t_images = [t_image for _, t_image, _ in group]
+        try:
+            results = await asyncio.get_event_loop().run_in_executor(
+                self.executor, self._predict, model, t_images
+            )
+        except Exception as exc:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
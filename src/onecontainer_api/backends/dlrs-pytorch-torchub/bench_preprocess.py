@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""compare per request transforms with the cached uint8 preprocessing.
+
+    python bench_preprocess.py [--images 256] [--batch 16]
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from preprocess import get_preprocessor
+
+
+def make_images(count, size=(1280, 960)):
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels).save(buf, format="JPEG")
+        images.append(buf.getvalue())
+    return images
+
+
+def per_request(images, batch):
+    """previous path, a Compose built and a float tensor normalized per image."""
+    for start in range(0, len(images), batch):
+        t_images = []
+        for img_bytes in images[start:start + batch]:
+            preprocess = transforms.Compose([
+                transforms.Resize(256),
+                transforms.CenterCrop(224),
+                transforms.ToTensor(),
+                transforms.Normalize(mean=[0.485, 0.486, 0.406], std=[0.229, 0.224, 0.225]),
+            ])
+            t_images.append(preprocess(Image.open(io.BytesIO(img_bytes))).unsqueeze(0))
+        torch.cat(t_images)
+
+
+def cached(images, batch):
+    """uint8 per image, one normalization per batch."""
+    preprocessor = get_preprocessor()
+    for start in range(0, len(images), batch):
+        t_images = [preprocessor.to_uint8(img_bytes) for img_bytes in images[start:start + batch]]
+        preprocessor.normalize(torch.cat(t_images))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=16)
+    args = parser.parse_args()
+    torch.set_num_threads(1)
+    images = make_images(args.images)
+    for name, run in (("per request", per_request), ("cached", cached)):
+        run(images[:args.batch], args.batch)
+        start = time.perf_counter()
+        run(images, args.batch)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12}: {len(images) / elapsed:8.1f} images/s")
+
+
+if __name__ == "__main__":
+    main()
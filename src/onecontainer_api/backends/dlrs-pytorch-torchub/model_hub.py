@@ -1,16 +1,21 @@
 # SPDX-License-Identifier: BSD-3-Clause
 #  Copyright (c) 2020 Intel Corporation
 """tochhub model backend for dlrs."""
+import functools
+import itertools
 import json
 import os
+import threading
+from collections import OrderedDict
 
 from PIL import Image
 import psutil
 import torch
-from torchvision import transforms
-from torchvision.transforms.transforms import CenterCrop
 
 from logger import logger
+from preprocess import get_preprocessor
+from preprocess import IMAGENET_MEAN
+from preprocess import IMAGENET_STD
 from utils import is_model_cached
 
 
@@ -30,6 +35,14 @@ class InitServer:
         os.environ["inter_op_parallelism_threads"] = self.inter_op
         os.environ["intra_op_parallelism_threads"] = self.intra_op
 
+    def set_threads(self):
+        """apply intra/inter op threads to torch, it can only be done once per process."""
+        torch.set_num_threads(int(self.intra_op))
+        try:
+            torch.set_num_interop_threads(int(self.inter_op))
+        except RuntimeError as e:
+            logger.error(e)
+
 
 class ModelLoader:
     """load a model given metadata from torchub."""
@@ -37,6 +50,7 @@ class ModelLoader:
     def __init__(self, model_meta: dict = None):
         InitServer().set_vars()
         self.loaded = False
+        self.error = None
 
     def init_model(self, model_meta: dict):
         try:
@@ -51,6 +65,7 @@ class ModelLoader:
                 self.loaded = True
         except TypeError as e:
             logger.error(e)
+            self.error = f"invalid model params: {e}"
 
     def load_model(self):
         """load model artifacts from model_hub."""
@@ -60,14 +75,109 @@ class ModelLoader:
             self.loaded = True
         except AttributeError as e:
             logger.error(e)
+            self.error = f"model not found: {e}"
         except FileNotFoundError as e:
             logger.error(e)
+            self.error = f"model path not found: {e}"
         except RuntimeError as e:
             logger.error(e)
             raise RuntimeError
         return True
 
 
+def model_nbytes(model):
+    """memory used by the parameters and buffers of a model."""
+    tensors = itertools.chain(model.parameters(), model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry:
+    """Loaded models keyed by (path, name, kwargs).
+
+    Several models stay resident, once their memory goes over max_bytes the
+    least recently used ones are evicted. The last served model is the
+    default one for predictions that don't name a model.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.loading = set()
+        self.errors = {}
+        self.default = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_meta: dict):
+        kwargs = dict(model_meta.get("kwargs") or {})
+        kwargs.setdefault("pretrained", True)
+        return model_meta["path"], model_meta["name"], json.dumps(kwargs, sort_keys=True)
+
+    def is_loaded(self, key):
+        return key in self.models
+
+    def is_loading(self, key):
+        return key in self.loading
+
+    def pop_error(self, key):
+        """reason the last load of a model failed, None if it didn't."""
+        with self._lock:
+            return self.errors.pop(key, None)
+
+    def set_default(self, key):
+        with self._lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.default = key
+
+    def load(self, model_meta: dict):
+        """load a model from torchub, blocks so it runs in an executor."""
+        key = self.key(model_meta)
+        with self._lock:
+            if key in self.models or key in self.loading:
+                return True
+            self.loading.add(key)
+        try:
+            loader = ModelLoader()
+            loader.init_model(dict(model_meta, kwargs=json.loads(key[2])))
+            if not loader.loaded:
+                loader.load_model()
+        finally:
+            with self._lock:
+                self.loading.discard(key)
+        if not loader.loaded:
+            with self._lock:
+                self.errors[key] = loader.error or "model not loaded"
+            return False
+        loader.nbytes = model_nbytes(loader.model)
+        with self._lock:
+            self.errors.pop(key, None)
+            self.models[key] = loader
+            self.default = key
+            self._evict()
+        logger.debug(f"model {key[1]} loaded, {loader.nbytes} bytes")
+        return True
+
+    def _evict(self):
+        while len(self.models) > 1 and sum(m.nbytes for m in self.models.values()) > self.max_bytes:
+            key, _ = self.models.popitem(last=False)
+            logger.debug(f"model {key[1]} evicted")
+
+    def get(self, name: str = None):
+        """resident model by name, or the default one, None if not loaded."""
+        with self._lock:
+            if not self.models:
+                return None
+            if name is None:
+                key = self.default if self.default in self.models else next(reversed(self.models))
+            else:
+                key = next((k for k in reversed(self.models) if k[1] == name), None)
+                if key is None:
+                    return None
+            self.models.move_to_end(key)
+            return self.models[key].model
+
+
 class ImageProcessor:
     """transorform image to tensor."""
 
@@ -76,23 +186,41 @@ class ImageProcessor:
 
     def transform(self, size=None, crop=None, mean=None, std=None):
         # todo: load preprocess based on self.model_name
-        self.preprocess = transforms.Compose(
-            [
-                transforms.Resize(size if size else 256),
-                transforms.CenterCrop(crop if crop else 224),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=mean if mean else [0.485, 0.486, 0.406],
-                    std=std if std else [0.229, 0.224, 0.225],
-                ),
-            ]
+        self.preprocess = get_preprocessor(
+            size if size else 256,
+            crop if crop else 224,
+            tuple(mean) if mean else IMAGENET_MEAN,
+            tuple(std) if std else IMAGENET_STD,
         )
-        self.t_image = self.preprocess(self.image).unsqueeze(0)
+        self.t_image = self.preprocess([self.image])
         return self.t_image
 
 
+def preprocess_image(img_bytes: bytes):
+    """image file content to a (1, C, H, W) uint8 tensor, runs in the preprocess pool.
+
+    Normalization is left to normalize_batch, once images are batched.
+    """
+    return get_preprocessor().to_uint8(img_bytes)
+
+
+def normalize_batch(batch):
+    """normalize a batch of preprocess_image outputs."""
+    return get_preprocessor().normalize(batch)
+
+
+@functools.lru_cache(maxsize=None)
+def load_class_idx(path: str = "./data/imagenet_class_index.json"):
+    """class index of the model outputs, read once per path."""
+    with open(path) as class_idx_file:
+        return json.load(class_idx_file)
+
+
 class ModelRunner:
-    """Run model using LoadedModel and ImageProcessor."""
+    """Run model using LoadedModel and ImageProcessor.
+
+    t_image may hold a batch of images stacked on the first dimension.
+    """
 
     def __init__(self, model, t_image):
         self.model = model
@@ -106,13 +234,15 @@ class ModelRunner:
             _, pred = output.max(1)
             return pred
 
+    def predict_batch(self):
+        """get class of each object in the batch."""
+        # todo: use class_idx based on model
+        class_idx = load_class_idx()
+        return [class_idx[str(idx)][1] for idx in self.run().tolist()]
+
     def predict(self):
         """get class of object."""
-        # todo: use class_idx based on model
-        class_idx = json.load(open("./data/imagenet_class_index.json"))
-        prediction = self.run()
-        prediction_idx = str(prediction.item())
-        return class_idx[prediction_idx][1]
+        return self.predict_batch()[0]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""bounded worker pools to keep cpu work off the sanic event loop."""
+import asyncio
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Saturated(Exception):
+    """more requests in flight than the pool accepts."""
+
+
+class BoundedPool:
+    """Executor with a bound on the requests in flight.
+
+    Requests enter with admit, which fails fast with Saturated once
+    max_pending requests are being served, instead of letting a queue of
+    work grow in front of the executor. A process pool is started with
+    spawn, forking a process that already runs torch threads can deadlock.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, processes: bool = False):
+        if processes:
+            self.executor = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers)
+        self.max_pending = max_pending
+        self.pending = 0
+
+    @contextlib.contextmanager
+    def admit(self, count: int = 1):
+        if self.pending + count > self.max_pending:
+            raise Saturated(f"{self.pending} requests in flight")
+        self.pending += count
+        try:
+            yield
+        finally:
+            self.pending -= count
+
+    def chunks(self, items: list):
+        """items split in chunks admit can take, a request with more than
+        max_pending items would never be admitted at once."""
+        return [items[start:start + self.max_pending] for start in range(0, len(items), self.max_pending)]
+
+    async def run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
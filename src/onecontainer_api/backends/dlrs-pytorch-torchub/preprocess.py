@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""image preprocessing, decode to uint8 per image and normalize per batch."""
+import functools
+import io
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class Preprocessor:
+    """Resize, crop and normalize images for a model input.
+
+    to_uint8 decodes one image and applies the geometric transforms, JPEGs
+    are decoded at the smallest scale still larger than size. Its
+    output stays uint8, 4 times smaller than float to move between
+    processes and to stack in batches. normalize converts a whole batch to
+    float and normalizes it with two vectorized ops.
+    """
+
+    def __init__(self, size=256, crop=224, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.size = size
+        self.geometry = transforms.Compose(
+            [transforms.Resize(size), transforms.CenterCrop(crop)]
+        )
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1) * 255
+        self.std = torch.tensor(std).view(1, -1, 1, 1) * 255
+
+    def to_uint8(self, image):
+        """PIL image or image file content to a (1, C, H, W) uint8 tensor."""
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+        # let the jpeg decoder downscale, keeping both sides >= size
+        image.draft("RGB", (self.size, self.size))
+        image = self.geometry(image.convert("RGB"))
+        array = np.array(image)
+        return torch.from_numpy(array).permute(2, 0, 1).unsqueeze(0)
+
+    def normalize(self, batch):
+        """(N, C, H, W) uint8 tensor to a normalized float tensor."""
+        return batch.float().sub_(self.mean).div_(self.std)
+
+    def __call__(self, images):
+        return self.normalize(torch.cat([self.to_uint8(image) for image in images]))
+
+
+@functools.lru_cache(maxsize=32)
+def get_preprocessor(size=256, crop=224, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+    """preprocessor for a (size, crop, mean, std) config, built once."""
+    return Preprocessor(size, crop, tuple(mean), tuple(std))
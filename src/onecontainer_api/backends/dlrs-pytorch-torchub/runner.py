@@ -1,20 +1,47 @@
 # SPDX-License-Identifier: BSD-3-Clause
 #  Copyright (c) 2020 Intel Corporation
 """REST inteface to model_runner."""
-import io
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from logging import exception
 
 import sanic
 from sanic import response
 
+from batcher import DynamicBatcher
 from logger import logger
-from model_hub import ModelLoader
-from model_hub import ImageProcessor
-from model_hub import ModelRunner
+from model_hub import InitServer
+from model_hub import ModelRegistry
+from model_hub import normalize_batch
+from model_hub import preprocess_image
+from utils import is_model_cached
+from pool import BoundedPool
+from pool import Saturated
 
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 16))
+BATCH_MAX_DELAY = float(os.environ.get("BATCH_MAX_DELAY_MS", 5)) / 1000
+# images in flight (decoding, waiting for a batch or running), more get a 429
+INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", 64))
+# "thread" or "process", processes avoid the GIL for PIL decoding and resizing
+PREPROCESS_POOL = os.environ.get("PREPROCESS_POOL", "thread")
+# memory for resident models, least recently used ones are evicted beyond it
+MODEL_MEMORY_BUDGET = int(os.environ.get("MODEL_MEMORY_BUDGET_MB", 4096)) * 1024 * 1024
 
 app = sanic.Sanic("dlrs-torchub")
-model_loader = ModelLoader()
+registry = ModelRegistry(MODEL_MEMORY_BUDGET)
+init_server = InitServer()
+init_server.set_threads()
+# forward passes run in inter_op threads, each using intra_op torch threads
+inference_executor = ThreadPoolExecutor(int(init_server.inter_op))
+preprocess_pool = BoundedPool(
+    int(init_server.intra_op), INFERENCE_MAX_PENDING, processes=PREPROCESS_POOL == "process"
+)
+batcher = DynamicBatcher(
+    BATCH_MAX_SIZE, BATCH_MAX_DELAY, executor=inference_executor, prepare=normalize_batch
+)
+
+BUSY_RESPONSE = {"status": "failed", "result": "server busy, retry later"}
 
 
 @app.route("/")
@@ -23,7 +50,7 @@ async def index(request):
     return response.json(
         {
             "info": "torch hub server on dlrs",
-            "urls": ["/", "/ping", "/serve", "/predict"],
+            "urls": ["/", "/ping", "/serve", "/predict", "/predict_batch"],
         }
     )
 
@@ -37,50 +64,94 @@ async def ping(request):
 @app.route("/serve", methods=["POST"])
 async def load_model(request):
     """load model using process pool."""
-    global model_loader
     req = request.json
     if req is None:
         return response.json(
             {"status": "fail", "result": "model param json not provided"}
         )
-    if req.get("path", None) and req.get("name", None):
-        if not model_loader:
-            model_loader = ModelLoader()
-        model_loader.init_model(req)
-        if model_loader.loaded:
-            return response.json(
-                {"status": "ok", "result": f"model {req['name']} loaded"}
-            )
-        try:
-            request.app.loop.run_in_executor(None, model_loader.load_model)
-        except RuntimeError:
-            return response.json(
-                {"status": "fail", "result": "model or path not retievable"}
-            )
-        return response.json(
-            {"status": "ok", "result": f"model {req['name']} loading in progress"}
-        )
-    else:
-        model_loader = None
+    if not (req.get("path", None) and req.get("name", None)):
         raise sanic.exceptions.SanicException(
             "model_path/model_name not given", status_code=401
         )
+    key = registry.key(req)
+    if registry.is_loaded(key):
+        registry.set_default(key)
+        return response.json({"status": "ok", "result": f"model {req['name']} loaded"})
+    if not registry.is_loading(key):
+        # a load that failed in the background is reported once, then retried
+        error = registry.pop_error(key)
+        if error:
+            return response.json({"status": "fail", "result": error}, status=400)
+        loading = request.app.loop.run_in_executor(None, registry.load, req)
+        if is_model_cached(req["path"], req["name"]):
+            try:
+                loaded = await loading
+            except RuntimeError:
+                return response.json(
+                    {"status": "fail", "result": "model or path not retievable"}
+                )
+            if not loaded:
+                return response.json(
+                    {"status": "fail", "result": registry.pop_error(key)}, status=400
+                )
+            return response.json({"status": "ok", "result": f"model {req['name']} loaded"})
+    return response.json(
+        {"status": "ok", "result": f"model {req['name']} loading in progress"}
+    )
+
+
+def _loaded_model(request):
+    """model named by the `model` query arg, or the last one served."""
+    model = registry.get(request.args.get("model"))
+    if model is None:
+        return None, response.json(
+            {"status": "failed", "result": "model not initiated, use serve model API"}
+        )
+    return model, None
 
 
 @app.route("/predict", methods=["POST"])
 async def predict(request):
     """return output of the model."""
     img_str = request.files["img"]
-    image = io.BytesIO(img_str[0].body)
-    img_processor = ImageProcessor(image)
-    img_tensor = img_processor.transform()
+    model, error = _loaded_model(request)
+    if error:
+        return error
     try:
-        model_runner = ModelRunner(model_loader.model, img_tensor)
-    except AttributeError:
-        return response.json(
-            {"status": "failed", "result": "model not initiated, use serve model API"}
-        )
-    return response.json({"status": "ok", "result": model_runner.predict()})
+        with preprocess_pool.admit():
+            img_tensor = await preprocess_pool.run(preprocess_image, img_str[0].body)
+            result = await batcher.submit(model, img_tensor)
+    except Saturated:
+        return response.json(BUSY_RESPONSE, status=429)
+    return response.json({"status": "ok", "result": result})
+
+
+@app.route("/predict_batch", methods=["POST"])
+async def predict_batch(request):
+    """return output of the model for every image sent with key `img`."""
+    model, error = _loaded_model(request)
+    if error:
+        return error
+    imgs = request.files.get("img", [])
+    results = []
+    try:
+        for chunk in preprocess_pool.chunks(imgs):
+            with preprocess_pool.admit(len(chunk)):
+                img_tensors = await asyncio.gather(
+                    *[preprocess_pool.run(preprocess_image, img.body) for img in chunk]
+                )
+                results.extend(await asyncio.gather(
+                    *[batcher.submit(model, t_image) for t_image in img_tensors]
+                ))
+    except Saturated:
+        return response.json(BUSY_RESPONSE, status=429)
+    return response.json({"status": "ok", "result": results})
+
+
+@app.listener("after_server_stop")
+async def stop_pools(app, loop):
+    preprocess_pool.shutdown()
+    inference_executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
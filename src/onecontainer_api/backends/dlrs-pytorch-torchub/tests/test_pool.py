@@ -0,0 +1,41 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pool import BoundedPool, Saturated  # noqa: E402
+
+
+class TestBoundedPool():
+
+    def setup_method(self):
+        self.pool = BoundedPool(1, 4)
+
+    def teardown_method(self):
+        self.pool.shutdown()
+
+    def test_admit_bound(self):
+        with self.pool.admit(3):
+            with pytest.raises(Saturated):
+                with self.pool.admit(2):
+                    pass
+            with self.pool.admit(1):
+                assert self.pool.pending == 4
+        assert self.pool.pending == 0
+
+    def test_batch_bigger_than_max_pending(self):
+        imgs = list(range(10))
+        with pytest.raises(Saturated):
+            with self.pool.admit(len(imgs)):
+                pass
+        admitted = []
+        for chunk in self.pool.chunks(imgs):
+            with self.pool.admit(len(chunk)):
+                admitted.extend(chunk)
+        assert admitted == imgs
+        assert [len(chunk) for chunk in self.pool.chunks(imgs)] == [4, 4, 2]
+        assert self.pool.chunks([]) == []
@@ -64,16 +64,19 @@ def save_model_files(model, path, file_name):
         logger.error("failed to save model files: {}".format(e))
 
 
+# built once, transforms are stateless and shared by every request
+TRANSFORM = transforms.Compose(
+    [
+        transforms.Resize(224),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ]
+)
+
+
 def preprocess_img(img):
     try:
         img = Image.open(img)
     except AttributeError:
         pass
-    transform = transforms.Compose(
-        [
-            transforms.Resize(224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-        ]
-    )
-    return transform(img).unsqueeze(0)
+    return TRANSFORM(img).unsqueeze(0)
@@ -0,0 +1,315 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""in-memory caches for the gateway hot paths."""
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, List, Optional
+
+from pydantic import BaseModel
+from starlette.datastructures import UploadFile
+from starlette.responses import Response
+
+from onecontainer_api import config
+from onecontainer_api.logger import logger
+
+
+class LRUCache:
+    """Bounded in-memory cache with LRU eviction and per entry TTL
+
+    Entries live in the process, so with several uvicorn workers each one
+    keeps its own copy, writes must call delete on the keys they change and
+    ttl bounds the staleness between workers.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None,
+                 maxbytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+            self.delete(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """store a value, values bigger than maxbytes are not stored."""
+        size = self.sizeof(value) if self.maxbytes else 0
+        self.delete(key)
+        if self.maxbytes and size > self.maxbytes:
+            return False
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._data[key] = (value, expires_at, size)
+        self.nbytes += size
+        while len(self._data) > self.maxsize or (self.maxbytes and self.nbytes > self.maxbytes):
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.nbytes -= evicted_size
+            self.evictions += 1
+        return True
+
+    def delete(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        self.nbytes -= entry[2]
+        return True
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.nbytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
+
+
+def _utf8_size(value: str) -> int:
+    return len(value.encode())
+
+
+class MemoryBackend:
+    """response cache storage in the gateway process, bounded by entries and bytes
+
+    Tags come from request paths, at most maxtags generations are kept.
+    Generations are drawn from one counter and untracked tags share the
+    floor generation, raised past every generation given out when a tag is
+    evicted, so an evicted tag never gets back an older generation and
+    only costs misses of the entries with untracked tags.
+    """
+
+    def __init__(self, maxsize: int, maxbytes: int, maxtags: Optional[int] = None):
+        # bodies are str, maxbytes counts their utf-8 bytes
+        self.entries = LRUCache(maxsize, maxbytes=maxbytes, sizeof=_utf8_size)
+        self.maxtags = maxtags or 4 * maxsize
+        self.tags = OrderedDict()
+        self.floor = 0
+        self._generation = itertools.count(1)
+
+    async def get(self, key: str):
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: str, ttl: float):
+        self.entries.set(key, value, ttl)
+
+    async def generations(self, tags: List[str]):
+        generations = []
+        for tag in tags:
+            if tag in self.tags:
+                self.tags.move_to_end(tag)
+            generations.append(self.tags.get(tag, self.floor))
+        return generations
+
+    async def bump(self, tag: str):
+        self.tags[tag] = next(self._generation)
+        self.tags.move_to_end(tag)
+        while len(self.tags) > self.maxtags:
+            self.tags.popitem(last=False)
+            self.floor = next(self._generation)
+
+    def stats(self):
+        return {**self.entries.stats(), "tags": len(self.tags), "maxtags": self.maxtags}
+
+
+class RedisBackend:
+    """response cache storage shared by all gateway workers
+
+    Needs aiocache redis support (pip install aiocache[redis]), memory is
+    bounded by the redis maxmemory and maxmemory-policy settings.
+    """
+
+    def __init__(self, host: str, port: int):
+        from aiocache import Cache
+        from aiocache.serializers import StringSerializer
+        if Cache.REDIS is None:
+            raise ImportError("aioredis is not installed, install aiocache[redis]")
+        self.client = Cache(Cache.REDIS, endpoint=host, port=port,
+                            namespace="oca_response", serializer=StringSerializer())
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        value = await self.client.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl: float):
+        await self.client.set(key, value, ttl=ttl)
+
+    async def generations(self, tags: List[str]):
+        values = await self.client.multi_get([f"tag:{tag}" for tag in tags])
+        return [int(value or 0) for value in values]
+
+    async def bump(self, tag: str):
+        await self.client.increment(f"tag:{tag}")
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
+
+
+class ResponseCache:
+    """Opt-in cache for service api responses
+
+    Keys are a hash of the route, the service id and the canonicalized
+    request body (content of uploaded files, dict of pydantic models), so
+    requests with the same input share an entry no matter which objects
+    carried it. Every entry also depends on the generation of a set of tags,
+    writes bump the generation of the tags they affect, which makes every
+    related entry unreachable at once, without listing them.
+    """
+
+    IGNORED_ARGS = {"db", "sync", "ttl"}
+
+    def __init__(self, backend, ttl: float, wait_job: Optional[Callable[[str], Awaitable[Any]]] = None):
+        self.backend = backend
+        self.ttl = ttl
+        self.wait_job = wait_job or _wait_job
+        self._pending = set()
+
+    @staticmethod
+    async def _canonical(value):
+        if isinstance(value, UploadFile):
+            digest = hashlib.sha256()
+            chunk = await value.read(config.UPLOAD_CHUNK_SIZE)
+            while chunk:
+                digest.update(chunk)
+                chunk = await value.read(config.UPLOAD_CHUNK_SIZE)
+            await value.seek(0)
+            return digest.hexdigest()
+        if isinstance(value, BaseModel):
+            return value.dict()
+        if isinstance(value, list):
+            return [await ResponseCache._canonical(item) for item in value]
+        return value
+
+    async def key(self, route: str, kwargs: dict, tags: List[str]):
+        body = {}
+        for name, value in kwargs.items():
+            if name not in self.IGNORED_ARGS:
+                body[name] = await self._canonical(value)
+        generations = await self.backend.generations(tags)
+        raw = json.dumps([route, body, tags, generations], sort_keys=True, default=str)
+        return f"{route}:{hashlib.sha256(raw.encode()).hexdigest()}"
+
+    async def invalidate(self, *tags: str):
+        for tag in tags:
+            await self.backend.bump(tag)
+
+    def cached(self, route: str, tags: Iterable[str] = (), ttl: Optional[float] = None):
+        """opt a route into the cache
+
+        Only sync calls are cached, async ones must enqueue a new job. tags
+        are formatted with the route arguments, the service id is always a
+        tag, so service updates invalidate all its responses.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                expire = self.ttl if ttl is None else ttl
+                if args or not expire or not kwargs.get("sync"):
+                    return await func(*args, **kwargs)
+                route_tags = [tag.format(**kwargs) for tag in ("{service_id}", *tags)]
+                key = await self.key(route, kwargs, route_tags)
+                cached = await self.backend.get(key)
+                if cached is not None:
+                    return json.loads(cached)
+                resp = await func(**kwargs)
+                if isinstance(resp, Response):
+                    # streamed or custom responses are not cached
+                    return resp
+                await self.backend.set(key, json.dumps(resp), expire)
+                return resp
+            return wrapper
+        return decorator
+
+    async def _invalidate_after(self, job_id: str, tags: List[str]):
+        try:
+            await self.wait_job(job_id)
+        except Exception as exc:
+            logger.warning(f"Can't wait for job {job_id}, invalidating {tags} now: {exc}")
+        await self.invalidate(*tags)
+
+    def invalidates(self, *tags: str):
+        """invalidate tags, formatted with the route arguments, once a write is applied
+
+        A sync call applied its write when it returns. An async call only
+        enqueued a job, its tags are invalidated when the job is done, reads
+        in between may cache the old data again. Async calls returning no
+        job (buffered inserts) invalidate on their own.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                resp = await func(*args, **kwargs)
+                route_tags = [tag.format(**kwargs) for tag in tags]
+                if "sync" in kwargs and not kwargs["sync"]:
+                    if isinstance(resp, dict) and "id" in resp:
+                        task = asyncio.ensure_future(self._invalidate_after(resp["id"], route_tags))
+                        self._pending.add(task)
+                        task.add_done_callback(self._pending.discard)
+                else:
+                    await self.invalidate(*route_tags)
+                return resp
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return self.backend.stats()
+
+
+async def _wait_job(job_id: str):
+    """wait for a queued job to be done, or for JOB_STREAM_TIMEOUT seconds."""
+    # routers import the cache
+    from onecontainer_api.routers import queues
+    async for _ in queues.watch_jobs([job_id], config.JOB_STREAM_TIMEOUT):
+        pass
+
+
+def _response_backend():
+    if config.RESPONSE_CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend(config.RESPONSE_CACHE_REDIS_HOST, config.RESPONSE_CACHE_REDIS_PORT)
+        except ImportError as exc:
+            logger.error(f"Response cache falls back to memory: {exc}")
+    return MemoryBackend(config.RESPONSE_CACHE_SIZE, config.RESPONSE_CACHE_MAXBYTES)
+
+
+responses = ResponseCache(_response_backend(), config.cache_tte)
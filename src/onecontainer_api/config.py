@@ -14,6 +14,34 @@ sys.path.append(BASE_DIR)
 # cache time to expire
 cache_tte = int(os.environ.get("CACHE_TTE", 3600)) 
 
+# response cache, "memory" is per gateway process, "redis" is shared
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 4096))
+RESPONSE_CACHE_MAXBYTES = int(os.environ.get("RESPONSE_CACHE_MAXBYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_REDIS_HOST = os.environ.get("RESPONSE_CACHE_REDIS_HOST", "127.0.0.1")
+RESPONSE_CACHE_REDIS_PORT = int(os.environ.get("RESPONSE_CACHE_REDIS_PORT", 6379))
+
+# seconds db table lists and descriptions are cached, tables created through
+# the gateway are seen at once, schema changes made by other clients after ttl
+SCHEMA_CACHE_TTL = float(os.environ.get("SCHEMA_CACHE_TTL", min(cache_tte, 60)))
+
+# seconds db records are cached, writes made by async jobs are seen once the
+# job is done, writes of other clients or other gateway processes after ttl
+RECORDS_CACHE_TTL = float(os.environ.get("RECORDS_CACHE_TTL", min(cache_tte, 10)))
+
+# write-behind record inserts (buffered=true): rows per flush, seconds a row
+# waits for a batch, rows queued per service table before inserts wait, and
+# retries of a failed flush on shutdown, failed flushes are retried until
+# they succeed otherwise, waiting at most INGEST_RETRY_MAX_DELAY seconds
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 0.05))
+INGEST_MAX_ROWS = int(os.environ.get("INGEST_MAX_ROWS", 50000))
+INGEST_FLUSH_RETRIES = int(os.environ.get("INGEST_FLUSH_RETRIES", 3))
+INGEST_RETRY_MAX_DELAY = float(os.environ.get("INGEST_RETRY_MAX_DELAY", 5))
+
+# size of the chunks read from uploaded files
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 # General config
 
 ID_SIZE = 8
@@ -35,10 +63,48 @@ if not os.path.exists(PLUGIN_PATH):
 
 DRIVER_PORT = 5055
 
+# seconds between checks for changes in the driver directories
+DRIVER_CATALOG_CHECK_INTERVAL = float(os.environ.get("DRIVER_CATALOG_CHECK_INTERVAL", 5))
+
+# seconds a resolved driver IP is trusted without a docker event, 0 disables expiration
+DRIVER_ENDPOINT_TTL = float(os.environ.get("DRIVER_ENDPOINT_TTL", 300))
+
+# max seconds between restarts of the docker events watcher, the delay doubles from 1s
+DRIVER_EVENTS_RETRY_MAX_DELAY = float(os.environ.get("DRIVER_EVENTS_RETRY_MAX_DELAY", 60))
+
+# Transport config, drivers may override limit and timeout with
+# "conn_limit" and "timeout" in their metadata.json meta
+
+TRANSPORT_CONN_LIMIT = int(os.environ.get("TRANSPORT_CONN_LIMIT", 100))
+TRANSPORT_TIMEOUT = float(os.environ.get("TRANSPORT_TIMEOUT", 300))
+TRANSPORT_CONNECT_TIMEOUT = float(os.environ.get("TRANSPORT_CONNECT_TIMEOUT", 10))
+TRANSPORT_KEEPALIVE = float(os.environ.get("TRANSPORT_KEEPALIVE", 30))
+
 # Queue Service config
 
 QUEUE_API_URL = "http://127.0.0.1:5057"
 
+# async calls: "api" posts them to the queue api, "redis" writes jobs
+# straight to the queue redis (oca_redis, published on 127.0.0.1:6379)
+QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", "api")
+QUEUE_REDIS_HOST = os.environ.get("QUEUE_REDIS_HOST", "127.0.0.1")
+QUEUE_REDIS_PORT = int(os.environ.get("QUEUE_REDIS_PORT", 6379))
+QUEUE_REDIS_DB = int(os.environ.get("QUEUE_REDIS_DB", 0))
+QUEUE_REDIS_POOL_SIZE = int(os.environ.get("QUEUE_REDIS_POOL_SIZE", 10))
+
+# buffered inserts: "redis" stores rows in the queue redis before they are
+# acknowledged, "memory" keeps them in the gateway, lost if it crashes
+INGEST_STORE = os.environ.get("INGEST_STORE", "redis" if QUEUE_BACKEND == "redis" else "memory")
+
+# job waits: longest ?wait= of a long-poll, seconds an event stream stays open,
+# and seconds between job reads when no redis keyspace notification arrives
+JOB_WAIT_MAX = float(os.environ.get("JOB_WAIT_MAX", 60))
+JOB_STREAM_TIMEOUT = float(os.environ.get("JOB_STREAM_TIMEOUT", 600))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+
+# most jobs in a /job/batch submission
+JOB_BATCH_MAX = int(os.environ.get("JOB_BATCH_MAX", 1000))
+
 # Database related config
 
 SQLITE_PROTOCOL = "sqlite"
@@ -51,6 +117,10 @@ DATABASE_URL = f"{DATABASE_PROTOCOL}:///./{DB_NAME}.db"
 
 # Service related config
 
+# services are read on every service api call, keep them in memory
+SERVICE_CACHE_SIZE = int(os.environ.get("SERVICE_CACHE_SIZE", 1024))
+SERVICE_CACHE_TTL = float(os.environ.get("SERVICE_CACHE_TTL", 60))
+
 JSON = 'json'
 YAML = 'yaml'
 RAW = 'raw'
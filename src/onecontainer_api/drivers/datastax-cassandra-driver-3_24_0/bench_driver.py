@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""concurrency benchmark of the driver client against a stand-in cluster.
+
+The stand-in answers every query after --latency ms from a single io
+thread, like the cassandra driver does, so the numbers show how many
+requests each model keeps in flight, not Cassandra performance.
+
+    python bench_driver.py [--requests 5000] [--concurrency 256] [--threads 32] [--latency 2]
+
+blocking runs session.execute in a pool of --threads threads, one request
+per thread as the previous flask server did, async awaits execute_async
+from --concurrency tasks sharing one event loop.
+"""
+import argparse
+import asyncio
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import driver
+
+
+class StandInFuture:
+    """the parts of a ResponseFuture used by driver.bridge and ResultSet."""
+    _col_names = None
+    _col_types = None
+    _paging_state = None
+    has_more_pages = False
+
+    def __init__(self):
+        self._callbacks = []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def add_callbacks(self, callback, errback):
+        # like ResponseFuture, a callback added after the result runs at once
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback([])
+
+    def result(self):
+        self._done.wait()
+        return []
+
+    def _set_result(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback([])
+
+
+class StandInStatement:
+
+    def __init__(self, query):
+        self.query = query
+
+    def bind(self, values):
+        return self
+
+
+class StandInSession:
+    """answers queries after latency seconds from one io thread."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self._timers = []
+        self._count = 0
+        self._ready = threading.Condition()
+        threading.Thread(target=self._io_loop, daemon=True).start()
+
+    def _io_loop(self):
+        while True:
+            with self._ready:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    self._ready.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                _, _, future = heapq.heappop(self._timers)
+            future._set_result()
+
+    def prepare(self, query):
+        return StandInStatement(query)
+
+    def execute_async(self, statement, paging_state=None):
+        future = StandInFuture()
+        with self._ready:
+            self._count += 1
+            heapq.heappush(self._timers, (time.monotonic() + self.latency, self._count, future))
+            self._ready.notify()
+        return future
+
+    def execute(self, statement, paging_state=None):
+        return self.execute_async(statement, paging_state).result()
+
+
+def stand_in_client(latency):
+    client = driver.Client.__new__(driver.Client)
+    client.ks = "bench"
+    client._statements = driver.OrderedDict()
+    client._statements_lock = threading.Lock()
+    client.session = StandInSession(latency)
+    return client
+
+
+def run_blocking(client, requests, threads):
+    statement = client._prepare("INSERT INTO bench(id, value) VALUES(?,?)")
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(lambda i: client.session.execute(statement.bind([i, "value"])), range(requests)))
+
+
+async def run_async(client, requests, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+
+    async def insert(i):
+        async with slots:
+            await client.insert_into("bench", {"field_values": {"id": i, "value": "value"}})
+
+    await asyncio.gather(*[insert(i) for i in range(requests)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=2, help="stand-in latency in ms")
+    args = parser.parse_args()
+    driver.logger.remove()
+
+    client = stand_in_client(args.latency / 1000)
+    start = time.perf_counter()
+    run_blocking(client, args.requests, args.threads)
+    elapsed = time.perf_counter() - start
+    print(f"blocking ({args.threads} threads): {args.requests / elapsed:10.1f} req/s")
+
+    client = stand_in_client(args.latency / 1000)
+    start = time.perf_counter()
+    asyncio.run(run_async(client, args.requests, args.concurrency))
+    elapsed = time.perf_counter() - start
+    print(f"async ({args.concurrency} in flight):  {args.requests / elapsed:10.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
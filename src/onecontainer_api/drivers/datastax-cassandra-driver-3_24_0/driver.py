@@ -2,120 +2,795 @@
 #  Copyright (c) 2020 Intel Corporation
 #!/usr/bin/env python3
 
-from cassandra.cluster import Cluster, NoHostAvailable
+import asyncio
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from cassandra import ConsistencyLevel, InvalidRequest
+from cassandra.cluster import Cluster, EXEC_PROFILE_DEFAULT, ExecutionProfile, NoHostAvailable, ResultSet
+from cassandra.policies import (ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy,
+                                HostDistance, TokenAwarePolicy)
+from cassandra.query import BatchStatement, BatchType
 
 from logger import logger
 
+# seconds an unused session is kept open, and most sessions kept open
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", 600))
+SESSION_POOL_SIZE = int(os.environ.get("SESSION_POOL_SIZE", 16))
+# prepared statements kept per client, one per table and column set
+STATEMENT_CACHE_SIZE = int(os.environ.get("STATEMENT_CACHE_SIZE", 512))
+
+# bulk writes: statements in flight, rows per unlogged batch, rows read
+# ahead to group by partition, and most row errors reported
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 64))
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 50))
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", 2000))
+BULK_MAX_ERRORS = 100
+
+# rows fetched at a time when streaming a table without page_size
+STREAM_PAGE_SIZE = int(os.environ.get("STREAM_PAGE_SIZE", 1000))
+
+# exports: token ranges a table scan is split in, and ranges read at once
+EXPORT_SPLITS = int(os.environ.get("EXPORT_SPLITS", 64))
+EXPORT_CONCURRENCY = int(os.environ.get("EXPORT_CONCURRENCY", 8))
+
+# Murmur3Partitioner tokens, no key has the minimum one
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+DQL_OPERATORS = {"=": "=", "<": "<", "<=": "<=", ">": ">", ">=": ">=", "in": "IN"}
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def parse_hosts(hosts):
+    """split "host[:port]" strings into contact points and the default port
+
+    Hosts without a port use the port of the others, or 9042. When ports
+    differ, contact points are (host, port) tuples, so none is dropped.
+    """
+    parsed = []
+    for host in hosts:
+        address, _, port = host.partition(":")
+        parsed.append((address, int(port) if port else None))
+    ports = {port for _, port in parsed if port}
+    port = ports.pop() if len(ports) == 1 else 9042
+    if ports:
+        return [(address, port_ or 9042) for address, port_ in parsed], port
+    return [address for address, _ in parsed], port
+
+
+def _consistency(name):
+    try:
+        return ConsistencyLevel.name_to_value[name.upper()]
+    except KeyError:
+        raise ValueError(f"Invalid consistency level: {name}")
+
+
+def cluster_options(metadata):
+    """Cluster arguments for the routing options of a service meta
+
+    - local_dc, remote_dc_hosts: DC-aware round robin over local_dc, with
+      remote_dc_hosts hosts of each other DC as fallback
+    - token_aware (true): send statements to a replica of their partition
+    - consistency, serial_consistency: level names, e.g. LOCAL_QUORUM
+    - speculative_execution: {"delay_ms", "max_attempts"}, retry idempotent
+      statements on another host when the first is slow
+    - request_timeout: seconds
+    - protocol_version, connections_per_host {"core", "max"}: connection
+      counts per host only apply to protocol versions 1 and 2, newer ones
+      multiplex requests over one connection per host
+    """
+    child = DCAwareRoundRobinPolicy(local_dc=metadata.get("local_dc", ""),
+                                    used_hosts_per_remote_dc=int(metadata.get("remote_dc_hosts", 0)))
+    profile = {
+        "load_balancing_policy": TokenAwarePolicy(child) if metadata.get("token_aware", True) else child,
+    }
+    if metadata.get("consistency"):
+        profile["consistency_level"] = _consistency(metadata["consistency"])
+    if metadata.get("serial_consistency"):
+        profile["serial_consistency_level"] = _consistency(metadata["serial_consistency"])
+    if metadata.get("request_timeout"):
+        profile["request_timeout"] = float(metadata["request_timeout"])
+    speculative = metadata.get("speculative_execution")
+    if speculative:
+        profile["speculative_execution_policy"] = ConstantSpeculativeExecutionPolicy(
+            delay=float(speculative.get("delay_ms", 50)) / 1000,
+            max_attempts=int(speculative.get("max_attempts", 2)))
+    options = {"execution_profiles": {EXEC_PROFILE_DEFAULT: ExecutionProfile(**profile)}}
+    if metadata.get("protocol_version"):
+        options["protocol_version"] = int(metadata["protocol_version"])
+    return options
+
+
+def _set_connections(cluster, connections):
+    if not connections:
+        return
+    if cluster.protocol_version >= 3:
+        logger.warning(f"connections_per_host ignored with protocol version {cluster.protocol_version}")
+        return
+    for distance in (HostDistance.LOCAL, HostDistance.REMOTE):
+        if connections.get("max"):
+            cluster.set_max_connections_per_host(distance, int(connections["max"]))
+        if connections.get("core"):
+            cluster.set_core_connections_per_host(distance, int(connections["core"]))
+
+
+def token_ranges(splits):
+    """splits (start, end] ranges of even size covering the token ring."""
+    splits = max(1, min(int(splits), 2 ** 16))
+    step = (MAX_TOKEN - MIN_TOKEN) // splits
+    bounds = [MIN_TOKEN + step * i for i in range(splits)] + [MAX_TOKEN]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _identifiers(names):
+    """names of a table or columns, checked before they go into a query."""
+    names = tuple(names)
+    for name in names:
+        if not IDENTIFIER.match(name):
+            raise ValueError(f"Invalid identifier: {name}")
+    return names
+
+
+def _chunks(iterable, size):
+    """lists of up to size items of an iterable."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _achunks(rows, size):
+    """lists of up to size (index, row) of a sync or async iterable of rows."""
+    chunk = []
+    index = 0
+    if not hasattr(rows, "__aiter__"):
+        rows = _aiter(rows)
+    async for row in rows:
+        chunk.append((index, row))
+        index += 1
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
+
+
+def _set_future(future, result=None, exc=None):
+    if future.done():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+def bridge(response_future):
+    """asyncio future of the ResultSet of a cassandra ResponseFuture
+
+    Driver callbacks run in its io thread, results are handed to the event
+    loop with call_soon_threadsafe, so no thread waits on a query.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    response_future.add_callbacks(
+        lambda rows: loop.call_soon_threadsafe(_set_future, future, ResultSet(response_future, rows)),
+        lambda exc: loop.call_soon_threadsafe(_set_future, future, None, exc),
+    )
+    return future
+
+
+def _required(data, name):
+    """non empty mapping field of a DML request."""
+    if not data.get(name):
+        raise ValueError(f"Missing {name}")
+    return data[name]
+
+
+class BulkReport:
+    """counts of a bulk write, with the first BULK_MAX_ERRORS row errors."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.rows_applied = 0
+        self.rows_failed = 0
+        self.errors = []
+
+    def applied(self, indexes):
+        self.rows_applied += len(indexes)
+
+    def failed(self, indexes, exc):
+        self.rows_failed += len(indexes)
+        for index in indexes[:BULK_MAX_ERRORS - len(self.errors)]:
+            self.errors.append({"index": index, "error": f"{type(exc).__name__}: {exc}"})
+
+    def result(self):
+        elapsed = time.monotonic() - self.start
+        rows = self.rows_applied + self.rows_failed
+        return {
+            "rows": rows,
+            "applied": self.rows_applied,
+            "failed": self.rows_failed,
+            "errors": sorted(self.errors, key=lambda error: error["index"]),
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class SchemaCache:
+    """Formatted tables of a keyspace, rebuilt only when their metadata changes
+
+    The cassandra driver replaces the TableMetadata of a table when it gets
+    a schema change event for it, an entry stays valid while it was built
+    from the object currently in cluster.metadata, so reads are served from
+    memory and still follow schema changes made by any client.
+    """
+
+    def __init__(self, cluster, keyspace):
+        self.cluster = cluster
+        self.keyspace = keyspace
+        self._tables = {}
+
+    @staticmethod
+    def _format_table(table):
+        columns = []
+        for column_name, column in table.columns.items():
+            columns.append({
+                "name": column_name,
+                "datatype": column.cql_type
+            })
+        return {
+            "name": table.name,
+            "columns": columns,
+            "primary_key": [x.name for x in table.primary_key]
+        }
+
+    def _entry(self, name, table):
+        entry = self._tables.get(name)
+        if entry is None or entry[0] is not table:
+            entry = (table, self._format_table(table))
+            self._tables[name] = entry
+        return entry[1]
+
+    def table(self, name):
+        return self._entry(name, self.cluster.metadata.keyspaces[self.keyspace].tables[name])
+
+    def tables(self):
+        tables = self.cluster.metadata.keyspaces[self.keyspace].tables
+        for name in set(self._tables) - set(tables):
+            del self._tables[name]
+        return [self._entry(name, table) for name, table in tables.items()]
+
+    def invalidate(self, name=None):
+        if name is None:
+            self._tables.clear()
+        else:
+            self._tables.pop(name, None)
+
 
 class Client:
 
     def __init__(self, hosts, metadata):
-        self.port = 9042
-        self.hosts = []
-        for host in hosts:
-            if ":" in host:
-                self.port = host.split(":")[-1]
-                self.hosts.append(host.split(":")[0])
-            else:
-                self.hosts.append(host)
+        self.hosts, self.port = parse_hosts(hosts)
         logger.debug(f"Connecting to hosts: {hosts}")
         self.ks = metadata["keyspace"]
         self.repl = metadata["replication"]
-        self.cluster = Cluster(self.hosts, port=self.port)
+        self._statements = OrderedDict()
+        self._statements_lock = threading.Lock()
+        self.cluster = self._cluster(metadata)
         try:
             self.session = self.cluster.connect(self.ks)
         except NoHostAvailable:
             self.cluster.shutdown()
-            self.cluster = Cluster(self.hosts, port=self.port)
+            self.cluster = self._cluster(metadata)
             query = f"CREATE KEYSPACE IF NOT EXISTS {self.ks} WITH REPLICATION = {self.repl}"
             logger.debug(f"Keyspace not found: {self.ks}")
             logger.debug(f"Executing query: {query}")
             self.session = self.cluster.connect()
             self.session.execute(query)
             self.session.set_keyspace(self.ks)
+        self.schema = SchemaCache(self.cluster, self.ks)
+
+    def _cluster(self, metadata):
+        cluster = Cluster(self.hosts, port=self.port, **cluster_options(metadata))
+        _set_connections(cluster, metadata.get("connections_per_host"))
+        return cluster
+
+    def shutdown(self):
+        self.cluster.shutdown()
 
     def heartbeat(self):
         return bool(self.cluster.metadata.keyspaces)
 
-    def _format_table(self, table):
-        columns = []
-        for column_name, column in table.columns.items():
-            columns.append({
-                "name": column_name,
-                "datatype": column.cql_type
-            })
-        return {
-            "name": table.name,
-            "columns": columns,
-            "primary_key": [x.name for x in table.primary_key]
-        }
-
     def list_tables(self, **kwargs):
-        tables = []
-        for _, table in self.cluster.metadata.keyspaces[self.ks].tables.items():
-            tables.append(self._format_table(table))
-        return tables
+        return self.schema.tables()
 
-    def create_table(self, data):
+    async def create_table(self, data):
         logger.debug(f"Creating table {data}")
         fields = []
         for i in data["columns"]:
             fields.append(f'{i["name"]} {i["datatype"]}')
         query = f'CREATE TABLE {data["name"]}({",".join(fields)}, PRIMARY KEY({",".join(data["primary_key"])}))'
         logger.debug(f"Executing query: {query}")
-        self.session.execute(query)
+        # the driver waits for schema agreement and refreshes its metadata
+        # before a DDL returns, the next read rebuilds the entry from it
+        await self.execute(query)
+        self.schema.invalidate(data["name"])
         return True
 
     def describe_table(self, table_name):
-        table = self.cluster.metadata.keyspaces[self.ks].tables[table_name]
-        return self._format_table(table)
+        return self.schema.table(table_name)
+
+    def _prepare(self, query):
+        """prepared statement of a query, prepared once per client.
+
+        Queries only hold placeholders, so there is one per table, column
+        set and options, whatever the values.
+        """
+        with self._statements_lock:
+            statement = self._statements.get(query)
+            if statement is None:
+                logger.debug(f"Preparing query: {query}")
+                try:
+                    statement = self.session.prepare(query)
+                except InvalidRequest as exc:
+                    # the query is rejected as written, values don't matter
+                    raise ValueError(f"Invalid query {query}: {exc}")
+                self._statements[query] = statement
+                while len(self._statements) > STATEMENT_CACHE_SIZE:
+                    self._statements.popitem(last=False)
+            else:
+                self._statements.move_to_end(query)
+        return statement
+
+    async def _prepare_async(self, query):
+        """_prepare without blocking the event loop, preparing runs in a thread once."""
+        with self._statements_lock:
+            statement = self._statements.get(query)
+        if statement is not None:
+            return statement
+        return await asyncio.get_event_loop().run_in_executor(None, self._prepare, query)
+
+    async def _bind(self, query, values):
+        statement = await self._prepare_async(query)
+        try:
+            return statement.bind(values)
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f"Invalid values for {query}: {exc}")
+
+    async def execute(self, statement, paging_state=None):
+        """ResultSet of a statement, awaited without holding a thread."""
+        return await bridge(self.session.execute_async(statement, paging_state=paging_state))
+
+    async def _execute(self, query, values):
+        bound = await self._bind(query, values)
+        logger.debug(f"Executing query: {query} with {values}")
+        return await self.execute(bound)
+
+    @staticmethod
+    def _conditions(data):
+        """IF clause and values of an UPDATE or DELETE."""
+        field_conditions = data.get("field_conditions") or {}
+        if field_conditions:
+            columns = _identifiers(field_conditions)
+            return f' IF {" AND ".join(f"{c} = ?" for c in columns)}', list(field_conditions.values())
+        if data.get("exist_condition") == "if_exist":
+            return " IF EXISTS", []
+        return "", []
+
+    @staticmethod
+    def _using(data, options):
+        """USING clause and values of a DML, for its ttl and timestamp options."""
+        names = [option for option in options if data.get(option) is not None]
+        clause = f' USING {" AND ".join(f"{name.upper()} ?" for name in names)}' if names else ""
+        return clause, [data[name] for name in names]
 
-    def insert_into(self, table_name, data):
+    @staticmethod
+    def _applied(rows, conditional):
+        return rows.was_applied if conditional else True
+
+    async def insert_into(self, table_name, data):
         logger.debug(f"Insert into {table_name}: {data}")
-        fields = []
+        _identifiers([table_name])
+        columns = _identifiers(_required(data, "field_values"))
+        condition = " IF NOT EXISTS" if data.get("exist_condition") == "if_not_exist" else ""
+        using, option_values = self._using(data, ("ttl", "timestamp"))
+        query = (f'INSERT INTO {table_name}({",".join(columns)}) '
+                 f'VALUES({",".join("?" * len(columns))}){condition}{using}')
+        rows = await self._execute(query, list(data["field_values"].values()) + option_values)
+        return self._applied(rows, condition)
+
+    async def _select(self, table_name, data):
+        """bound SELECT of the dql option in the query string filters
+
+        dql is a RecordDQLOptions, predicates are only accepted on primary
+        key columns, so the query targets partitions instead of scanning
+        the table, Cassandra checks the rest (partition key restricted by
+        equality, ranges on clustering columns).
+        """
+        _identifiers([table_name])
+        dql = json.loads(data["dql"][0]) if data.get("dql", [""])[0] else {}
+        table = self.cluster.metadata.keyspaces[self.ks].tables[table_name]
+        keys = {column.name for column in table.primary_key}
+        predicates = [(column, "=", value) for column, value in (dql.get("where") or {}).items()]
+        predicates += [(f["column"], f.get("op", "="), f["value"]) for f in dql.get("filters") or []]
+        clauses = []
         values = []
-        for k, v in data["field_values"].items():
-            fields.append(k)
-            if isinstance(v, str):
-                v = f"'{v}'"
-            values.append(str(v))
-        query = f'INSERT INTO {table_name}({",".join(fields)}) VALUES({",".join(values)})'
-        logger.debug(f"Executing query: {query}")
-        self.session.execute(query)
-        return True
+        for column, op, value in predicates:
+            _identifiers([column])
+            if column not in keys:
+                raise ValueError(f"{column} is not a primary key column of {table_name}")
+            if op not in DQL_OPERATORS:
+                raise ValueError(f"Invalid operator: {op}")
+            clauses.append(f"{column} {DQL_OPERATORS[op]} ?")
+            values.append(value)
+        columns = _identifiers(dql.get("columns") or [])
+        query = f'SELECT {",".join(columns) or "*"} FROM {table_name}'
+        if clauses:
+            query += f' WHERE {" AND ".join(clauses)}'
+        order_by = dql.get("order_by") or []
+        if order_by:
+            orders = [f'{_identifiers([o["column"]])[0]} {"DESC" if o.get("desc") else "ASC"}' for o in order_by]
+            query += f' ORDER BY {",".join(orders)}'
+        if dql.get("limit"):
+            query += " LIMIT ?"
+            values.append(int(dql["limit"]))
+        statement = await self._bind(query, values)
+        # reads can be retried on another replica by speculative execution
+        statement.is_idempotent = True
+        return statement
+
+    async def _pages(self, statement, rows):
+        """rows of a result set and of its next pages, fetched one at a time."""
+        while True:
+            for row in rows.current_rows:
+                yield row
+            if not rows.paging_state:
+                return
+            rows = await self.execute(statement, paging_state=rows.paging_state)
+
+    async def select_from(self, table_name, data):
+        """rows of a table, or one page of them when page_size is given.
 
-    def select_from(self, table_name, data):
+        A page comes with next_page_token, the Cassandra paging state of
+        the following page, None on the last one.
+        """
         logger.debug(f"Select from {table_name}: {data}")
-        query = f'SELECT * FROM {table_name}'
-        logger.debug(f"Executing query: {query}")
-        rows = self.session.execute(query)
-        return rows.all()
+        statement = await self._select(table_name, data)
+        if not data.get("page_size"):
+            return [row async for row in self._pages(statement, await self.execute(statement))]
+        statement.fetch_size = int(data["page_size"][0])
+        page_token = data.get("page_token", [""])[0]
+        paging_state = bytes.fromhex(page_token) if page_token else None
+        rows = await self.execute(statement, paging_state=paging_state)
+        return {
+            "rows": rows.current_rows,
+            "next_page_token": rows.paging_state.hex() if rows.paging_state else None,
+        }
+
+    async def stream_from(self, table_name, data):
+        """async iterator over the rows of a table, fetching page_size rows at a time.
+
+        The first page is fetched before returning, so query errors are
+        raised here and not once the rows are being sent.
+        """
+        logger.debug(f"Stream from {table_name}: {data}")
+        statement = await self._select(table_name, data)
+        statement.fetch_size = int(data.get("page_size", [STREAM_PAGE_SIZE])[0])
+        return self._pages(statement, await self.execute(statement))
+
+    async def _scan_range(self, statement, start, end, pages):
+        bound = statement.bind([start, end])
+        bound.fetch_size = STREAM_PAGE_SIZE
+        bound.is_idempotent = True
+        rows = await self.execute(bound)
+        while True:
+            if rows.current_rows:
+                await pages.put(rows.current_rows)
+            if not rows.paging_state:
+                return
+            rows = await self.execute(bound, paging_state=rows.paging_state)
+
+    async def _scan(self, statement, ranges):
+        """pages of the token ranges, EXPORT_CONCURRENCY ranges read at once."""
+        pages = asyncio.Queue(EXPORT_CONCURRENCY * 2)
+        ranges = iter(ranges)
+
+        async def scan():
+            # each scanner takes the next range left when done with one
+            for start, end in ranges:
+                await self._scan_range(statement, start, end, pages)
 
-    def update_from(self, table_name, data):
+        scanners = {asyncio.ensure_future(scan()) for _ in range(EXPORT_CONCURRENCY)}
+        page = None
+        try:
+            while scanners or not pages.empty():
+                if not pages.empty():
+                    yield pages.get_nowait()
+                    continue
+                page = asyncio.ensure_future(pages.get())
+                done, _ = await asyncio.wait(scanners | {page}, return_when=asyncio.FIRST_COMPLETED)
+                for scanner in done - {page}:
+                    scanners.discard(scanner)
+                    # raises the error of a failed scan
+                    scanner.result()
+                if page.done():
+                    yield page.result()
+                else:
+                    page.cancel()
+        finally:
+            if page is not None:
+                page.cancel()
+            for scanner in scanners:
+                scanner.cancel()
+
+    async def export_from(self, table_name, splits=None):
+        """columns and async iterator over the pages of a whole table
+
+        The token ring is split in splits ranges (EXPORT_SPLITS), each one
+        is read by a paged SELECT on the token of the partition key, so
+        EXPORT_CONCURRENCY ranges, held by different replicas, are scanned
+        at once. Pages come as they are fetched, not in token order.
+        Columns are (name, cql type), pages lists of row tuples.
+        """
+        logger.debug(f"Export {table_name} in {splits or EXPORT_SPLITS} ranges")
+        _identifiers([table_name])
+        table = self.cluster.metadata.keyspaces[self.ks].tables[table_name]
+        columns = [(name, column.cql_type) for name, column in table.columns.items()]
+        token = f'token({",".join(column.name for column in table.partition_key)})'
+        query = (f'SELECT {",".join(name for name, _ in columns)} FROM {table_name} '
+                 f'WHERE {token} > ? AND {token} <= ?')
+        statement = await self._prepare_async(query)
+        return columns, self._scan(statement, token_ranges(splits or EXPORT_SPLITS))
+
+    async def _bulk_statements(self, table_name, rows, using, option_values, report, convert=None):
+        """(statement, row indexes) to run for a sync or async iterable of rows
+
+        Rows are read BULK_CHUNK_SIZE at a time, rows of a chunk sharing a
+        partition key go in unlogged batches of BULK_BATCH_SIZE, which land
+        on a single replica set, the others are sent alone. Rows that can't
+        be bound are reported as failed and skipped.
+        """
+        partition_key = [c.name for c in self.cluster.metadata.keyspaces[self.ks].tables[table_name].partition_key]
+        async for chunk in _achunks(rows, BULK_CHUNK_SIZE):
+            partitions = OrderedDict()
+            for index, row in chunk:
+                try:
+                    if convert is not None:
+                        row = convert(row)
+                    elif isinstance(row, (str, bytes)):
+                        row = json.loads(row)
+                    columns = _identifiers(row)
+                    query = (f'INSERT INTO {table_name}({",".join(columns)}) '
+                             f'VALUES({",".join("?" * len(columns))}){using}')
+                    bound = await self._bind(query, list(row.values()) + option_values)
+                    key = repr(tuple(row[column] for column in partition_key))
+                except Exception as exc:
+                    report.failed([index], exc)
+                    continue
+                partitions.setdefault(key, []).append((index, bound))
+            for statements in partitions.values():
+                for group in _chunks(statements, BULK_BATCH_SIZE):
+                    if len(group) == 1:
+                        yield group[0][1], [group[0][0]]
+                        continue
+                    batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+                    for _, bound in group:
+                        batch.add(bound)
+                    yield batch, [index for index, _ in group]
+
+    async def bulk_insert(self, table_name, rows, ttl=None, timestamp=None, convert=None):
+        """insert an iterable of rows, BULK_CONCURRENCY statements at a time.
+
+        Rows are {column: value} dicts or JSON documents of them, or what
+        convert turns into a dict, those that fail are counted and reported
+        with their index.
+        """
+        logger.debug(f"Bulk insert into {table_name}")
+        _identifiers([table_name])
+        using, option_values = self._using({"ttl": ttl, "timestamp": timestamp}, ("ttl", "timestamp"))
+        report = BulkReport()
+        in_flight = asyncio.BoundedSemaphore(BULK_CONCURRENCY)
+
+        def done(future, indexes):
+            if future.cancelled():
+                report.failed(indexes, asyncio.CancelledError("insert cancelled"))
+            else:
+                exc = future.exception()
+                if exc is None:
+                    report.applied(indexes)
+                else:
+                    report.failed(indexes, exc)
+            in_flight.release()
+
+        async for statement, indexes in self._bulk_statements(table_name, rows, using, option_values, report,
+                                                                convert):
+            await in_flight.acquire()
+            future = bridge(self.session.execute_async(statement))
+            future.add_done_callback(lambda future, indexes=indexes: done(future, indexes))
+        for _ in range(BULK_CONCURRENCY):
+            await in_flight.acquire()
+        return report.result()
+
+    async def update_from(self, table_name, data):
         logger.debug(f"Update from {table_name}: {data}")
-        updates = []
-        filters = []
-        for k, v in data["field_values"].items():
-            if isinstance(v, str):
-                v = f"'{v}'"
-            updates.append(f"{k} = {v}")
-        for k, v in data["where"].items():
-            if isinstance(v, str):
-                v = f"'{v}'"
-            filters.append(f"{k} = {v}")
-        query = f'UPDATE {table_name} SET {",".join(updates)} WHERE {",".join(filters)}'
-        logger.debug(f"Executing query: {query}")
-        self.session.execute(query)
-        return True
+        _identifiers([table_name])
+        columns = _identifiers(_required(data, "field_values"))
+        filters = _identifiers(_required(data, "where"))
+        using, option_values = self._using(data, ("ttl", "timestamp"))
+        condition, condition_values = self._conditions(data)
+        query = (f'UPDATE {table_name}{using} SET {",".join(f"{c} = ?" for c in columns)} '
+                 f'WHERE {" AND ".join(f"{c} = ?" for c in filters)}{condition}')
+        rows = await self._execute(query, option_values + list(data["field_values"].values())
+                             + list(data["where"].values()) + condition_values)
+        return self._applied(rows, condition)
 
-    def delete_from(self, table_name, data):
+    async def delete_from(self, table_name, data):
         logger.debug(f"Delete from {table_name}: {data}")
-        filters = []
-        for k, v in data["where"].items():
-            if isinstance(v, str):
-                v = f"'{v}'"
-            filters.append(f"{k} = {v}")
-        query = f'DELETE FROM {table_name} WHERE {",".join(filters)}'
-        logger.debug(f"Executing query: {query}")
-        self.session.execute(query)
-        return True
+        _identifiers([table_name])
+        filters = _identifiers(_required(data, "where"))
+        using, option_values = self._using(data, ("timestamp",))
+        condition, condition_values = self._conditions(data)
+        query = (f'DELETE FROM {table_name}{using} '
+                 f'WHERE {" AND ".join(f"{c} = ?" for c in filters)}{condition}')
+        rows = await self._execute(query, option_values + list(data["where"].values()) + condition_values)
+        return self._applied(rows, condition)
+
+
+class SessionPool:
+    """Long-lived clients keyed by (hosts, port, keyspace, meta)
+
+    A Client owns a Cluster, its connections and its threads, building one
+    means connecting, discovering the topology and maybe creating the
+    keyspace, so clients are shared by every request with the same target.
+    Clients unused for idle_timeout seconds are shut down by a reaper
+    thread, the least recently used one when more than maxsize are open.
+    Clients taken with lease are in use until release, a streamed export or
+    import can outlast idle_timeout, leased clients are never shut down.
+    """
+
+    def __init__(self, maxsize=SESSION_POOL_SIZE, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._clients = OrderedDict()
+        self._connecting = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def key(hosts, metadata):
+        addresses, port = parse_hosts(hosts)
+        return (tuple(sorted(map(str, addresses))), port, metadata["keyspace"],
+                json.dumps(metadata, sort_keys=True))
+
+    def get(self, hosts, metadata, lease=False):
+        """client for hosts and metadata, connecting on first use."""
+        key = self.key(hosts, metadata)
+        with self._lock:
+            client = self._touch(key, lease)
+            if client is not None:
+                return client
+            connecting = self._connecting.setdefault(key, threading.Lock())
+        # connect outside the pool lock, a slow host only blocks its own key
+        with connecting:
+            with self._lock:
+                client = self._touch(key, lease)
+            if client is None:
+                try:
+                    client = Client(hosts, metadata)
+                except BaseException:
+                    with self._lock:
+                        self._connecting.pop(key, None)
+                    raise
+                # stored before the connecting lock goes, a thread coming in
+                # between finds one or the other and never connects again
+                with self._lock:
+                    self._clients[key] = [client, time.monotonic(), int(lease)]
+                    self._connecting.pop(key, None)
+                    evicted = self._evict(keep=key)
+                self._shutdown(evicted)
+                self._start_reaper()
+        return client
+
+    async def get_async(self, hosts, metadata, lease=False):
+        """get for the event loop, connecting runs in a thread."""
+        with self._lock:
+            client = self._touch(self.key(hosts, metadata), lease)
+        if client is not None:
+            return client
+        return await asyncio.get_event_loop().run_in_executor(None, self.get, hosts, metadata, lease)
+
+    async def lease(self, hosts, metadata):
+        """get_async for a client in use until release."""
+        return await self.get_async(hosts, metadata, lease=True)
+
+    def release(self, client):
+        """end a lease, the client is idle from now on."""
+        with self._lock:
+            for entry in self._clients.values():
+                if entry[0] is client:
+                    entry[1] = time.monotonic()
+                    entry[2] -= 1
+                    return
+
+    def _touch(self, key, lease=False):
+        entry = self._clients.get(key)
+        if entry is None:
+            return None
+        if entry[0].cluster.is_shutdown:
+            del self._clients[key]
+            return None
+        entry[1] = time.monotonic()
+        if lease:
+            entry[2] += 1
+        self._clients.move_to_end(key)
+        return entry[0]
+
+    def _evict(self, now=None, keep=None):
+        """pop idle and extra clients, the caller shuts them down without the lock.
+
+        Leased clients and the one of keep, just connected, are kept, the pool
+        may go over maxsize while they are in use.
+        """
+        evicted = []
+        deadline = (now or time.monotonic()) - self.idle_timeout
+        for key, (client, last_used, leases) in list(self._clients.items()):
+            if leases or key == keep:
+                continue
+            if len(self._clients) > self.maxsize or (self.idle_timeout and last_used < deadline):
+                evicted.append(client)
+                del self._clients[key]
+        return evicted
+
+    @staticmethod
+    def _shutdown(clients):
+        for client in clients:
+            logger.debug(f"Closing session to {client.hosts}, keyspace {client.ks}")
+            client.shutdown()
+
+    def _start_reaper(self):
+        if not self.idle_timeout or (self._reaper and self._reaper.is_alive()):
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reap, name="session-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while not self._stop.wait(min(self.idle_timeout, 60)):
+            with self._lock:
+                evicted = self._evict()
+            self._shutdown(evicted)
+
+    def close(self):
+        """shut down every client, used on exit."""
+        self._stop.set()
+        with self._lock:
+            clients = [client for client, _, _ in self._clients.values()]
+            self._clients.clear()
+        self._shutdown(clients)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._clients), "maxsize": self.maxsize,
+                    "idle_timeout": self.idle_timeout,
+                    "leases": sum(leases for _, _, leases in self._clients.values())}
+
+
+pool = SessionPool()
+atexit.register(pool.close)
@@ -0,0 +1,346 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""table export and import formats: ndjson, csv and parquet
+
+Exports encode pages of row tuples in column order to chunks of bytes,
+imports decode a request body, read in chunks, to rows for
+Client.bulk_insert. Parquet needs pyarrow, installed in the image, it is
+imported on first use so the driver still runs ndjson and csv without it.
+"""
+import asyncio
+import datetime
+import decimal
+import json
+import os
+import re
+import tempfile
+import uuid
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# rows per parquet row group, and parquet uploads kept in memory before spooling to disk
+PARQUET_ROW_GROUP = int(os.environ.get("PARQUET_ROW_GROUP", 50000))
+PARQUET_SPOOL_SIZE = 64 * 1024 * 1024
+
+_INTEGERS = {"int", "bigint", "smallint", "tinyint", "varint", "counter"}
+_COLLECTIONS = ("list<", "set<", "map<", "tuple<", "frozen<")
+
+
+def _check(fmt):
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Invalid format: {fmt}, expected one of {', '.join(MEDIA_TYPES)}")
+    if fmt == "parquet":
+        _arrow()
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("parquet needs pyarrow, it is not installed in the driver")
+    return pyarrow
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + value.hex()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "items"):
+        return dict(value.items())
+    return str(value)
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default)
+
+
+def _text(value):
+    """value of a csv or parquet string cell, the form coerce reads back."""
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + value.hex()
+    if isinstance(value, (list, tuple, set, frozenset, dict)) or hasattr(value, "items"):
+        return _dumps(value)
+    return str(value)
+
+
+def coerce(cql_type, value):
+    """value of a column of cql_type from its text or JSON form
+
+    Values that aren't strings, or of text columns, are kept, empty
+    strings are null for every other type.
+    """
+    if not isinstance(value, str) or cql_type in ("text", "varchar", "ascii"):
+        return value
+    if value == "":
+        return None
+    if cql_type in _INTEGERS:
+        return int(value)
+    if cql_type in ("float", "double"):
+        return float(value)
+    if cql_type == "decimal":
+        return decimal.Decimal(value)
+    if cql_type == "boolean":
+        try:
+            return {"true": True, "false": False}[value.lower()]
+        except KeyError:
+            raise ValueError(f"Invalid boolean: {value}")
+    if cql_type in ("uuid", "timeuuid"):
+        return uuid.UUID(value)
+    if cql_type == "timestamp":
+        return datetime.datetime.fromisoformat(value)
+    if cql_type == "date":
+        return datetime.date.fromisoformat(value)
+    if cql_type == "blob":
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    if cql_type.startswith(_COLLECTIONS):
+        return json.loads(value)
+    return value
+
+
+# Exports
+
+async def _ndjson(names, pages):
+    async for page in pages:
+        yield "".join(_dumps(dict(zip(names, row))) + "\n" for row in page).encode()
+
+
+def _csv_line(values):
+    """csv record with every value quoted, nulls are left as empty unquoted fields."""
+    return ",".join(
+        "" if value is None else '"' + _text(value).replace('"', '""') + '"' for value in values
+    ) + "\n"
+
+
+async def _csv(names, pages):
+    yield _csv_line(names).encode()
+    async for page in pages:
+        yield "".join(_csv_line(row) for row in page).encode()
+
+
+def _arrow_type(pa, cql_type):
+    """arrow type and value converter of a cql type, other types are strings."""
+    types = {
+        "int": pa.int32(), "smallint": pa.int16(), "tinyint": pa.int8(),
+        "bigint": pa.int64(), "counter": pa.int64(),
+        "float": pa.float32(), "double": pa.float64(),
+        "boolean": pa.bool_(), "blob": pa.binary(), "timestamp": pa.timestamp("ms"),
+    }
+    if cql_type in types:
+        return types[cql_type], None
+    if cql_type == "date":
+        # cassandra.util.Date, with the date() of its value
+        return pa.date32(), lambda value: value.date() if hasattr(value, "date") else value
+    return pa.string(), _text
+
+
+class _Sink:
+    """write-only file for pyarrow, its content is taken by drain as it is written."""
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+async def _parquet(columns, pages):
+    pa = _arrow()
+    fields = [(name, *_arrow_type(pa, cql_type)) for name, cql_type in columns]
+    schema = pa.schema([(name, arrow_type) for name, arrow_type, _ in fields])
+    sink = _Sink()
+    writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+
+    def row_group(rows):
+        arrays = []
+        for index, (_, arrow_type, convert) in enumerate(fields):
+            values = [row[index] for row in rows]
+            if convert:
+                values = [None if value is None else convert(value) for value in values]
+            arrays.append(pa.array(values, type=arrow_type))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    rows = []
+    async for page in pages:
+        rows.extend(page)
+        if len(rows) >= PARQUET_ROW_GROUP:
+            row_group(rows)
+            rows = []
+            yield sink.drain()
+    if rows:
+        row_group(rows)
+    writer.close()
+    yield sink.drain()
+
+
+async def _closing(chunks, pages):
+    """chunks, closing pages when they are, so a stopped export stops its scans."""
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+        await pages.aclose()
+
+
+def encode(fmt, columns, pages):
+    """async iterator over the chunks of a table export
+
+    columns are (name, cql type) of the rows, pages an async iterator of
+    lists of row tuples. ndjson and csv send a chunk per page, parquet one
+    per row group of PARQUET_ROW_GROUP rows.
+    """
+    _check(fmt)
+    names = [name for name, _ in columns]
+    if fmt == "ndjson":
+        return _closing(_ndjson(names, pages), pages)
+    if fmt == "csv":
+        return _closing(_csv(names, pages), pages)
+    return _closing(_parquet(columns, pages), pages)
+
+
+# Imports
+
+async def _lines(chunks):
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+class Reader:
+    """rows of an import body and their conversion to {column: value}
+
+    rows yields raw rows, convert is called by bulk_insert for each of them
+    so a row that can't be decoded only fails itself.
+    """
+
+    def __init__(self, columns):
+        self.types = {column["name"]: column["datatype"] for column in columns}
+
+    def _coerce(self, row):
+        return {name: coerce(self.types.get(name, ""), value) for name, value in row.items()}
+
+
+class NDJSONReader(Reader):
+
+    async def rows(self, chunks):
+        async for line in _lines(chunks):
+            if line.strip():
+                yield line
+
+    def convert(self, line):
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("Row is not a JSON object")
+        return self._coerce(row)
+
+
+_CSV_FIELD = re.compile(r'"((?:[^"]|"")*)"|([^,]*)')
+
+
+def _csv_fields(record):
+    """values of a csv record, None for the empty unquoted fields."""
+    if record.endswith("\r"):
+        record = record[:-1]
+    fields, position = [], 0
+    while True:
+        match = _CSV_FIELD.match(record, position)
+        quoted, unquoted = match.groups()
+        fields.append(quoted.replace('""', '"') if quoted is not None else unquoted or None)
+        position = match.end()
+        if position == len(record):
+            return fields
+        if record[position] != ",":
+            raise ValueError(f"Invalid csv field at character {position}")
+        position += 1
+
+
+class CSVReader(Reader):
+    """csv with a header line, quoted fields may hold line breaks
+
+    An empty unquoted field is a null and a quoted one an empty string, as
+    exports write them. For other than text columns both are null.
+    """
+    header = None
+
+    async def rows(self, chunks):
+        record = []
+        async for line in _lines(chunks):
+            record.append(line.decode())
+            # a record ends with its quotes balanced, escaped quotes are doubled
+            if sum(part.count('"') for part in record) % 2:
+                continue
+            text, record = "\n".join(record), []
+            if not text.strip():
+                continue
+            if self.header is None:
+                self.header = _csv_fields(text)
+                continue
+            yield text
+        if record and self.header is not None:
+            # unbalanced quotes, the row fails as it is
+            yield "\n".join(record)
+
+    def convert(self, record):
+        values = _csv_fields(record)
+        if len(values) != len(self.header):
+            raise ValueError(f"Row has {len(values)} fields, header has {len(self.header)}")
+        return self._coerce(dict(zip(self.header, values)))
+
+
+class ParquetReader(Reader):
+    """parquet files end with their metadata, the body is spooled before reading it."""
+
+    async def rows(self, chunks):
+        pa = _arrow()
+        loop = asyncio.get_event_loop()
+        with tempfile.SpooledTemporaryFile(PARQUET_SPOOL_SIZE) as body:
+            async for chunk in chunks:
+                body.write(chunk)
+            body.seek(0)
+            batches = pa.parquet.ParquetFile(body).iter_batches()
+            while True:
+                batch = await loop.run_in_executor(None, next, batches, None)
+                if batch is None:
+                    return
+                for row in batch.to_pylist():
+                    yield row
+
+    def convert(self, row):
+        return self._coerce(row)
+
+
+READERS = {"ndjson": NDJSONReader, "csv": CSVReader, "parquet": ParquetReader}
+
+
+def reader(fmt, columns):
+    """Reader of fmt for a table described by columns ({name, datatype})."""
+    _check(fmt)
+    return READERS[fmt](columns)
@@ -2,15 +2,24 @@
 #  Copyright (c) 2020 Intel Corporation
 #!/bin/env python
 
+import functools
 import json
+import os
 import urllib.parse
 
+import sanic
+
 import driver
+import formats
+from logger import logger
+
+app = sanic.Sanic("cassandra_driver")
 
-import flask
-from flask import request
+# one process is enough for most loads, requests of a worker share its sessions
+DRIVER_WORKERS = int(os.environ.get("DRIVER_WORKERS", 1))
 
-app = flask.Flask("cassandra_driver")
+# rows hold uuids, dates and other values json can't encode
+_dumps = functools.partial(json.dumps, default=str)
 
 
 def decode_headers(req):
@@ -19,63 +28,211 @@ def decode_headers(req):
     return metadata, hosts
 
 
-def get_client(req):
+async def get_client(req):
     try:
         metadata, hosts = decode_headers(req)
     except json.decoder.JSONDecodeError:
         return None, "Metadata is not JSON object"
     if hosts[0] == '':
         return None, "Missing hosts"
-    client = driver.Client(hosts, metadata)
+    try:
+        client = await driver.pool.lease(hosts, metadata)
+    except (KeyError, ValueError) as exc:
+        return None, f"Invalid metadata or hosts: {exc}"
     return client, None
 
 
+def with_client(handler):
+    """call handler with the client of the request, leased until the
+    response is sent, a streamed body included."""
+    @functools.wraps(handler)
+    async def wrapper(request, *args, **kwargs):
+        client, error = await get_client(request)
+        if error:
+            return bad_request(error)
+        streamed = False
+        try:
+            response = await handler(request, client, *args, **kwargs)
+            if isinstance(response, sanic.response.StreamingHTTPResponse):
+                send = response.streaming_fn
+
+                async def streaming_fn(resp):
+                    try:
+                        await send(resp)
+                    finally:
+                        driver.pool.release(client)
+                response.streaming_fn = streaming_fn
+                streamed = True
+            return response
+        finally:
+            if not streamed:
+                driver.pool.release(client)
+    return wrapper
+
+
+def _int_arg(req, name):
+    value = req.args.get(name)
+    return int(value) if value is not None else None
+
+
+def bad_request(error):
+    return sanic.response.text(error, status=400)
+
+
+def jsonify(body):
+    return sanic.response.json(body, dumps=_dumps)
+
+
+def _ndjson(rows):
+    """streaming response with one JSON document per row, sent as rows are fetched."""
+    async def send(response):
+        try:
+            async for row in rows:
+                await response.write(_dumps(row) + "\n")
+        finally:
+            # the client may be gone, stop paging
+            await rows.aclose()
+    return sanic.response.stream(send, content_type="application/x-ndjson")
+
+
+def _chunked(chunks, content_type):
+    """streaming response sending chunks as they are produced."""
+    async def send(response):
+        try:
+            async for chunk in chunks:
+                await response.write(chunk)
+        finally:
+            # the client may be gone, stop producing
+            await chunks.aclose()
+    return sanic.response.stream(send, content_type=content_type)
+
+
+async def _body(req):
+    """chunks of a streamed request body."""
+    while True:
+        chunk = await req.stream.read()
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _ndjson_lines(req):
+    """lines of a streamed request body."""
+    pending = b""
+    async for chunk in _body(req):
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+async def _bulk_rows(req):
+    """rows of a bulk request, a JSON array or one JSON object per line.
+
+    NDJSON lines are decoded by the client, so a bad line only fails its row.
+    """
+    if req.headers.get("content-type", "").startswith("application/x-ndjson"):
+        return _ndjson_lines(req)
+    body = b""
+    async for chunk in _body(req):
+        body += chunk
+    rows = json.loads(body)
+    if not isinstance(rows, list):
+        raise ValueError("Body is not a JSON array")
+    return rows
+
+
 @app.route("/ping", methods=["GET"])
-def ping():
-    client, error = get_client(request)
-    if error or not client.heartbeat():
-        return error, 400
-    return flask.jsonify({"status": "Ok"})
+@with_client
+async def ping(request, client):
+    if not client.heartbeat():
+        return bad_request("No keyspace metadata, cluster is unreachable")
+    return jsonify({"status": "Ok"})
+
+
+@app.route("/sessions", methods=["GET"])
+async def sessions(request):
+    return jsonify(driver.pool.stats())
 
 
 @app.route("/table", methods=["GET", "POST"])
-def tables():
-    client, error = get_client(request)
-    if error:
-        return error, 400
+@with_client
+async def tables(request, client):
     if request.method == 'POST':
-        resp = client.create_table(json.loads(request.data))
+        resp = await client.create_table(request.json)
     else:
         resp = client.list_tables()
-    return flask.jsonify(resp)
+    return jsonify(resp)
 
 
 @app.route("/table/<table_name>", methods=["GET"])
-def table(table_name):
-    client, error = get_client(request)
-    if error:
-        return error, 400
-    resp = client.describe_table(table_name)
-    return flask.jsonify(resp)
+@with_client
+async def table(request, client, table_name):
+    try:
+        resp = client.describe_table(table_name)
+    except KeyError:
+        return bad_request(f"Table {table_name} not found in keyspace {client.ks}")
+    return jsonify(resp)
 
 
 @app.route("/table/<table_name>/record", methods=["GET", "POST", "PUT", "DELETE"])
-def records(table_name):
-    client, error = get_client(request)
-    if error:
-        return error, 400
-    # TODO: Need to add error handling
-    if request.method == 'POST':
-        resp = client.insert_into(table_name, json.loads(request.data))
-    elif request.method == 'PUT':
-        resp = client.update_from(table_name, json.loads(request.data))
-    elif request.method == 'DELETE':
-        resp = client.delete_from(table_name, json.loads(request.data))
-    else:
-        filters = urllib.parse.parse_qs(request.query_string.decode('utf-8'))
-        resp = client.select_from(table_name, filters)
-    return flask.jsonify(resp)
+@with_client
+async def records(request, client, table_name):
+    try:
+        if request.method == 'POST':
+            resp = await client.insert_into(table_name, json.loads(request.body))
+        elif request.method == 'PUT':
+            resp = await client.update_from(table_name, json.loads(request.body))
+        elif request.method == 'DELETE':
+            resp = await client.delete_from(table_name, json.loads(request.body))
+        else:
+            filters = urllib.parse.parse_qs(request.query_string)
+            if filters.get("format") == ["ndjson"]:
+                return _ndjson(await client.stream_from(table_name, filters))
+            resp = await client.select_from(table_name, filters)
+    except (KeyError, ValueError) as exc:
+        return bad_request(f"Invalid request: {exc}")
+    return jsonify(resp)
+
+
+@app.route("/table/<table_name>/bulk", methods=["POST"], stream=True)
+@with_client
+async def bulk_records(request, client, table_name):
+    try:
+        resp = await client.bulk_insert(table_name, await _bulk_rows(request),
+                                        ttl=_int_arg(request, "ttl"), timestamp=_int_arg(request, "timestamp"))
+    except (KeyError, ValueError) as exc:
+        return bad_request(f"Invalid request: {exc}")
+    return jsonify(resp)
+
+
+@app.route("/table/<table_name>/export", methods=["GET"])
+@with_client
+async def export_table(request, client, table_name):
+    fmt = request.args.get("format", "ndjson")
+    try:
+        columns, pages = await client.export_from(table_name, splits=_int_arg(request, "splits"))
+        chunks = formats.encode(fmt, columns, pages)
+    except (KeyError, ValueError) as exc:
+        return bad_request(f"Invalid request: {exc}")
+    return _chunked(chunks, formats.MEDIA_TYPES[fmt])
+
+
+@app.route("/table/<table_name>/import", methods=["POST"], stream=True)
+@with_client
+async def import_table(request, client, table_name):
+    try:
+        reader = formats.reader(request.args.get("format", "ndjson"), client.describe_table(table_name)["columns"])
+        resp = await client.bulk_insert(table_name, reader.rows(_body(request)), convert=reader.convert,
+                                        ttl=_int_arg(request, "ttl"), timestamp=_int_arg(request, "timestamp"))
+    except (KeyError, ValueError) as exc:
+        return bad_request(f"Invalid request: {exc}")
+    return jsonify(resp)
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5055)
+    logger.debug(f"Starting cassandra driver with {DRIVER_WORKERS} workers")
+    app.run(host="0.0.0.0", port=5055, workers=DRIVER_WORKERS, access_log=False)
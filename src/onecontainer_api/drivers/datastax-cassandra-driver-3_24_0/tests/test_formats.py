@@ -0,0 +1,85 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import formats  # noqa: E402
+
+COLUMNS = [("id", "int"), ("name", "text"), ("score", "double"), ("flag", "boolean"),
+           ("data", "blob"), ("tags", "list<text>")]
+ROWS = [
+    (1, "plain", 1.5, True, b"\x00\xff", ["a", "b"]),
+    (2, 'line one\n"quoted", line two\r\nend', -2.0, False, b"", []),
+    (3, "", None, None, None, None),
+    (4, None, 0.0, True, b"x", ["with, comma"]),
+]
+
+
+async def _pages(rows):
+    # two pages
+    yield rows[:2]
+    yield rows[2:]
+
+
+async def _chunks(body, size=7):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+def export(fmt, rows=ROWS):
+    return b"".join(asyncio.run(_collect(formats.encode(fmt, COLUMNS, _pages(rows)))))
+
+
+def load(fmt, body):
+    reader = formats.reader(fmt, [{"name": name, "datatype": cql_type} for name, cql_type in COLUMNS])
+    rows = asyncio.run(_collect(reader.rows(_chunks(body))))
+    return [reader.convert(row) for row in rows]
+
+
+def expected(rows=ROWS):
+    return [dict(zip([name for name, _ in COLUMNS], row)) for row in rows]
+
+
+@pytest.mark.parametrize("fmt", ["ndjson", "csv", "parquet"])
+def test_round_trip(fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    assert load(fmt, export(fmt)) == expected()
+
+
+class TestCSV:
+
+    def test_multiline_quoted_fields(self):
+        body = export("csv")
+        assert body.count(b"\n") > len(ROWS) + 1
+        assert load("csv", body)[1]["name"] == 'line one\n"quoted", line two\r\nend'
+
+    def test_null_and_empty_text(self):
+        body = export("csv", [ROWS[2], ROWS[3]])
+        assert body.splitlines()[1:] == [b'"3","",,,,', b'"4",,"0.0","True","0x78","[""with, comma""]"']
+        rows = load("csv", body)
+        assert rows[0]["name"] == ""
+        assert rows[1]["name"] is None
+
+    def test_unquoted_fields(self):
+        body = b"id,name,score,flag,data,tags\r\n5,some text,3,false,0x01,\r\n"
+        assert load("csv", body) == [
+            {"id": 5, "name": "some text", "score": 3.0, "flag": False, "data": b"\x01", "tags": None}
+        ]
+
+    def test_bad_row_fails_alone(self):
+        reader = formats.reader("csv", [{"name": name, "datatype": cql_type} for name, cql_type in COLUMNS])
+        body = b'id,name,score,flag,data,tags\n"6"x,,,,,\n7,,,,,\n'
+        bad, good = asyncio.run(_collect(reader.rows(_chunks(body))))
+        with pytest.raises(ValueError):
+            reader.convert(bad)
+        assert reader.convert(good)["id"] == 7
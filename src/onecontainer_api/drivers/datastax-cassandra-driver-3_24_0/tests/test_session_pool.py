@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("cassandra")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import driver  # noqa: E402
+
+
+class StubClient:
+    """Client without a cluster, records the clients built and shut down."""
+
+    created = []
+    closed = []
+    # set in the threads that built a client
+    local = threading.local()
+
+    def __init__(self, hosts, metadata):
+        time.sleep(0.01)
+        self.hosts = hosts
+        self.ks = metadata["keyspace"]
+        self.cluster = SimpleNamespace(is_shutdown=False)
+        StubClient.created.append(self)
+        StubClient.local.connected = True
+
+    def shutdown(self):
+        self.cluster.is_shutdown = True
+        StubClient.closed.append(self)
+
+
+class SlowLock:
+    """pool lock of which connecting threads wait after each release, to widen races."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+        if getattr(StubClient.local, "connected", False):
+            time.sleep(0.005)
+
+
+class TestSessionPool():
+
+    def setup_method(self):
+        StubClient.created, StubClient.closed = [], []
+        self.pool = driver.SessionPool(maxsize=64, idle_timeout=0)
+
+    def teardown_method(self):
+        self.pool.close()
+
+    def test_one_client_per_key(self, monkeypatch):
+        monkeypatch.setattr(driver, "Client", StubClient)
+        self.pool._lock = SlowLock()
+        for round_ in range(5):
+            metadata = {"keyspace": f"ks{round_}"}
+            clients = []
+
+            def get(delay):
+                time.sleep(delay)
+                clients.append(self.pool.get(["127.0.0.1"], metadata))
+            # threads keep coming while the first one connects and stores its client
+            threads = [threading.Thread(target=get, args=(i * 0.001,)) for i in range(32)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len({id(client) for client in clients}) == 1
+        assert len(StubClient.created) == 5
+        assert StubClient.closed == []
+
+    def test_leased_clients_are_kept(self, monkeypatch):
+        monkeypatch.setattr(driver, "Client", StubClient)
+        self.pool.maxsize = 1
+        leased = self.pool.get(["127.0.0.1"], {"keyspace": "leased"}, lease=True)
+        other = self.pool.get(["127.0.0.1"], {"keyspace": "other"})
+        assert StubClient.closed == []
+        third = self.pool.get(["127.0.0.1"], {"keyspace": "third"})
+        assert StubClient.closed == [other]
+        assert not third.cluster.is_shutdown
+        self.pool.release(leased)
+        assert self.pool.stats()["leases"] == 0
+        assert not leased.cluster.is_shutdown
@@ -68,13 +68,30 @@ async def predict(request):
         for img in data["img"]:
             b64_img = img.body
             # img_bytes = base64.b64decode(b64_img)
-            results.append(json.loads(await client.predict(b64_img)))
+            results.append(json.loads(await client.predict(b64_img, request.args.get("model"))))
         return sanic.response.json({"results": results})
     return sanic.response.json(
         {"status": "not image file in request data with key `img`"}
     )
 
 
+@app.route("/predict_batch", methods=["POST"])
+async def predict_batch(request):
+    """predict - classify all images sent in a single backend call."""
+    data = request.files
+    logger.debug("client api - predict_batch")
+    client, error = get_client(request)
+    if error:
+        return error, 400
+    if data.get("img", None):
+        imgs = [img.body for img in data["img"]]
+        resp = await client.predict_batch(imgs, request.args.get("model"))
+        return sanic.response.json(json.loads(resp))
+    return sanic.response.json(
+        {"status": "not image file in request data with key `img`"}
+    )
+
+
 @app.route("/serve", methods=["POST"])
 async def serve(request):
     """load and init model"""
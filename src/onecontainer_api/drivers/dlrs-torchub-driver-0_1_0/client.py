@@ -32,12 +32,26 @@ class Client:
     #        async with sess.get(f"{self.url}/serve") as resp:
     #            return await resp.json()
 
-    async def predict(self, img):
+    async def predict(self, img, model=None):
         """takes in an image and returns the response."""
         async with self.session as sess:
             async with sess.post(
                 f"{self.url}/predict",
                 data={"img": img, "content_type": "application/octet-stream"},
+                params={"model": model} if model else None,
+            ) as resp:
+                return await resp.text()
+
+    async def predict_batch(self, imgs, model=None):
+        """takes in a list of images and returns the response."""
+        form = aiohttp.FormData()
+        for img in imgs:
+            form.add_field("img", img, content_type="application/octet-stream")
+        async with self.session as sess:
+            async with sess.post(
+                f"{self.url}/predict_batch",
+                data=form,
+                params={"model": model} if model else None,
             ) as resp:
                 return await resp.text()
 
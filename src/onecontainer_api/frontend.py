@@ -7,8 +7,8 @@ from fastapi import FastAPI, Request, status
 from fastapi.exceptions import RequestValidationError, ValidationError
 from fastapi.responses import JSONResponse
 
-from onecontainer_api.routers import ai, db, media, services, drivers, queues
-from onecontainer_api import models, errors, startup_svc
+from onecontainer_api.routers import ai, batches, db, media, services, drivers, queues
+from onecontainer_api import cache, jobs, models, errors, startup_svc, transport
 
 models.Base.metadata.create_all(bind=models.engine)
 
@@ -22,6 +22,8 @@ app.include_router(db.router, tags=["service_api"])
 app.include_router(media.router, tags=["service_api"])
 app.include_router(services.router, tags=["management_api"])
 app.include_router(drivers.router, tags=["management_api"])
+# /job/batch routes go before the /job/{job_id} ones
+app.include_router(batches.router, tags=["service_api"])
 app.include_router(queues.router, tags=["service_api"])
 
 
@@ -29,10 +31,18 @@ app.include_router(queues.router, tags=["service_api"])
 async def startup():
     await models.db.connect()
     await startup_svc.startup()
+    drivers.endpoints.watch()
+    # rows a previous gateway stored but didn't flush
+    await db.buffers.recover()
 
 
 @app.on_event("shutdown")
 async def shutdown():
+    drivers.endpoints.stop()
+    # buffered inserts go through the driver transport, flush them first
+    await db.buffers.close()
+    await transport.close()
+    await jobs.close()
     await models.db.disconnect()
 
 
@@ -91,3 +101,17 @@ async def service_exception_handler(request: Request, exc: errors.ServiceExcepti
 def index():
     return {"msg": "system onecontainer api"}
 
+
+@app.get("/cache/stats", tags=["management_api"],
+    description="Hit and miss counters of the gateway caches")
+async def cache_stats():
+    return {
+        "service": services.service_cache.stats(),
+        "response": cache.responses.stats(),
+    }
+
+
+@app.get("/db/buffers/stats", tags=["management_api"],
+    description="Queue depth and flush latency of the buffered db inserts")
+async def buffer_stats():
+    return db.buffers.stats()
@@ -0,0 +1,329 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""write-behind buffers for high rate record inserts.
+
+A buffered insert is acknowledged once its row is stored, rows sharing a
+key are then flushed together, in batches of batch_size rows or with the
+rows stored after interval seconds, whichever comes first. A batch leaves
+the store once flushed, failed flushes are retried until they succeed and
+inserts wait while max_rows rows of a key are stored, acknowledged rows
+are never dropped, only rows the driver rejects are (rows_failed).
+
+RedisStore keeps rows in the queue redis, they outlive the gateway and are
+flushed by the next one (recover), a row whose flush was applied but not
+trimmed before a crash is inserted twice. MemoryStore keeps them in the
+gateway process, close flushes them on shutdown but a crash loses them.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from onecontainer_api import config, errors, jobs
+from onecontainer_api.logger import logger
+
+FlushFunc = Callable[[Hashable, List[Any]], Awaitable[dict]]
+
+# redis keys of the stored rows of a buffer, and the set of buffer keys
+INGEST_PREFIX = "oca:ingest:"
+INGEST_KEYS = "oca:ingest:keys"
+
+
+class MemoryStore:
+    """rows of each key in the gateway process."""
+
+    durable = False
+
+    def __init__(self):
+        self._rows: Dict[Hashable, deque] = {}
+
+    async def push(self, key: Hashable, row: Any):
+        self._rows.setdefault(key, deque()).append(row)
+
+    async def peek(self, key: Hashable, count: int) -> List[Any]:
+        rows = self._rows.get(key, ())
+        return [rows[i] for i in range(min(count, len(rows)))]
+
+    async def trim(self, key: Hashable, count: int):
+        rows = self._rows.get(key)
+        for _ in range(min(count, len(rows or ()))):
+            rows.popleft()
+
+    async def pending(self) -> Dict[Hashable, int]:
+        return {key: len(rows) for key, rows in self._rows.items() if rows}
+
+
+class RedisStore:
+    """rows of each key in a list of the queue redis, as JSON."""
+
+    durable = True
+
+    @staticmethod
+    def _list(key: Hashable) -> str:
+        return INGEST_PREFIX + json.dumps(key)
+
+    async def _call(self, command: Callable[[Any], Awaitable[Any]]):
+        try:
+            return await command(await jobs.get_pool())
+        except (OSError, jobs.aioredis.RedisError) as exc:
+            raise errors.ServiceException(config.QUEUE_REDIS_HOST, errors.QAPI_UNREACH_ERROR,
+                                          f"Queue redis: {exc}")
+
+    async def push(self, key: Hashable, row: Any):
+        async def push(redis):
+            tr = redis.multi_exec()
+            tr.sadd(INGEST_KEYS, json.dumps(key))
+            tr.rpush(self._list(key), json.dumps(row))
+            await tr.execute()
+        await self._call(push)
+
+    async def peek(self, key: Hashable, count: int) -> List[Any]:
+        rows = await self._call(lambda redis: redis.lrange(self._list(key), 0, count - 1))
+        return [json.loads(row) for row in rows]
+
+    async def trim(self, key: Hashable, count: int):
+        await self._call(lambda redis: redis.ltrim(self._list(key), count, -1))
+
+    async def pending(self) -> Dict[Hashable, int]:
+        async def pending(redis):
+            counts = {}
+            for raw in await redis.smembers(INGEST_KEYS, encoding="utf-8"):
+                key = json.loads(raw)
+                key = tuple(key) if isinstance(key, list) else key
+                counts[key] = await redis.llen(self._list(key))
+            return {key: count for key, count in counts.items() if count}
+        return await self._call(pending)
+
+
+def default_store():
+    """RedisStore with INGEST_STORE=redis and aioredis installed, else MemoryStore."""
+    if config.INGEST_STORE == "redis" and jobs.available():
+        return RedisStore()
+    return MemoryStore()
+
+
+class FlushStats:
+    """counters of the flushes of a buffer, latencies in seconds."""
+
+    def __init__(self):
+        self.flushes = 0
+        self.rows_applied = 0
+        self.rows_failed = 0
+        self.flush_errors = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self.last_error = None
+
+    def flushed(self, report: dict, latency: float):
+        self.flushes += 1
+        self.rows_applied += report.get("applied", 0)
+        self.rows_failed += report.get("failed", 0)
+        if report.get("errors"):
+            self.last_error = report["errors"][0].get("error")
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+
+    def failed(self, exc: Exception):
+        self.flush_errors += 1
+        self.last_error = str(exc)
+
+    def dict(self):
+        return {
+            "flushes": self.flushes,
+            "rows_applied": self.rows_applied,
+            "rows_failed": self.rows_failed,
+            "flush_errors": self.flush_errors,
+            "flush_latency": {
+                "last": round(self.last_latency, 4),
+                "avg": round(self.total_latency / self.flushes, 4) if self.flushes else 0.0,
+                "max": round(self.max_latency, 4),
+            },
+            "last_error": self.last_error,
+        }
+
+
+class WriteBuffer:
+    """stored rows of one key and the task flushing them
+
+    The flush task only runs while there are rows, one batch is sent at a
+    time and trimmed from the store once flushed, so rows of a key reach
+    the driver in order. put waits while max_rows rows are stored.
+    """
+
+    def __init__(self, key: Hashable, flush: FlushFunc, store, batch_size: int, interval: float,
+                 max_rows: int, retries: int, max_delay: float = config.INGEST_RETRY_MAX_DELAY):
+        self.key = key
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_rows = max_rows
+        self.retries = retries
+        self.max_delay = max_delay
+        self.queued = 0
+        self.in_flight = 0
+        self.stats = FlushStats()
+        self._flush = flush
+        self._storing = 0
+        self._full = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def put(self, row: Any) -> int:
+        """store a row, returns the rows queued for the key."""
+        async with self._space:
+            await self._space.wait_for(
+                lambda: self.queued + self.in_flight + self._storing < self.max_rows)
+            self._storing += 1
+        try:
+            await self.store.push(self.key, row)
+        finally:
+            self._storing -= 1
+        self.queued += 1
+        self._wake()
+        return self.queued
+
+    def restore(self, count: int):
+        """rows left in the store by a previous gateway, flushed first."""
+        self.queued += count
+        self._wake()
+
+    def _wake(self):
+        if self.queued >= self.batch_size:
+            self._full.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self.queued:
+            if self.queued < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            try:
+                batch = await self.store.peek(self.key, self.batch_size)
+            except Exception as exc:
+                if not await self._failed(exc, 0):
+                    break
+                continue
+            if not batch:
+                # the stored rows went away, e.g. the redis was flushed
+                self.queued = 0
+                break
+            self.queued -= len(batch)
+            self.in_flight = len(batch)
+            flushed = await self._send(batch)
+            self.in_flight = 0
+            if not flushed:
+                self.queued += len(batch)
+                break
+            async with self._space:
+                self._space.notify_all()
+        self._task = None
+
+    async def _send(self, batch: List[Any]) -> bool:
+        """flush and trim a batch, retrying until it succeeds, False if closed before."""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                report = await self._flush(self.key, batch)
+                break
+            except Exception as exc:
+                if not await self._failed(exc, attempt):
+                    return False
+                attempt += 1
+        self.stats.flushed(report if isinstance(report, dict) else {"applied": len(batch)},
+                           time.monotonic() - start)
+        attempt = 0
+        while True:
+            try:
+                await self.store.trim(self.key, len(batch))
+                return True
+            except Exception as exc:
+                if not await self._failed(exc, attempt):
+                    return False
+                attempt += 1
+
+    async def _failed(self, exc: Exception, attempt: int) -> bool:
+        """count a failure and back off, False when closing after retries."""
+        self.stats.failed(exc)
+        if self._closing and attempt >= self.retries:
+            kept = "kept in the store" if self.store.durable else "lost"
+            logger.error(f"Closing with {self.queued + self.in_flight} rows of {self.key} not flushed, "
+                         f"{kept}: {exc}")
+            return False
+        logger.warning(f"Flush of {self.key} failed, retrying: {exc}")
+        await asyncio.sleep(min(0.1 * 2 ** attempt, self.max_delay))
+        return True
+
+    async def close(self):
+        """flush every stored row without waiting for interval."""
+        self._closing = True
+        self._full.set()
+        if self._task is not None:
+            await self._task
+
+    def dict(self):
+        return {"queued": self.queued, "in_flight": self.in_flight, **self.stats.dict()}
+
+
+class WriteBehind:
+    """WriteBuffer of each key, created on first put."""
+
+    def __init__(self, flush: FlushFunc, batch_size: int = config.INGEST_BATCH_SIZE,
+                 interval: float = config.INGEST_FLUSH_INTERVAL, max_rows: int = config.INGEST_MAX_ROWS,
+                 retries: int = config.INGEST_FLUSH_RETRIES, store=None):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_rows = max_rows
+        self.retries = retries
+        self.store = store if store is not None else MemoryStore()
+        self._buffers: Dict[Hashable, WriteBuffer] = {}
+
+    def _buffer(self, key: Hashable) -> WriteBuffer:
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = WriteBuffer(key, self.flush, self.store, self.batch_size, self.interval,
+                                 self.max_rows, self.retries)
+            self._buffers[key] = buffer
+        return buffer
+
+    async def put(self, key: Hashable, row: Any) -> int:
+        return await self._buffer(key).put(row)
+
+    async def recover(self):
+        """flush the rows a previous gateway left in a durable store."""
+        if not self.store.durable:
+            return
+        try:
+            pending = await self.store.pending()
+        except errors.ServiceException as exc:
+            logger.warning(f"Buffered rows not recovered: {exc.detail}")
+            return
+        for key, count in pending.items():
+            logger.debug(f"Recovering {count} buffered rows of {key}")
+            self._buffer(key).restore(count)
+
+    async def close(self):
+        """flush all buffers, used on application shutdown."""
+        await asyncio.gather(*[buffer.close() for buffer in self._buffers.values()])
+
+    def stats(self):
+        buffers = {":".join(str(part) for part in key if part is not None): buffer.dict()
+                   for key, buffer in self._buffers.items()}
+        return {
+            "store": "redis" if self.store.durable else "memory",
+            "queued": sum(buffer["queued"] for buffer in buffers.values()),
+            "in_flight": sum(buffer["in_flight"] for buffer in buffers.values()),
+            "batch_size": self.batch_size,
+            "flush_interval": self.interval,
+            "max_rows": self.max_rows,
+            "buffers": buffers,
+        }
@@ -0,0 +1,294 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""jobs of the async queue, written straight to the queue redis.
+
+Jobs have the schema of async_queue/job_queue.enqueue_job, taken from
+async_queue/job_schema: an rq job of job_queue.worker with the driver call
+as kwargs, 3 retries, and uploads packed as async_queue/blob_store does
+with its redis store. They are built
+with rq and written in one MULTI over a pooled aioredis connection, so an
+async call costs a redis round trip instead of two queue api requests.
+
+Jobs are read back the same way, and watch follows their status through
+redis keyspace notifications of the job hashes (notify-keyspace-events Kh
+in the queue redis), read every JOB_POLL_INTERVAL seconds without them.
+Job batches are lists of job ids under oca:batch:<id>, enqueued in the
+same MULTI as their jobs.
+
+Needs rq and aioredis 1.x, without them, or with QUEUE_BACKEND=api, jobs
+are posted to the queue api.
+"""
+import asyncio
+import pickle
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from starlette.datastructures import UploadFile
+
+from onecontainer_api import config, errors, transport
+from onecontainer_api.async_queue import job_schema
+from onecontainer_api.logger import logger
+
+try:
+    import aioredis
+    from redis import Redis
+    from rq.job import Job, JobStatus
+    from rq.utils import utcnow
+except ImportError as exc:
+    logger.debug(f"Jobs are enqueued through the queue api: {exc}")
+    aioredis = None
+
+# rq keys
+QUEUES_KEY = "rq:queues"
+QUEUE_PREFIX = "rq:queue:"
+JOB_PREFIX = "rq:job:"
+BATCH_PREFIX = "oca:batch:"
+# statuses a job doesn't leave, jobs with retries left go back to queued
+DONE_STATUSES = ("finished", "failed", "stopped", "canceled")
+KEYSPACE_CHANNEL = f"__keyspace@{config.QUEUE_REDIS_DB}__:{JOB_PREFIX}"
+
+_pool = None
+_pool_lock = None
+# only used by rq to build jobs, never connects
+_connection = None
+# job id: change queues of its watchers, fed by the _listen task
+_watchers: Dict[str, Set[asyncio.Queue]] = {}
+_listener = None
+
+
+def available():
+    return aioredis is not None
+
+
+async def get_pool():
+    """pooled connection to the queue redis, created on first use."""
+    global _pool, _pool_lock
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None or _pool.closed:
+            logger.debug(f"Connecting to queue redis {config.QUEUE_REDIS_HOST}:{config.QUEUE_REDIS_PORT}")
+            _pool = await aioredis.create_redis_pool(
+                (config.QUEUE_REDIS_HOST, config.QUEUE_REDIS_PORT), db=config.QUEUE_REDIS_DB,
+                maxsize=config.QUEUE_REDIS_POOL_SIZE)
+    return _pool
+
+
+async def close():
+    """close the redis pool, used on application shutdown."""
+    global _pool
+    if _listener is not None:
+        listener = _listener
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
+async def _pack_upload(redis, upload: UploadFile, ttl: Optional[int]):
+    """blob_store.pack_upload of an upload, blobs always go to redis."""
+    ttl = ttl or job_schema.BLOB_TTL
+    await upload.seek(0)
+    content = await upload.read(job_schema.BLOB_INLINE_MAX + 1)
+    if len(content) <= job_schema.BLOB_INLINE_MAX:
+        return job_schema.inline_ref(upload.filename, content)
+    blob_id = str(uuid.uuid4())
+    size = 0
+    while content:
+        await redis.append(job_schema.blob_data_key(blob_id), content)
+        size += len(content)
+        content = await upload.read(job_schema.BLOB_CHUNK_SIZE)
+    await redis.expire(job_schema.blob_data_key(blob_id), ttl)
+    await redis.set(job_schema.blob_refs_key(blob_id), 1, expire=ttl)
+    return job_schema.blob_ref(upload.filename, blob_id, "redis", size)
+
+
+async def _pack(redis, data: Any, ttl: Optional[int]):
+    if isinstance(data, UploadFile):
+        return await _pack_upload(redis, data, ttl)
+    if transport.is_upload_list(data):
+        return [await _pack_upload(redis, upload, ttl) for upload in data]
+    return data
+
+
+def build_job(name: str, url: str, method: str, headers: dict, data: Any, ttl: Optional[int]):
+    """rq job of a driver call, as job_queue.enqueue_job makes it."""
+    global _connection
+    if _connection is None:
+        _connection = Redis(config.QUEUE_REDIS_HOST, config.QUEUE_REDIS_PORT, config.QUEUE_REDIS_DB)
+    job = Job.create(job_schema.WORKER_FUNC, kwargs=job_schema.job_kwargs(method, url, headers, data),
+                     connection=_connection, result_ttl=ttl or job_schema.JOB_RESULT_TTL,
+                     timeout=job_schema.JOB_TIMEOUT, status=JobStatus.QUEUED, origin=name)
+    job.retries_left = job_schema.JOB_RETRIES
+    job.retry_intervals = [0]
+    job.enqueued_at = utcnow()
+    return job
+
+
+async def enqueue_many(calls: List[tuple], ttl: Optional[int], batch_id: Optional[str] = None):
+    """enqueue (name, url, method, headers, data) driver calls in one MULTI
+
+    Returns the jobs like job_queue.enqueue_job. With a batch_id, the job
+    ids are also listed under the batch, kept as long as their results.
+    """
+    try:
+        redis = await get_pool()
+        built = [build_job(name, url, method, headers, await _pack(redis, data, ttl), ttl)
+                 for name, url, method, headers, data in calls]
+        tr = redis.multi_exec()
+        lengths = []
+        for job in built:
+            tr.sadd(QUEUES_KEY, f"{QUEUE_PREFIX}{job.origin}")
+            tr.hmset_dict(job.key, job.to_dict())
+            lengths.append(tr.rpush(f"{QUEUE_PREFIX}{job.origin}", job.id))
+        if batch_id is not None:
+            tr.rpush(f"{BATCH_PREFIX}{batch_id}", *[job.id for job in built])
+            tr.expire(f"{BATCH_PREFIX}{batch_id}", ttl or job_schema.JOB_RESULT_TTL)
+        await tr.execute()
+        lengths = await asyncio.gather(*lengths)
+    except (OSError, aioredis.RedisError) as exc:
+        raise errors.ServiceException(config.QUEUE_REDIS_HOST, errors.QAPI_UNREACH_ERROR, f"Queue redis: {exc}")
+    return [{
+        "id": job.id,
+        "status": JobStatus.QUEUED,
+        "queue": job.origin,
+        "position": length - 1,
+    } for job, length in zip(built, lengths)]
+
+
+async def enqueue(name: str, url: str, method: str, headers: dict, data: Any, ttl: Optional[int]):
+    """enqueue a driver call, returns the job like job_queue.enqueue_job."""
+    job, = await enqueue_many([(name, url, method, headers, data)], ttl)
+    return job
+
+
+async def batch_jobs(batch_id: str) -> List[str]:
+    """ids of the jobs of a batch, empty once the batch expired."""
+    try:
+        redis = await get_pool()
+        return await redis.lrange(f"{BATCH_PREFIX}{batch_id}", 0, -1, encoding="utf-8")
+    except (OSError, aioredis.RedisError) as exc:
+        raise errors.ServiceException(config.QUEUE_REDIS_HOST, errors.QAPI_UNREACH_ERROR, f"Queue redis: {exc}")
+
+
+def _load_result(raw: Optional[bytes]):
+    if raw is None:
+        return None
+    try:
+        return pickle.loads(raw)
+    except Exception:
+        return "Unserializable return value"
+
+
+async def _position(redis, queue: str, job_id: str):
+    key = f"{QUEUE_PREFIX}{queue}"
+    try:
+        return await redis.execute(b"LPOS", key, job_id)
+    except aioredis.ReplyError:
+        # LPOS needs redis 6.0.6
+        job_ids = await redis.lrange(key, 0, -1, encoding="utf-8")
+        return job_ids.index(job_id) if job_id in job_ids else None
+
+
+async def fetch_many(job_ids: List[str], positions: bool = True) -> List[Optional[dict]]:
+    """jobs like job_queue.fetch_job returns them, None for unknown ids.
+
+    Job hashes are read in one pipeline, positions of queued jobs, unless
+    positions is False, in a second.
+    """
+    try:
+        redis = await get_pool()
+        pipe = redis.pipeline()
+        for job_id in job_ids:
+            pipe.hmget(f"{JOB_PREFIX}{job_id}", "status", "origin", "result")
+        fields = await pipe.execute()
+        output = []
+        for status, origin, result in fields:
+            if status is None:
+                output.append(None)
+                continue
+            output.append({
+                "status": status.decode(),
+                "queue": origin.decode() if origin else None,
+                "position": None,
+                "result": _load_result(result),
+            })
+        queued = [(job_id, job) for job_id, job in zip(job_ids, output)
+                  if positions and job and job["status"] == "queued"]
+        found = await asyncio.gather(*[_position(redis, job["queue"], job_id) for job_id, job in queued])
+    except (OSError, aioredis.RedisError) as exc:
+        raise errors.ServiceException(config.QUEUE_REDIS_HOST, errors.QAPI_UNREACH_ERROR, f"Queue redis: {exc}")
+    for (_, job), position in zip(queued, found):
+        job["position"] = position
+    return output
+
+
+async def _listen():
+    """wake the watchers of a job on each change of its hash."""
+    global _listener
+    conn = None
+    try:
+        conn = await aioredis.create_redis((config.QUEUE_REDIS_HOST, config.QUEUE_REDIS_PORT), db=config.QUEUE_REDIS_DB)
+        channel, = await conn.psubscribe(f"{KEYSPACE_CHANNEL}*")
+        while await channel.wait_message():
+            name, _ = await channel.get()
+            job_id = name.decode()[len(KEYSPACE_CHANNEL):]
+            for changes in _watchers.get(job_id, ()):
+                changes.put_nowait(job_id)
+    except (OSError, aioredis.RedisError) as exc:
+        logger.warning(f"No job notifications, jobs are polled: {exc}")
+    finally:
+        _listener = None
+        if conn is not None:
+            conn.close()
+            await conn.wait_closed()
+
+
+async def watch(job_ids: List[str], timeout: float,
+                read: Callable[[List[str]], Awaitable[List[Optional[dict]]]] = fetch_many, notify: bool = True):
+    """yield (job id, job) of each job, then again on each status change
+
+    Stops once every job is done or unknown (yielded as None), or after
+    timeout seconds. Jobs are read with read every JOB_POLL_INTERVAL
+    seconds, and on keyspace notifications with notify.
+    """
+    global _listener
+    job_ids = list(dict.fromkeys(job_ids))
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    changes = asyncio.Queue()
+    if notify:
+        for job_id in job_ids:
+            _watchers.setdefault(job_id, set()).add(changes)
+        if _listener is None:
+            _listener = asyncio.ensure_future(_listen())
+    statuses = {}
+    try:
+        to_read = job_ids
+        while True:
+            for job_id, job in zip(to_read, await read(to_read) if to_read else []):
+                status = job["status"] if job else None
+                if job_id not in statuses or statuses[job_id] != status:
+                    statuses[job_id] = status
+                    yield job_id, job
+            pending = [job_id for job_id in job_ids
+                       if statuses[job_id] is not None and statuses[job_id] not in DONE_STATUSES]
+            remaining = deadline - loop.time()
+            if not pending or remaining <= 0:
+                return
+            try:
+                changed = {await asyncio.wait_for(changes.get(), min(remaining, config.JOB_POLL_INTERVAL))}
+                while not changes.empty():
+                    changed.add(changes.get_nowait())
+                to_read = [job_id for job_id in pending if job_id in changed]
+            except asyncio.TimeoutError:
+                to_read = pending
+    finally:
+        for job_id in job_ids:
+            watchers = _watchers.get(job_id)
+            if watchers is not None:
+                watchers.discard(changes)
+                if not watchers:
+                    del _watchers[job_id]
@@ -1,21 +1,29 @@
 # SPDX-License-Identifier: BSD-3-Clause
 #  Copyright (c) 2020 Intel Corporation
 """AI vertical entrypoint."""
+from typing import List, Optional
+from urllib.parse import urlencode
+
 import databases
-from aiocache import cached
-from aiocache import Cache
 from fastapi import APIRouter, Depends, File, UploadFile
 
-from onecontainer_api import errors, models, schemas
-from onecontainer_api.config import cache_tte
+from onecontainer_api import cache, errors, models, schemas
 from onecontainer_api.routers import drivers, services
 
 router = APIRouter()
 
 
+def _model_path(path: str, model: Optional[str]):
+    """driver path routing the call to a model loaded with serve, by name."""
+    if model:
+        return f"{path}?{urlencode({'model': model})}"
+    return path
+
+
 @router.get(
     "/ai/{service_id}/usage", description="Get functions available for this service"
 )
+@cache.responses.cached("ai.usage")
 async def usage(
     service_id: str,
     sync: bool = False,
@@ -25,7 +33,7 @@ async def usage(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
+        return await drivers.service_stack(
             driver, service, "get", "/usage", sync=sync, ttl=ttl
         )
     raise errors.ServiceException(
@@ -34,7 +42,7 @@ async def usage(
 
 
 @router.post("/ai/{service_id}/serve", description="Load a model")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.invalidates("{service_id}:model")
 async def serve(
     service_id: str,
     model_meta: schemas.AIModelMeta,
@@ -45,7 +53,7 @@ async def serve(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
+        return await drivers.service_stack(
             driver,
             service,
             "post",
@@ -62,10 +70,36 @@ async def serve(
 @router.post(
     "/ai/{service_id}/predict", description="Execute an inference over an image"
 )
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.cached("ai.predict", tags=["{service_id}:model"])
 async def predict(
     service_id: str,
     image_file: UploadFile = File(...),
+    model: Optional[str] = None,
+    sync: bool = False,
+    ttl: int = 3600,
+    db: databases.Database = Depends(models.get_db),
+):
+    service = await services.get_service(service_id, db)
+    if service.driver:
+        driver = await drivers.get_driver(service.driver)
+        return await drivers.service_stack(
+            driver, service, "post", _model_path("/predict", model), data=image_file,
+            sync=sync, ttl=ttl
+        )
+    raise errors.ServiceException(
+        service.id, errors.NO_DRV_ERROR, "Service has no driver assigned"
+    )
+
+
+@router.post(
+    "/ai/{service_id}/predict_batch",
+    description="Execute an inference over a batch of images in a single call",
+)
+@cache.responses.cached("ai.predict_batch", tags=["{service_id}:model"])
+async def predict_batch(
+    service_id: str,
+    image_files: List[UploadFile] = File(...),
+    model: Optional[str] = None,
     sync: bool = False,
     ttl: int = 3600,
     db: databases.Database = Depends(models.get_db),
@@ -73,8 +107,9 @@ async def predict(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
-            driver, service, "post", "/predict", data=image_file, sync=sync, ttl=ttl
+        return await drivers.service_stack(
+            driver, service, "post", _model_path("/predict_batch", model), data=image_files,
+            sync=sync, ttl=ttl
         )
     raise errors.ServiceException(
         service.id, errors.NO_DRV_ERROR, "Service has no driver assigned"
@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""Job batches entrypoint."""
+import uuid
+from collections import Counter
+from functools import partial
+
+import databases
+from fastapi import APIRouter, Depends, Query
+
+from onecontainer_api import config, errors, jobs, models, schemas
+from onecontainer_api.routers import drivers, queues, services
+
+router = APIRouter()
+
+
+@router.post("/job/batch",
+    description="Enqueue async calls to service drivers as one batch")
+async def post_job_batch(batch: schemas.JobBatch, db: databases.Database = Depends(models.get_db)):
+    if not queues.direct():
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_EXEC_ERROR,
+                                      "Job batches need the redis queue backend")
+    if len(batch.jobs) > config.JOB_BATCH_MAX:
+        raise errors.ServiceException("", errors.DATA_ERROR, f"A batch has at most {config.JOB_BATCH_MAX} jobs")
+    # each service and its driver are resolved once for the batch
+    targets = {}
+    for service_id in dict.fromkeys(job.service_id for job in batch.jobs):
+        service = await services.get_service(service_id, db)
+        if not service.driver:
+            raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
+        driver = await drivers.get_driver(service.driver)
+        url, headers = await drivers.driver_url(driver, service, "")
+        targets[service_id] = (service.name, url, headers)
+    calls = []
+    for job in batch.jobs:
+        name, url, headers = targets[job.service_id]
+        calls.append((name, f"{url}{job.route}", job.method.value, headers, job.data))
+    batch_id = str(uuid.uuid4())
+    return {"id": batch_id, "jobs": await jobs.enqueue_many(calls, batch.ttl, batch_id)}
+
+
+@router.get("/job/batch/{batch_id}",
+    description="Progress and results of a batch, wait up to wait seconds for it to be done")
+async def get_job_batch(batch_id: str, wait: float = Query(0, ge=0, le=config.JOB_WAIT_MAX),
+                        results: bool = True):
+    if not queues.direct():
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_EXEC_ERROR,
+                                      "Job batches need the redis queue backend")
+    job_ids = await jobs.batch_jobs(batch_id)
+    if not job_ids:
+        raise errors.ServiceException(batch_id, errors.QAPI_JOB_ERROR, "Batch not found")
+    read = partial(jobs.fetch_many, positions=False)
+    if wait:
+        latest = {}
+        async for job_id, job in jobs.watch(job_ids, wait, read=read):
+            latest[job_id] = job
+        fetched = [latest[job_id] for job_id in job_ids]
+    else:
+        fetched = await read(job_ids)
+    output = []
+    for job_id, job in zip(job_ids, fetched):
+        # results expire with the batch, a job may expire first
+        job = job or {"status": "expired", "queue": None, "result": None}
+        job.pop("position", None)
+        if not results:
+            job.pop("result")
+        output.append({"id": job_id, **job})
+    statuses = Counter(job["status"] for job in output)
+    done = sum(count for status, count in statuses.items() if status in jobs.DONE_STATUSES + ("expired",))
+    return {
+        "id": batch_id,
+        "total": len(output),
+        "done": done,
+        "progress": round(done / len(output), 4),
+        "statuses": dict(statuses),
+        "jobs": output,
+    }
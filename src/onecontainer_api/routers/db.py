@@ -1,108 +1,208 @@
 # SPDX-License-Identifier: BSD-3-Clause
 #  Copyright (c) 2020 Intel Corporation
-from aiocache import Cache
-from aiocache import cached
-from fastapi import APIRouter, Depends
+from typing import Optional
+import urllib.parse
+
+from fastapi import APIRouter, Depends, Query, Request
 import databases
-try:
-    import ujson as json
-except ImportError:
-    import json
+import pydantic
 
-from onecontainer_api import models, errors, schemas
-from onecontainer_api.config import cache_tte
+from onecontainer_api import cache, config, ingest, models, errors, schemas, transport
 from onecontainer_api.routers import services, drivers
 
 router = APIRouter()
 
+EXPORT_MEDIA_TYPES = {
+    schemas.TableFormat.ndjson: "application/x-ndjson",
+    schemas.TableFormat.csv: "text/csv",
+    schemas.TableFormat.parquet: "application/vnd.apache.parquet",
+}
+
+
+def _bulk_path(table_name: str, route: str = "bulk", **options):
+    query = urllib.parse.urlencode({k: v for k, v in options.items() if v is not None})
+    return f"/table/{table_name}/{route}?{query}"
+
+
+async def _flush_records(key, rows):
+    """insert rows buffered for (service_id, table_name, ttl, timestamp) through the bulk path."""
+    service_id, table_name, record_ttl, timestamp = key
+    service = await services.get_service(service_id, models.db)
+    if not service.driver:
+        raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
+    driver = await drivers.get_driver(service.driver)
+    path = _bulk_path(table_name, ttl=record_ttl, timestamp=timestamp)
+    report = await drivers.service_stack(driver, service, "post", path,
+                                         data=transport.ndjson_payload(rows), sync=True)
+    await cache.responses.invalidate(f"{service_id}:records:{table_name}")
+    return report
+
+
+buffers = ingest.WriteBehind(_flush_records, store=ingest.default_store())
+
 
 @router.get("/db/{service_id}/table",
     description="List tables available")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.cached("db.list_table", tags=["{service_id}:tables"], ttl=config.SCHEMA_CACHE_TTL)
 async def list_table(service_id: str, sync: bool = False, ttl: int = 3600, db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(driver, service, "get", "/table", sync=sync, ttl=ttl)
+        return await drivers.service_stack(driver, service, "get", "/table", sync=sync, ttl=ttl)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
 @router.post("/db/{service_id}/table",
     description="Create a new table")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.invalidates("{service_id}:tables", "{service_id}:table:{table.name}")
 async def post_table(service_id: str, table: schemas.Table, sync: bool = False, ttl: int = 3600,
                      db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(driver, service, "post", "/table", data=table.dict(), sync=sync, ttl=ttl)
+        return await drivers.service_stack(driver, service, "post", "/table", data=table.dict(), sync=sync, ttl=ttl)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
 @router.get("/db/{service_id}/table/{table_name}",
     description="List records in a table")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.cached("db.describe_table", tags=["{service_id}:table:{table_name}"],
+                        ttl=config.SCHEMA_CACHE_TTL)
 async def describe_table(service_id: str, table_name: str, sync: bool = False, ttl: int = 3600,
                          db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(driver, service, "get", f"/table/{table_name}", sync=sync, ttl=ttl)
+        return await drivers.service_stack(driver, service, "get", f"/table/{table_name}", sync=sync, ttl=ttl)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
 @router.get("/db/{service_id}/table/{table_name}/record",
-    description="Select records of a table using DQL")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+    description="Select records of a table using DQL, dql_options is a JSON RecordDQLOptions "
+                "with columns, where, filters, order_by and limit. With page_size, one page is returned "
+                "with the token of the next one, with stream, rows are sent as NDJSON as they are read")
+@cache.responses.cached("db.list_records", tags=["{service_id}:records:{table_name}"],
+                        ttl=config.RECORDS_CACHE_TTL)
 async def list_records(service_id: str, table_name: str, sync: bool = False, ttl: int = 3600,
-                       dql_options: str = "", db: databases.Database = Depends(models.get_db)):
+                       dql_options: str = "", page_size: Optional[int] = Query(None, gt=0),
+                       page_token: Optional[str] = None, stream: bool = False,
+                       db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
         path = f"/table/{table_name}/record"
         if dql_options:
             try:
-                json.loads(dql_options)
-            except json.decoder.JSONDecodeError:
-                raise errors.ServiceException(dql_options, errors.DATA_ERROR, "Value is not JSON decodable")
-        return drivers.service_stack(driver, service, "get", path, data={"dql": dql_options}, sync=sync, ttl=ttl)
+                dql = schemas.RecordDQLOptions.parse_raw(dql_options)
+            except pydantic.ValidationError as exc:
+                raise errors.ServiceException(dql_options, errors.DATA_ERROR, f"Value is not a valid DQL query: {exc}")
+            dql_options = dql.json(exclude_none=True)
+        data = {"dql": dql_options, "page_size": page_size, "page_token": page_token}
+        if stream:
+            data["format"] = "ndjson"
+            return await drivers.service_stream(driver, service, "get", path, data=data)
+        return await drivers.service_stack(driver, service, "get", path, data=data, sync=sync, ttl=ttl)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
 @router.post("/db/{service_id}/table/{table_name}/record",
-    description="Insert a record in a table using DML")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+    description="Insert a record in a table using DML. With buffered, the record is acknowledged "
+                "once stored in the queue redis (INGEST_STORE=redis) or in the gateway, stored "
+                "records are inserted in batches through the bulk path, conditions are not supported")
+@cache.responses.invalidates("{service_id}:records:{table_name}")
 async def create_records(service_id: str, table_name: str, dml_options: schemas.RecordDMLOptions,
-                       sync: bool = False, ttl: int = 3600, db: databases.Database = Depends(models.get_db)):
+                       sync: bool = False, ttl: int = 3600, buffered: bool = False,
+                       db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
+    if service.driver and buffered:
+        if dml_options.field_conditions or dml_options.exist_condition:
+            raise errors.ServiceException(table_name, errors.DATA_ERROR, "Buffered inserts can't have conditions")
+        if not dml_options.field_values:
+            raise errors.ServiceException(table_name, errors.DATA_ERROR, "Missing field_values")
+        key = (service.id, table_name, dml_options.ttl, dml_options.timestamp)
+        queued = await buffers.put(key, dml_options.field_values)
+        return {"status": "queued", "queued": queued, "durable": buffers.store.durable}
     if service.driver:
         driver = await drivers.get_driver(service.driver)
         path = f"/table/{table_name}/record"
-        return drivers.service_stack(driver, service, "post", path, data=dml_options.dict(), sync=sync, ttl=ttl)
+        return await drivers.service_stack(driver, service, "post", path, data=dml_options.dict(), sync=sync, ttl=ttl)
+    raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
+
+
+@router.post("/db/{service_id}/table/{table_name}/records:bulk",
+    description="Insert many records in a table, the body is a JSON array of rows or, "
+                "with Content-Type application/x-ndjson, one row per line. Rows are "
+                "{column: value} objects, record_ttl and timestamp apply to all of them. "
+                "Returns applied and failed counts, row errors and rows/sec")
+@cache.responses.invalidates("{service_id}:records:{table_name}")
+async def bulk_records(service_id: str, table_name: str, request: Request,
+                       record_ttl: Optional[int] = Query(None, ge=0), timestamp: Optional[int] = None,
+                       db: databases.Database = Depends(models.get_db)):
+    service = await services.get_service(service_id, db)
+    if service.driver:
+        driver = await drivers.get_driver(service.driver)
+        path = _bulk_path(table_name, ttl=record_ttl, timestamp=timestamp)
+        # the body is relayed as it is received, never held whole by the gateway
+        return await drivers.service_stack(driver, service, "post", path,
+                                           data=transport.relay_payload(request), sync=True)
+    raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
+
+
+@router.get("/db/{service_id}/table/{table_name}/export",
+    description="Export all records of a table, streamed as NDJSON, CSV with a header line or "
+                "Parquet (when the driver has pyarrow). The table is read in splits token ranges, "
+                "several at once, rows are not ordered")
+async def export_table(service_id: str, table_name: str, format: schemas.TableFormat = schemas.TableFormat.ndjson,
+                       splits: Optional[int] = Query(None, gt=0), db: databases.Database = Depends(models.get_db)):
+    service = await services.get_service(service_id, db)
+    if service.driver:
+        driver = await drivers.get_driver(service.driver)
+        path = f"/table/{table_name}/export"
+        return await drivers.service_stream(driver, service, "get", path,
+                                            data={"format": format.value, "splits": splits},
+                                            media_type=EXPORT_MEDIA_TYPES[format])
+    raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
+
+
+@router.post("/db/{service_id}/table/{table_name}/import",
+    description="Import records in a table from a streamed body in the format of export, "
+                "values are read as the type of their column. record_ttl and timestamp apply "
+                "to all rows. Returns applied and failed counts, row errors and rows/sec")
+@cache.responses.invalidates("{service_id}:records:{table_name}")
+async def import_table(service_id: str, table_name: str, request: Request,
+                       format: schemas.TableFormat = schemas.TableFormat.ndjson,
+                       record_ttl: Optional[int] = Query(None, ge=0), timestamp: Optional[int] = None,
+                       db: databases.Database = Depends(models.get_db)):
+    service = await services.get_service(service_id, db)
+    if service.driver:
+        driver = await drivers.get_driver(service.driver)
+        path = _bulk_path(table_name, "import", format=format.value, ttl=record_ttl, timestamp=timestamp)
+        return await drivers.service_stack(driver, service, "post", path,
+                                           data=transport.relay_payload(request), sync=True)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
 @router.put("/db/{service_id}/table/{table_name}/record",
     description="Update records in a table using DML filtering")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.invalidates("{service_id}:records:{table_name}")
 async def update_records(service_id: str, table_name: str, dml_options: schemas.RecordDMLOptions,
                        sync: bool = False, ttl: int = 3600, db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
         path = f"/table/{table_name}/record"
-        return drivers.service_stack(driver, service, "put", path, data=dml_options.dict(), sync=sync, ttl=ttl)
+        return await drivers.service_stack(driver, service, "put", path, data=dml_options.dict(), sync=sync, ttl=ttl)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
 @router.delete("/db/{service_id}/table/{table_name}/record",
     description="Delete records from a table using DML filtering")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.invalidates("{service_id}:records:{table_name}")
 async def delete_records(service_id: str, table_name: str, dml_options: schemas.RecordDMLOptions,
                        sync: bool = False, ttl: int = 3600, db: databases.Database = Depends(models.get_db)):
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
         path = f"/table/{table_name}/record"
-        return drivers.service_stack(driver, service, "delete", path, data=dml_options.dict(), sync=sync, ttl=ttl)
+        return await drivers.service_stack(driver, service, "delete", path, data=dml_options.dict(), sync=sync, ttl=ttl)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
@@ -6,17 +6,20 @@
 from typing import List
 
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from starlette.datastructures import UploadFile
+import aiohttp
 import databases
 import docker
-import requests
 
-from onecontainer_api import models, schemas, config, errors
+from onecontainer_api import models, schemas, config, errors, transport
 from onecontainer_api.routers import queues
 from onecontainer_api.logger import logger
 
+import asyncio
 import json
 import os
+import threading
 import time
 from packaging import version
 
@@ -37,26 +40,38 @@ def match_version(ver: str, match: str):
 
 async def match_drivers(service: schemas.ServiceBase):
     matched_drivers = []
-    drivers = await list_drivers()
-    logger.debug(f"Found {len(drivers)} drivers installed")
     logger.debug(f"Matching driver for {service.app} {service.app_version}")
-    for driver in drivers:
-        if driver.app == service.app and match_version(service.app_version,
-                                                       driver.app_version_match):
+    for driver in catalog.by_app(service.app):
+        if match_version(service.app_version, driver.app_version_match):
             matched_drivers.append(driver)
     return matched_drivers
 
 
-def service_stack(driver: schemas.DriverBase, service: schemas.Service, method: str,
-                  path: str, data: dict = {}, sync: bool = False, ttl: int = 3600):
-    output = ""
+def _driver_request_kwargs(method: str, data):
+    kwargs = {}
+    if method == "get":
+        kwargs["params"] = {k: v for k, v in data.items() if v is not None}
+    elif isinstance(data, UploadFile) or transport.is_upload_list(data):
+        form = aiohttp.FormData()
+        for upload in (data if isinstance(data, list) else [data]):
+            form.add_field('img', transport.upload_payload(upload), filename=upload.filename)
+        kwargs["data"] = form
+    elif isinstance(data, aiohttp.Payload):
+        kwargs["data"] = data
+    elif isinstance(data, dict):
+        kwargs["json"] = data
+    return kwargs
+
+
+async def driver_url(driver: schemas.DriverBase, service: schemas.Service, path: str):
+    """url of a driver path and the headers describing the service to the driver."""
     hosts = list(service.locations.values())
     meta = service.meta
     if not meta:
         meta = config.DEFAULT_META.get(driver.scope, {}).get(driver.app)
     headers = {"Metadata": json.dumps(meta), "Hosts": ",".join(hosts)}
     try:
-        ip = get_driver_ip(driver)
+        ip = await endpoints.resolve(driver)
     except errors.ServiceException as exc:
         drv_create = {
             "name": driver.name,
@@ -67,47 +82,79 @@ def service_stack(driver: schemas.DriverBase, service: schemas.Service, method:
         raise exc
     if not ip:
         raise errors.ServiceException(driver.name, errors.DRV_UNREACH_ERROR, "Can't determine driver IP address")
-    url = f"http://{ip}:{config.DRIVER_PORT}{path}"
+    return f"http://{ip}:{config.DRIVER_PORT}{path}", headers
+
+
+async def service_stack(driver: schemas.DriverBase, service: schemas.Service, method: str,
+                        path: str, data: dict = {}, sync: bool = False, ttl: int = 3600):
+    output = ""
+    url, headers = await driver_url(driver, service, path)
     if sync:
         # Don't print secrets, use this line in secure envs
         # logger.debug(f"Executing {method.upper()} {url} with headers: {headers} and data: {data}")
+        drv_meta = driver.meta or {}
         try:
-            kwargs = {
-                "headers": headers,
-                "proxies": {"http": None},
-                "json": None,
-                "params": None,
-                "files": None
-            }
-            if method == "get":
-                kwargs["params"] = data
-            else:
-                if isinstance(data, dict):
-                    kwargs["json"] = data
-                if isinstance(data, UploadFile):
-                    kwargs["files"] = {'img': (data.filename, data.file.read())}
-            resp = requests.request(method.upper(), url, **kwargs)
-        except requests.exceptions.ConnectionError:
+            status, text = await transport.request(
+                f"{driver.name}-{driver.version}", method, url,
+                limit=drv_meta.get("conn_limit"), timeout=drv_meta.get("timeout"),
+                headers=headers, **_driver_request_kwargs(method, data))
+        except aiohttp.ClientConnectionError:
+            endpoints.invalidate(f"{driver.name}-{driver.version}")
             raise errors.ServiceException(driver.name, errors.DRV_UNREACH_ERROR, f"No route to {url}")
-        if resp.status_code == 200:
+        except asyncio.TimeoutError:
+            raise errors.ServiceException(driver.name, errors.DRV_UNREACH_ERROR, f"Timeout waiting for {url}")
+        except aiohttp.ClientError as exc:
+            raise errors.ServiceException(driver.name, errors.DRV_EXEC_ERROR, f"Request to {url} failed: {exc!r}")
+        if status == 200:
             try:
-                output = json.loads(resp.text)
+                output = json.loads(text)
             except json.decoder.JSONDecodeError:
-                raise errors.ServiceException(url, errors.DRV_IMPL_ERROR, f'Ouptut is not JSON deserializable: "{resp.text}"')
-        elif resp.status_code == 500:
-            raise errors.ServiceException(url, errors.DRV_EXEC_ERROR, resp.text)
+                raise errors.ServiceException(url, errors.DRV_IMPL_ERROR, f'Ouptut is not JSON deserializable: "{text}"')
+        elif status == 500:
+            raise errors.ServiceException(url, errors.DRV_EXEC_ERROR, text)
         else:
-            raise errors.ServiceException(url, errors.SVC_EXEC_ERROR, resp.text)
+            raise errors.ServiceException(url, errors.SVC_EXEC_ERROR, text)
     else:
-        queues.check_api_status()
-        resp = queues.queue_service(service.name, url, method, headers, data, ttl)
-        if resp.status_code == 200:
-            output = json.loads(resp.text)
-        else:
-            raise errors.ServiceException("", errors.QAPI_EXEC_ERROR, resp.text)
+        output = await queues.enqueue(service.name, url, method, headers, data, ttl)
     return output
 
 
+async def service_stream(driver: schemas.DriverBase, service: schemas.Service, method: str,
+                         path: str, data: dict = {}, media_type: str = "application/x-ndjson"):
+    """call a driver and relay its response body as it arrives
+
+    Streams are always direct calls, the first chunk is awaited before
+    responding, so driver errors still become errors.ServiceException.
+    """
+    url, headers = await driver_url(driver, service, path)
+    drv_meta = driver.meta or {}
+    chunks = transport.stream(
+        f"{driver.name}-{driver.version}", method, url,
+        limit=drv_meta.get("conn_limit"), timeout=drv_meta.get("timeout"),
+        headers=headers, **_driver_request_kwargs(method, data))
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except aiohttp.ClientConnectionError:
+        endpoints.invalidate(f"{driver.name}-{driver.version}")
+        raise errors.ServiceException(driver.name, errors.DRV_UNREACH_ERROR, f"No route to {url}")
+    except asyncio.TimeoutError:
+        raise errors.ServiceException(driver.name, errors.DRV_UNREACH_ERROR, f"Timeout waiting for {url}")
+    except transport.StreamError as exc:
+        code = errors.DRV_EXEC_ERROR if exc.status == 500 else errors.SVC_EXEC_ERROR
+        raise errors.ServiceException(url, code, exc.text)
+    except aiohttp.ClientError as exc:
+        raise errors.ServiceException(driver.name, errors.DRV_EXEC_ERROR, f"Request to {url} failed: {exc!r}")
+
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=media_type)
+
+
 def get_driver_container(driver: schemas.DriverBase):
     cont = None
     cont_name = f"{driver.name}-{driver.version}"
@@ -132,6 +179,206 @@ def get_driver_ip(driver: schemas.DriverBase):
     return cont.attrs["NetworkSettings"]["Networks"][config.NETWORK_NAME]["IPAddress"]
 
 
+class DriverEndpoints:
+    """In-process cache of driver container IPs
+
+    Resolving an IP through docker costs several calls to the docker socket,
+    so it's done once per driver and reused until the container changes.
+    Entries are dropped by docker container events (see watch), when a call
+    to the driver fails to connect, and after config.DRIVER_ENDPOINT_TTL
+    seconds in case events are missed.
+    """
+
+    WATCHED_ACTIONS = {"start", "restart", "die", "kill", "stop", "destroy", "rename"}
+
+    def __init__(self, ttl: float = config.DRIVER_ENDPOINT_TTL):
+        self.ttl = ttl
+        self._ips = {}
+        self._lock = threading.Lock()
+        self._events = None
+        self._retry = None
+        self._restarts = 0
+        self._stopped = False
+
+    def get(self, cont_name: str):
+        with self._lock:
+            entry = self._ips.get(cont_name)
+        if entry is None:
+            return None
+        ip, resolved_at = entry
+        if self.ttl and time.monotonic() - resolved_at > self.ttl:
+            self.invalidate(cont_name)
+            return None
+        return ip
+
+    def set(self, cont_name: str, ip: str):
+        with self._lock:
+            self._ips[cont_name] = (ip, time.monotonic())
+
+    def invalidate(self, cont_name: str = None):
+        with self._lock:
+            if cont_name is None:
+                self._ips.clear()
+            elif self._ips.pop(cont_name, None):
+                logger.debug(f"Driver endpoint {cont_name} invalidated")
+
+    async def resolve(self, driver: schemas.DriverBase):
+        """get the driver IP, querying docker outside the event loop on a miss."""
+        cont_name = f"{driver.name}-{driver.version}"
+        ip = self.get(cont_name)
+        if ip is None:
+            ip = await asyncio.get_event_loop().run_in_executor(None, get_driver_ip, driver)
+            if ip:
+                self.set(cont_name, ip)
+        return ip
+
+    def _watch_events(self, events):
+        try:
+            for event in events:
+                self._restarts = 0
+                if event.get("Action") in self.WATCHED_ACTIONS:
+                    attrs = event.get("Actor", {}).get("Attributes", {})
+                    self.invalidate(attrs.get("name"))
+                    if event["Action"] == "rename":
+                        self.invalidate(attrs.get("oldName", "").lstrip("/"))
+            reason = "event stream ended"
+        except Exception as exc:
+            reason = exc
+        # events may have been missed until the watcher is back
+        self.invalidate()
+        with self._lock:
+            if self._events is not events:
+                # closed by stop
+                return
+            self._events = None
+        self._restart(reason)
+
+    def _restart(self, reason):
+        """watch again after a delay doubling on every restart without events."""
+        delay = min(2 ** self._restarts, config.DRIVER_EVENTS_RETRY_MAX_DELAY)
+        self._restarts += 1
+        logger.warning(f"Driver endpoint watcher stopped ({reason}), restarting in {delay}s")
+        self._retry = threading.Timer(delay, self._start)
+        self._retry.daemon = True
+        self._retry.start()
+
+    def _start(self):
+        if self._stopped or self._events is not None:
+            return
+        try:
+            events = docker.from_env().events(decode=True, filters={"type": "container"})
+        except docker.errors.DockerException as exc:
+            if not self._restarts:
+                logger.debug(f"Can't watch docker events, relying on endpoint ttl: {exc}")
+                return
+            self._restart(exc)
+            return
+        self._events = events
+        threading.Thread(
+            target=self._watch_events, args=(events,), name="driver-endpoints", daemon=True
+        ).start()
+
+    def watch(self):
+        """invalidate entries on docker container events in a daemon thread.
+
+        The watcher is restarted with a backoff when the event stream ends or
+        fails, config.DRIVER_ENDPOINT_TTL bounds staleness meanwhile.
+        """
+        self._stopped = False
+        self._start()
+
+    def stop(self):
+        self._stopped = True
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        with self._lock:
+            events, self._events = self._events, None
+        if events is not None:
+            events.close()
+
+
+endpoints = DriverEndpoints()
+
+
+class DriverCatalog:
+    """Drivers installed in config.NATIVE_PATH and config.PLUGIN_PATH
+
+    metadata.json files are parsed once and indexed by {driver.name}-{driver.version}
+    and by driver.app. At most every config.DRIVER_CATALOG_CHECK_INTERVAL seconds
+    the mtimes of the driver directories and metadata files are compared with
+    the ones seen on the last load, and the catalog is reloaded if they changed.
+    """
+
+    def __init__(self, check_interval: float = config.DRIVER_CATALOG_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._drivers = []
+        self._by_name_ver = {}
+        self._by_app = {}
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sources():
+        return zip([schemas.SourceTypes.native.value, schemas.SourceTypes.plugin.value],
+                   [config.NATIVE_PATH, config.PLUGIN_PATH])
+
+    def _signature_of(self):
+        signature = []
+        for _, path in self._sources():
+            signature.append((path, os.stat(path).st_mtime_ns))
+            for name_ver in sorted(os.listdir(path)):
+                try:
+                    signature.append((name_ver, os.stat(f"{path}/{name_ver}/metadata.json").st_mtime_ns))
+                except (FileNotFoundError, NotADirectoryError):
+                    pass
+        return tuple(signature)
+
+    def _load(self):
+        drivers = []
+        for source_type, path in self._sources():
+            for name_ver in os.listdir(path):
+                if "metadata.json" in os.listdir(f"{path}/{name_ver}"):
+                    with open(f"{path}/{name_ver}/metadata.json", "r") as driver_file:
+                        driver_info = json.load(driver_file)
+                        driver_info["source_type"] = source_type
+                        drivers.append(schemas.DriverBase(**driver_info))
+        by_app = {}
+        for driver in drivers:
+            by_app.setdefault(driver.app, []).append(driver)
+        self._drivers = drivers
+        self._by_name_ver = {f"{driver.name}-{driver.version}": driver for driver in drivers}
+        self._by_app = by_app
+        logger.debug(f"Driver catalog loaded, found {len(drivers)} drivers installed")
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            signature = self._signature_of()
+            if force or signature != self._signature:
+                self._load()
+                self._signature = signature
+
+    def all(self):
+        self.refresh()
+        return list(self._drivers)
+
+    def get(self, name_ver: str):
+        self.refresh()
+        return self._by_name_ver.get(name_ver)
+
+    def by_app(self, app: str):
+        self.refresh()
+        return list(self._by_app.get(app, []))
+
+
+catalog = DriverCatalog()
+
+
 def is_driver_deployed(driver: schemas.DriverBase):
     try:
         get_driver_container(driver)
@@ -159,6 +406,7 @@ def deploy_driver(driver: schemas.DriverBase):
     except errors.ServiceException:
         logger.debug(f"No previuos driver {cont_name} found")
     client.containers.run(img_name, detach=True, network=config.NETWORK_NAME, name=cont_name)
+    endpoints.invalidate(cont_name)
     return True
 
 
@@ -182,17 +430,7 @@ async def list_drivers():
     Inside of each driver folder, there should be a metadata.json file which
     will be used to deserialize data and create a schemas.DriverBase object.
     """
-    drivers = []
-    for source_type, path in zip([schemas.SourceTypes.native.value,
-                                  schemas.SourceTypes.plugin.value],
-                                 [config.NATIVE_PATH, config.PLUGIN_PATH]):
-        for name_ver in os.listdir(path):
-            if "metadata.json" in os.listdir(f"{path}/{name_ver}"):
-                with open(f"{path}/{name_ver}/metadata.json", "r") as driver_file:
-                    driver_info = json.load(driver_file)
-                    driver_info["source_type"] = source_type
-                    drivers.append(schemas.DriverBase(**driver_info))
-    return drivers
+    return catalog.all()
 
 
 @router.get("/driver/{drv_name_ver}", response_model=schemas.DriverBase,
@@ -204,13 +442,7 @@ async def get_driver(drv_name_ver: str):
     referenced by name and version using the following format:
     {driver.name}-{driver.version}
     """
-    ver = drv_name_ver.split("-")[-1]
-    name = drv_name_ver[:-len(ver)-1]
-    drivers = await list_drivers()
-    for driver in drivers:
-        if driver.name == name and driver.version == ver:
-            return driver
-    return None
+    return catalog.get(drv_name_ver)
 
 
 @router.post("/driver/", response_model=schemas.DriverBase,
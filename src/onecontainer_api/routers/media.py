@@ -1,21 +1,18 @@
 # SPDX-License-Identifier: BSD-3-Clause
 #  Copyright (c) 2020 Intel Corporation
 """Media vertical entrypoint."""
-from aiocache import Cache
-from aiocache import cached
 import databases
 from fastapi import APIRouter
 from fastapi import Depends
 
-from onecontainer_api import errors, models, schemas
-from onecontainer_api.config import cache_tte
+from onecontainer_api import cache, errors, models, schemas
 from onecontainer_api.routers import drivers, services
 
 router = APIRouter()
 
 
 @router.post("/media/{service_id}/probe", description="Probe a media file")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
+@cache.responses.cached("media.probe")
 async def probe(
     service_id: str,
     input_file: schemas.InputFile,
@@ -26,7 +23,7 @@ async def probe(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
+        return await drivers.service_stack(
             driver,
             service,
             "post",
@@ -41,7 +38,6 @@ async def probe(
 
 
 @router.post("/media/{service_id}/pipeline", description="Create an ffmpeg pipeline")
-@cached(ttl=cache_tte, cache=Cache.MEMORY)
 async def transcode(
     service_id: str,
     pipeline: schemas.Pipeline,
@@ -52,7 +48,7 @@ async def transcode(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
+        return await drivers.service_stack(
             driver,
             service,
             "post",
@@ -80,7 +76,7 @@ async def get_outputs(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
+        return await drivers.service_stack(
             driver, service, "get", f"/pipeline/{pipeline_id}", sync=sync, ttl=ttl
         )
     raise errors.ServiceException(
@@ -102,7 +98,7 @@ async def delete_pipeline(
     service = await services.get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(
+        return await drivers.service_stack(
             driver, service, "delete", f"/pipeline/{pipeline_id}", sync=sync, ttl=ttl
         )
     raise errors.ServiceException(
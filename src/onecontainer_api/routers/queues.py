@@ -1,47 +1,21 @@
 # SPDX-License-Identifier: BSD-3-Clause
 #  Copyright (c) 2020 Intel Corporation
 
+import asyncio
 import json
-import time
+from typing import List
 
-import docker
+import aiohttp
 import requests
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
 from starlette.datastructures import UploadFile
 
-from onecontainer_api import config, errors
-from onecontainer_api.logger import logger
+from onecontainer_api import config, errors, jobs, transport
 
 router = APIRouter()
 
 
-def raise_worker(service_name: str):
-    logger.debug(f"Rising a worker for queue {service_name}")
-    client = docker.from_env()
-    img_name = "oca_worker"
-    cont_name = f"oca_worker_{service_name}"
-    cont = None
-    try:
-        client.images.get(img_name)
-        cont = client.containers.get(cont_name)
-    except docker.errors.ImageNotFound:
-        logger.debug(f"Building worker image {img_name}")
-        client.images.build(path=f"{config.BASE_DIR}/async_queue", tag=img_name, rm=True)
-    except docker.errors.NotFound:
-        logger.debug(f"Container {cont_name} not found")
-    if cont:
-        logger.debug("Worker container found")
-        if cont.status != 'running':
-            logger.debug(f"Container {cont_name} is not running. Running starting command")
-            cont.start()
-            time.sleep(3)
-            cont = client.containers.get(cont_name)
-    else:
-        logger.debug(f"Creating worker container {cont_name}")
-        client.containers.run(img_name, detach=True, network=config.NETWORK_NAME, working_dir="/workspace", name=cont_name, command=f"rq worker --url redis://oca_redis:6379 {service_name}")
-    # TODO: Implement queue monitoring system to remove workers on empty queues
-
-
 def check_api_status():
     try:
         resp = requests.get(f'{config.QUEUE_API_URL}/ping')
@@ -52,7 +26,20 @@ def check_api_status():
     return True
 
 
-def queue_service(name, url, req_type, headers, data, ttl):
+async def ping_api():
+    """non blocking check_api_status, used on the request path."""
+    try:
+        status, _ = await transport.request("queue_api", "get", f'{config.QUEUE_API_URL}/ping')
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_UNREACH_ERROR, "Check service or network")
+    except aiohttp.ClientError as exc:
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_EXEC_ERROR, repr(exc))
+    if status != 200:
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_UNREACH_ERROR, "Check service or network")
+    return True
+
+
+async def queue_service(name, url, req_type, headers, data, ttl):
     req_data = {
         "name": name,
         "url": url,
@@ -60,30 +47,111 @@ def queue_service(name, url, req_type, headers, data, ttl):
         "headers": headers,
         "ttl": ttl
     }
-    if isinstance(data, UploadFile):
-        files = {'data': (data.filename, data.file.read())}
-        req_data["headers"] = json.dumps(headers)
-        resp = requests.post(f"{config.QUEUE_API_URL}/queue", files=files, data=req_data)
+    if isinstance(data, UploadFile) or transport.is_upload_list(data):
+        form = aiohttp.FormData()
+        for key, value in req_data.items():
+            form.add_field(key, json.dumps(value) if key == "headers" else str(value))
+        for upload in (data if isinstance(data, list) else [data]):
+            form.add_field('data', transport.upload_payload(upload), filename=upload.filename)
+        kwargs = {"data": form}
     else:
         req_data["data"] = data
-        resp = requests.post(f"{config.QUEUE_API_URL}/queue", json=req_data)
-    # TODO: Execute this in a separate thread to avoid waiting
-    raise_worker(name)
+        kwargs = {"json": req_data}
+    try:
+        resp = await transport.request("queue_api", "post", f"{config.QUEUE_API_URL}/queue", **kwargs)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_UNREACH_ERROR, "Check service or network")
+    except aiohttp.ClientError as exc:
+        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_EXEC_ERROR, repr(exc))
+    # workers are started by the queue supervisor when the queue fills up
     return resp
 
 
+def direct():
+    """jobs are read and written straight in the queue redis."""
+    return config.QUEUE_BACKEND == "redis" and jobs.available()
+
+
+async def enqueue(name, url, req_type, headers, data, ttl):
+    """enqueue a driver call in the queue of a service, returns the job.
+
+    Jobs are written straight to the queue redis, or posted to the queue
+    api with QUEUE_BACKEND=api or when rq and aioredis are not installed.
+    """
+    if direct():
+        return await jobs.enqueue(name, url, req_type, headers, data, ttl)
+    await ping_api()
+    status, text = await queue_service(name, url, req_type, headers, data, ttl)
+    if status != 200:
+        raise errors.ServiceException("", errors.QAPI_EXEC_ERROR, text)
+    return json.loads(text)
+
+
+async def fetch_api(job_ids):
+    """jobs from the queue api, None for unknown ids."""
+    output = []
+    for job_id in job_ids:
+        try:
+            status, text = await transport.request("queue_api", "get", f"{config.QUEUE_API_URL}/queue/{job_id}")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_UNREACH_ERROR, "Check service or network")
+        except aiohttp.ClientError as exc:
+            raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_EXEC_ERROR, repr(exc))
+        output.append(json.loads(text) if status == 200 else None)
+    return output
+
+
+async def fetch_jobs(job_ids):
+    if direct():
+        return await jobs.fetch_many(job_ids)
+    return await fetch_api(job_ids)
+
+
+def watch_jobs(job_ids, timeout):
+    """(job id, job) of each job and of each status change, see jobs.watch."""
+    if direct():
+        return jobs.watch(job_ids, timeout)
+    return jobs.watch(job_ids, timeout, read=fetch_api, notify=False)
+
+
+def job_events(job_ids, timeout):
+    """server-sent events of the status changes of jobs."""
+    async def body():
+        events = watch_jobs(job_ids, timeout)
+        try:
+            async for job_id, job in events:
+                if job is None:
+                    job = {"status": None, "error": "Job not found"}
+                yield f"event: {job['status']}\nid: {job_id}\ndata: {json.dumps({'id': job_id, **job})}\n\n"
+        except errors.ServiceException as exc:
+            yield f"event: error\ndata: {json.dumps(exc.detail)}\n\n"
+        finally:
+            await events.aclose()
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/job/events",
+    description="Stream status changes of jobs as server-sent events, until all of them are done")
+async def get_jobs_events(id: List[str] = Query(...), timeout: float = Query(config.JOB_STREAM_TIMEOUT, gt=0)):
+    return job_events(id, timeout)
+
+
 # Get a job response
 @router.get("/job/{job_id}",
-    description="Query a job execution result")
-async def get_job(job_id: str):
-    try:
-        resp = requests.get(f"{config.QUEUE_API_URL}/queue/{job_id}")
-        if resp.status_code == 200:
-            output = json.loads(resp.text)
-        else:
-            raise errors.ServiceException(job_id, errors.QAPI_JOB_ERROR, "Job not found")
-    except requests.exceptions.ConnectionError:
-        raise errors.ServiceException(config.QUEUE_API_URL, errors.QAPI_UNREACH_ERROR, "Check service or network")
+    description="Query a job execution result, wait up to wait seconds for it to be done")
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=config.JOB_WAIT_MAX)):
+    if wait:
+        output = None
+        async for _, output in watch_jobs([job_id], wait):
+            pass
+    else:
+        output, = await fetch_jobs([job_id])
+    if output is None:
+        raise errors.ServiceException(job_id, errors.QAPI_JOB_ERROR, "Job not found")
     return output
 
 
+@router.get("/job/{job_id}/events",
+    description="Stream status changes of a job as server-sent events, until it is done")
+async def get_job_events(job_id: str, timeout: float = Query(config.JOB_STREAM_TIMEOUT, gt=0)):
+    return job_events([job_id], timeout)
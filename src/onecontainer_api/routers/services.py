@@ -8,7 +8,7 @@ from fastapi import APIRouter, Depends
 import databases
 import sqlite3
 
-from onecontainer_api import crud, models, schemas, errors
+from onecontainer_api import cache, config, crud, models, schemas, errors
 from onecontainer_api.logger import logger
 from onecontainer_api.routers import drivers
 
@@ -16,6 +16,8 @@ import re
 
 router = APIRouter()
 
+service_cache = cache.LRUCache(config.SERVICE_CACHE_SIZE, config.SERVICE_CACHE_TTL)
+
 
 @router.get("/service/", response_model=List[schemas.Service],
     description="List backend services available")
@@ -54,9 +56,12 @@ async def post_service(service: schemas.ServiceCreate,
 @router.get("/service/{service_id}", response_model=schemas.Service,
     description="Get information about a backend service")
 async def get_service(service_id: str, db: databases.Database = Depends(models.get_db)):
-    queried = await crud.db_get(db=db, table=models.get_table("service"), obj_id=service_id)
+    queried = service_cache.get(service_id)
     if queried is None:
-        raise errors.DataException(schemas.Service, service_id, errors.NOTFOUND_ERROR)
+        queried = await crud.db_get(db=db, table=models.get_table("service"), obj_id=service_id)
+        if queried is None:
+            raise errors.DataException(schemas.Service, service_id, errors.NOTFOUND_ERROR)
+        service_cache.set(service_id, queried)
     return queried
 
 
@@ -66,7 +71,7 @@ async def ping_service(service_id: str, db: databases.Database = Depends(models.
     service = await get_service(service_id, db)
     if service.driver:
         driver = await drivers.get_driver(service.driver)
-        return drivers.service_stack(driver, service, "get", "/ping", sync=True)
+        return await drivers.service_stack(driver, service, "get", "/ping", sync=True)
     raise errors.ServiceException(service.id, errors.NO_DRV_ERROR, "Service has no driver assigned")
 
 
@@ -82,6 +87,8 @@ async def put_service(service_id: str, service: schemas.ServiceUpdate,
     except sqlite3.IntegrityError as exc:
         raise errors.DataException(service, getattr(service, exc.args[0].split('.')[-1]),
                                    errors.CONFLICT_ERROR)
+    service_cache.delete(service_id)
+    await cache.responses.invalidate(service_id)
     if not updated:
         raise errors.DataException(service, service_id, errors.NOTFOUND_ERROR)
     return updated
@@ -92,6 +99,8 @@ async def put_service(service_id: str, service: schemas.ServiceUpdate,
 async def delete_service(service_id: str, db: databases.Database = Depends(models.get_db)):
     table = models.get_table('service')
     deleted = await crud.db_delete(db=db, table=table, obj_id=service_id)
+    service_cache.delete(service_id)
+    await cache.responses.invalidate(service_id)
     if not deleted:
         raise errors.DataException(schemas.Service, service_id, errors.NOTFOUND_ERROR)
     return deleted
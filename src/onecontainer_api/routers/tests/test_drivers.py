@@ -2,6 +2,7 @@
 #  Copyright (c) 2020 Intel Corporation
 import json
 import os
+import time
 
 from onecontainer_api import config, schemas
 from onecontainer_api.routers import drivers
@@ -50,3 +51,42 @@ class TestDrivers():
         cont = drivers.get_driver_container(driver)
         cont.kill()
         assert drivers.is_driver_deployed(driver)
+
+
+class TestDriverEndpoints():
+
+    def test_endpoint_cached(self):
+        endpoints = drivers.DriverEndpoints(ttl=0)
+        assert endpoints.get("drv-0.1.0") is None
+        endpoints.set("drv-0.1.0", "10.5.0.10")
+        assert endpoints.get("drv-0.1.0") == "10.5.0.10"
+        endpoints.invalidate("drv-0.1.0")
+        assert endpoints.get("drv-0.1.0") is None
+
+    def test_endpoint_expired(self):
+        endpoints = drivers.DriverEndpoints(ttl=0.01)
+        endpoints.set("drv-0.1.0", "10.5.0.10")
+        time.sleep(0.02)
+        assert endpoints.get("drv-0.1.0") is None
+
+
+class TestDriverCatalog():
+
+    def test_catalog_index(self):
+        catalog = drivers.DriverCatalog()
+        for driver in DRIVERS:
+            assert catalog.get(f"{driver.name}-{driver.version}") == driver
+            assert driver in catalog.by_app(driver.app)
+        assert catalog.get("missing-driver-0.0.0") is None
+
+    def test_catalog_reload(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config, "PLUGIN_PATH", str(tmp_path))
+        catalog = drivers.DriverCatalog(check_interval=0)
+        native = len(catalog.all())
+        (tmp_path / "plugin-driver-0_1_0").mkdir()
+        (tmp_path / "plugin-driver-0_1_0" / "metadata.json").write_text(json.dumps({
+            "name": "plugin-driver", "app": "plugin", "app_version_match": ">=0.1.0",
+            "version": "0.1.0", "scope": "ai"
+        }))
+        assert len(catalog.all()) == native + 1
+        assert catalog.get("plugin-driver-0.1.0").source_type == schemas.SourceTypes.plugin
@@ -3,7 +3,7 @@
 from enum import Enum
 from typing import List, Optional, Dict, Any
 
-from pydantic import utils, BaseModel
+from pydantic import utils, BaseModel, Field
 
 
 class Scopes(str, Enum):
@@ -104,6 +104,45 @@ class RecordDMLOptions(BaseModel):
     exist_condition: Optional[DMLExistCondition]
 
 
+class DQLOperator(str, Enum):
+    eq = "="
+    lt = "<"
+    lte = "<="
+    gt = ">"
+    gte = ">="
+    in_ = "in"
+
+
+class DQLPredicate(BaseModel):
+    column: str
+    op: DQLOperator = DQLOperator.eq
+    value: Any
+
+
+class DQLOrder(BaseModel):
+    column: str
+    desc: bool = False
+
+
+class RecordDQLOptions(BaseModel):
+    """select query, predicates go to partition and clustering key columns
+
+    where holds equality predicates, filters the others, so a read for a
+    key only touches its partition.
+    """
+    columns: Optional[List[str]]
+    where: Optional[Dict[str, Any]]
+    filters: Optional[List[DQLPredicate]]
+    order_by: Optional[List[DQLOrder]]
+    limit: Optional[int] = Field(None, gt=0)
+
+
+class TableFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+    parquet = "parquet"
+
+
 class AIModelMeta(BaseModel):
     name: str
     path: str
@@ -142,3 +181,22 @@ class Pipeline(BaseModel):
     input_file: InputFile
     outputs: List[Output]
     ttl: Optional[int] = 300
+
+
+class RequestType(str, Enum):
+    get = "get"
+    post = "post"
+    put = "put"
+    delete = "delete"
+
+
+class BatchJob(BaseModel):
+    service_id: str
+    route: str = Field(..., regex="^/")
+    method: RequestType = RequestType.post
+    data: Dict[str, Any] = {}
+
+
+class JobBatch(BaseModel):
+    jobs: List[BatchJob] = Field(..., min_items=1)
+    ttl: int = Field(3600, gt=0)
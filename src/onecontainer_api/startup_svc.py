@@ -57,6 +57,10 @@ def delete_queue():
     ret = os.system(f"cd {config.BASE_DIR}/async_queue && docker-compose kill && docker-compose rm -f")
     if ret:
         raise errors.ServiceException("Queue API", errors.QAPI_EXEC_ERROR, "Can't delete Queue API containers")
+    # workers are started by the queue supervisor, outside of docker-compose
+    client = docker.from_env()
+    for cont in client.containers.list(all=True, filters={"label": "oca_worker_queue"}):
+        cont.remove(force=True)
     logger.debug("Queue service down")
 
 
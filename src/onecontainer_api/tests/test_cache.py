@@ -0,0 +1,151 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import asyncio
+import time
+
+import pytest
+from starlette.responses import StreamingResponse
+
+from onecontainer_api import cache
+
+
+class TestLRUCache():
+
+    def test_lru_eviction(self):
+        lru = cache.LRUCache(maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        assert lru.get("a") == 1
+        lru.set("c", 3)
+        assert lru.get("b") is None
+        assert lru.get("a") == 1
+        assert lru.get("c") == 3
+        assert lru.stats()["evictions"] == 1
+
+    def test_ttl(self):
+        lru = cache.LRUCache(maxsize=2, ttl=0.01)
+        lru.set("a", 1)
+        time.sleep(0.02)
+        assert lru.get("a") is None
+        assert len(lru) == 0
+
+    def test_stats(self):
+        lru = cache.LRUCache()
+        lru.set("a", 1)
+        lru.get("a")
+        lru.get("b")
+        stats = lru.stats()
+        assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+    def test_byte_bound(self):
+        lru = cache.LRUCache(maxsize=10, maxbytes=8)
+        lru.set("a", "1234")
+        lru.set("b", "5678")
+        lru.set("c", "90")
+        assert lru.get("a") is None
+        assert lru.nbytes == 6
+        assert not lru.set("d", "123456789")
+
+
+class TestMemoryBackend():
+
+    @pytest.mark.asyncio
+    async def test_counts_utf8_bytes(self):
+        backend = cache.MemoryBackend(10, 8)
+        await backend.set("a", "\u00e9\u00e9\u00e9", 60)
+        assert backend.entries.nbytes == 6
+        await backend.set("b", "\u00e9\u00e9\u00e9", 60)
+        assert await backend.get("a") is None
+        await backend.set("c", "\u00e9" * 5, 60)
+        assert await backend.get("c") is None
+
+
+    @pytest.mark.asyncio
+    async def test_bounded_tags(self):
+        backend = cache.MemoryBackend(10, 1024, maxtags=2)
+        for tag in ("a", "b", "c"):
+            await backend.bump(tag)
+        assert list(backend.tags) == ["b", "c"]
+        gen_a, gen_b, gen_c = await backend.generations(["a", "b", "c"])
+        assert gen_a == backend.floor and gen_a > max(gen_b, gen_c)
+        # an entry cached before a's write never matches a again
+        await backend.bump("d")
+        assert (await backend.generations(["a"]))[0] not in (1, gen_a)
+
+
+class TestResponseCache():
+
+    def setup_method(self):
+        self.calls = 0
+        self.responses = cache.ResponseCache(cache.MemoryBackend(10, 1024), ttl=60)
+
+    @pytest.mark.asyncio
+    async def test_cached_sync_only(self):
+        @self.responses.cached("test.route")
+        async def route(service_id: str, body: dict, sync: bool = False):
+            self.calls += 1
+            return {"calls": self.calls}
+
+        assert await route(service_id="svc", body={"a": 1, "b": 2}, sync=True) == {"calls": 1}
+        assert await route(service_id="svc", body={"b": 2, "a": 1}, sync=True) == {"calls": 1}
+        assert await route(service_id="svc", body={"a": 1, "b": 2}, sync=False) == {"calls": 2}
+        assert await route(service_id="svc", body={"a": 2}, sync=True) == {"calls": 3}
+
+    @pytest.mark.asyncio
+    async def test_write_invalidates(self):
+        @self.responses.cached("test.read", tags=["{service_id}:records:{table_name}"])
+        async def read(service_id: str, table_name: str, sync: bool = False):
+            self.calls += 1
+            return self.calls
+
+        @self.responses.invalidates("{service_id}:records:{table_name}")
+        async def write(service_id: str, table_name: str, sync: bool = False):
+            return True
+
+        assert await read(service_id="svc", table_name="t1", sync=True) == 1
+        assert await read(service_id="svc", table_name="t2", sync=True) == 2
+        await write(service_id="svc", table_name="t1")
+        assert await read(service_id="svc", table_name="t1", sync=True) == 3
+        assert await read(service_id="svc", table_name="t2", sync=True) == 2
+        await self.responses.invalidate("svc")
+        assert await read(service_id="svc", table_name="t2", sync=True) == 4
+
+    @pytest.mark.asyncio
+    async def test_async_write_invalidates_when_job_done(self):
+        job_done = asyncio.Event()
+
+        async def wait_job(job_id):
+            assert job_id == "job1"
+            await job_done.wait()
+
+        self.responses.wait_job = wait_job
+
+        @self.responses.cached("test.read", tags=["{service_id}:records:{table_name}"])
+        async def read(service_id: str, table_name: str, sync: bool = False):
+            self.calls += 1
+            return self.calls
+
+        @self.responses.invalidates("{service_id}:records:{table_name}")
+        async def write(service_id: str, table_name: str, sync: bool = False):
+            return {"id": "job1", "status": "queued"}
+
+        assert await read(service_id="svc", table_name="t1", sync=True) == 1
+        await write(service_id="svc", table_name="t1", sync=False)
+        # the job didn't run yet, reads may still be served the old rows
+        assert await read(service_id="svc", table_name="t1", sync=True) == 1
+        job_done.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert await read(service_id="svc", table_name="t1", sync=True) == 2
+
+    @pytest.mark.asyncio
+    async def test_streams_not_cached(self):
+        @self.responses.cached("test.stream")
+        async def read(service_id: str, stream: bool = False, sync: bool = False):
+            self.calls += 1
+            return StreamingResponse(iter([b"{}\n"])) if stream else self.calls
+
+        assert isinstance(await read(service_id="svc", stream=True, sync=True), StreamingResponse)
+        assert isinstance(await read(service_id="svc", stream=True, sync=True), StreamingResponse)
+        assert self.calls == 2
+        assert await read(service_id="svc", sync=True) == 3
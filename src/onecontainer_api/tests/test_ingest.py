@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import asyncio
+
+import pytest
+
+from onecontainer_api import ingest, jobs
+
+try:
+    import fakeredis.aioredis
+except ImportError:
+    fakeredis = None
+
+
+class Recorder:
+
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    async def flush(self, key, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("driver down")
+        self.batches.append((key, list(rows)))
+        return {"applied": len(rows), "failed": 0, "errors": []}
+
+
+class TestWriteBehind():
+
+    @pytest.mark.asyncio
+    async def test_size_and_time_bounded_flushes(self):
+        recorder = Recorder()
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=3, interval=0.05, max_rows=100, retries=0)
+        for i in range(4):
+            await buffers.put("a", {"id": i})
+        await asyncio.sleep(0.01)
+        assert recorder.batches == [("a", [{"id": 0}, {"id": 1}, {"id": 2}])]
+        await asyncio.sleep(0.1)
+        assert recorder.batches[1] == ("a", [{"id": 3}])
+        stats = buffers.stats()
+        assert stats["queued"] == 0
+        assert stats["buffers"]["a"]["rows_applied"] == 4
+        assert stats["buffers"]["a"]["flushes"] == 2
+
+    @pytest.mark.asyncio
+    async def test_close_flushes_queued_rows(self):
+        recorder = Recorder()
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=100, interval=60, max_rows=100, retries=0)
+        await buffers.put(("svc", "t1"), {"id": 1})
+        await buffers.put(("svc", "t2"), {"id": 2})
+        await buffers.close()
+        assert sorted(key for key, _ in recorder.batches) == [("svc", "t1"), ("svc", "t2")]
+
+    @pytest.mark.asyncio
+    async def test_failed_flushes_are_retried(self):
+        recorder = Recorder(failures=3)
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=1, interval=0, max_rows=10, retries=0)
+        await buffers.put("a", {"id": 1})
+        await asyncio.sleep(0.5)
+        await buffers.close()
+        assert recorder.batches == [("a", [{"id": 1}])]
+        assert buffers.stats()["buffers"]["a"]["flush_errors"] == 3
+
+    @pytest.mark.asyncio
+    async def test_close_keeps_unflushed_rows(self):
+        recorder = Recorder(failures=10)
+        store = ingest.MemoryStore()
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=1, interval=0, max_rows=10, retries=1,
+                                     store=store)
+        buffers._buffer("a").max_delay = 0
+        await buffers.put("a", {"id": 1})
+        await buffers.close()
+        assert recorder.batches == []
+        assert await store.pending() == {"a": 1}
+        assert buffers.stats()["queued"] == 1
+
+    @pytest.mark.asyncio
+    async def test_put_waits_for_space(self):
+        recorder = Recorder()
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=2, interval=60, max_rows=2, retries=0)
+        await buffers.put("a", {"id": 1})
+        await buffers.put("a", {"id": 2})
+        await asyncio.wait_for(buffers.put("a", {"id": 3}), 1)
+        await buffers.close()
+        assert [row["id"] for _, rows in recorder.batches for row in rows] == [1, 2, 3]
+
+
+@pytest.fixture
+async def redis_store(monkeypatch):
+    pool = await fakeredis.aioredis.create_redis_pool()
+
+    async def get_pool():
+        return pool
+    monkeypatch.setattr(jobs, "get_pool", get_pool)
+    yield ingest.RedisStore()
+    pool.close()
+    await pool.wait_closed()
+
+
+@pytest.mark.skipif(fakeredis is None, reason="needs fakeredis")
+class TestRedisStore():
+
+    @pytest.mark.asyncio
+    async def test_rows_outlive_the_buffers(self, redis_store):
+        recorder = Recorder(failures=10)
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=2, interval=0, max_rows=10, retries=0,
+                                     store=redis_store)
+        buffers._buffer(("svc", "t1", None, None)).max_delay = 0
+        for i in range(3):
+            await buffers.put(("svc", "t1", None, None), {"id": i})
+        await buffers.close()
+        assert recorder.batches == []
+
+        # next gateway
+        recorder = Recorder()
+        buffers = ingest.WriteBehind(recorder.flush, batch_size=2, interval=0, max_rows=10, retries=0,
+                                     store=redis_store)
+        await buffers.recover()
+        await buffers.close()
+        assert recorder.batches == [(("svc", "t1", None, None), [{"id": 0}, {"id": 1}]),
+                                    (("svc", "t1", None, None), [{"id": 2}])]
+        assert await redis_store.pending() == {}
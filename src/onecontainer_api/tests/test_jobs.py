@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import io
+import os
+import sys
+
+import pytest
+from starlette.datastructures import UploadFile
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("fakeredis.aioredis")
+rq_job = pytest.importorskip("rq.job")
+rq_queue = pytest.importorskip("rq.queue")
+
+from onecontainer_api import jobs  # noqa: E402
+from onecontainer_api.async_queue import job_schema  # noqa: E402
+
+# the queue service modules are run from their directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "async_queue"))
+import blob_store  # noqa: E402
+import job_queue  # noqa: E402
+
+
+@pytest.fixture
+async def conn(monkeypatch):
+    """redis of the queue service, the gateway pool connects to the same fake server."""
+    server = fakeredis.FakeServer()
+    pool = await fakeredis.aioredis.create_redis_pool(server=server)
+
+    async def get_pool():
+        return pool
+    monkeypatch.setattr(jobs, "get_pool", get_pool)
+    sync_conn = fakeredis.FakeStrictRedis(server=server)
+    monkeypatch.setattr(job_queue, "CONN", sync_conn)
+    yield sync_conn
+    pool.close()
+    await pool.wait_closed()
+
+
+class TestJobs():
+
+    def test_rq_keys(self):
+        assert jobs.QUEUES_KEY == rq_queue.Queue.redis_queues_keys
+        assert jobs.QUEUE_PREFIX == rq_queue.Queue.redis_queue_namespace_prefix
+        assert jobs.JOB_PREFIX == rq_job.Job.redis_job_namespace_prefix
+        assert job_schema.WORKER_FUNC == f"{job_queue.worker.__module__}.{job_queue.worker.__name__}"
+
+    @pytest.mark.asyncio
+    async def test_enqueue_like_the_queue_service(self, conn):
+        enqueued = await jobs.enqueue_many([
+            ("svc", "http://driver/predict", "post", {"Hosts": "h"}, {"a": 1}),
+            ("svc", "http://driver/usage", "get", {"Hosts": "h"}, {}),
+        ], ttl=60)
+        assert [job["position"] for job in enqueued] == [0, 1]
+        assert rq_queue.Queue("svc", connection=conn).job_ids == [job["id"] for job in enqueued]
+
+        job = rq_job.Job.fetch(enqueued[0]["id"], connection=conn)
+        assert job.func_name == job_schema.WORKER_FUNC
+        assert job.kwargs == {"data": {"a": 1}, "method": "post", "url": "http://driver/predict",
+                              "headers": {"Hosts": "h"}}
+        assert (job.origin, job.result_ttl, job.retries_left) == ("svc", 60, job_schema.JOB_RETRIES)
+        assert job_queue.fetch_job(job.id) == {"status": "queued", "queue": "svc", "position": 0, "result": None}
+
+    @pytest.mark.asyncio
+    async def test_fetch_like_the_queue_service(self, conn):
+        enqueued = await jobs.enqueue("svc", "http://driver/predict", "post", {}, {"a": 1}, None)
+        job = rq_job.Job.fetch(enqueued["id"], connection=conn)
+        job._result = {"label": "cat"}
+        job.set_status(rq_job.JobStatus.FINISHED)
+        job.save()
+        conn.lrem("rq:queue:svc", 0, job.id)
+        fetched, missing = await jobs.fetch_many([job.id, "missing"])
+        assert fetched == job_queue.fetch_job(job.id)
+        assert fetched["result"] == {"label": "cat"}
+        assert missing is None
+
+    @pytest.mark.asyncio
+    async def test_uploads_like_blob_store(self, conn):
+        small = UploadFile("small.jpg", file=io.BytesIO(b"s" * 10))
+        big_content = os.urandom(job_schema.BLOB_INLINE_MAX + job_schema.BLOB_CHUNK_SIZE + 1)
+        big = UploadFile("big.jpg", file=io.BytesIO(big_content))
+        enqueued = await jobs.enqueue("svc", "http://driver/predict", "post", {}, [small, big], None)
+        small_ref, big_ref = rq_job.Job.fetch(enqueued["id"], connection=conn).kwargs["data"]
+        assert blob_store.is_upload(small_ref) and blob_store.is_upload(big_ref)
+        assert "content" in small_ref and big_ref["store"] == "redis"
+        with blob_store.open_upload(conn, small_ref) as fileobj:
+            assert fileobj.read() == b"s" * 10
+        with blob_store.open_upload(conn, big_ref) as fileobj:
+            assert fileobj.read() == big_content
+        blob_store.release(conn, big_ref)
+        assert not conn.exists(job_schema.blob_data_key(big_ref["blob"]))
@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+import io
+import os
+
+import aiohttp
+import pytest
+from aiohttp import web
+from starlette.datastructures import UploadFile
+
+from onecontainer_api import config, transport
+
+
+async def rows(request):
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await resp.prepare(request)
+    for i in range(3):
+        await resp.write(f'{{"id": {i}}}\n'.encode())
+    return resp
+
+
+async def upload_sizes(request):
+    data = await request.post()
+    return web.json_response({field.filename: len(field.file.read()) for field in data.getall("img")})
+
+
+async def invalid(request):
+    return web.Response(status=400, text="Invalid request")
+
+
+class TestStream():
+
+    @pytest.mark.asyncio
+    async def test_stream(self):
+        app = web.Application()
+        app.add_routes([web.get("/rows", rows), web.get("/invalid", invalid)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            body = b"".join([chunk async for chunk in transport.stream("test", "get", f"http://127.0.0.1:{port}/rows")])
+            assert body.decode().splitlines() == ['{"id": 0}', '{"id": 1}', '{"id": 2}']
+            with pytest.raises(transport.StreamError) as exc:
+                async for _ in transport.stream("test", "get", f"http://127.0.0.1:{port}/invalid"):
+                    pass
+            assert exc.value.status == 400
+        finally:
+            await transport.close()
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_upload_payload(self):
+        app = web.Application()
+        app.add_routes([web.post("/form", upload_sizes)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        content = os.urandom(3 * config.UPLOAD_CHUNK_SIZE + 1)
+        upload = UploadFile(file=io.BytesIO(content), filename="big.jpg")
+        await upload.read(10)
+        try:
+            form = aiohttp.FormData()
+            form.add_field("img", transport.upload_payload(upload), filename=upload.filename)
+            form.add_field("img", transport.upload_payload(UploadFile(file=io.BytesIO(b"s"), filename="small.jpg")),
+                           filename="small.jpg")
+            status, body = await transport.request("test", "post", f"http://127.0.0.1:{port}/form", data=form)
+            assert status == 200
+            assert body == '{"big.jpg": %d, "small.jpg": 1}' % len(content)
+        finally:
+            await transport.close()
+            await runner.cleanup()
@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: BSD-3-Clause
+#  Copyright (c) 2020 Intel Corporation
+"""pooled async http transport used to talk to drivers and the queue api.
+
+One aiohttp.ClientSession is kept per target (a driver name-version or the
+queue api), so connections are reused with keep-alive and each target gets
+its own connection limit and timeouts.
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import aiohttp
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+
+from onecontainer_api import config
+from onecontainer_api.logger import logger
+
+_sessions: Dict[str, aiohttp.ClientSession] = {}
+
+
+def get_session(target: str, limit: Optional[int] = None,
+                timeout: Optional[float] = None) -> aiohttp.ClientSession:
+    """get the pooled session for a target, creating it on first use."""
+    session = _sessions.get(target)
+    if session is None or session.closed:
+        limit = limit or config.TRANSPORT_CONN_LIMIT
+        timeout = timeout or config.TRANSPORT_TIMEOUT
+        logger.debug(f"Creating transport session for {target} (limit={limit}, timeout={timeout})")
+        connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit,
+                                         keepalive_timeout=config.TRANSPORT_KEEPALIVE)
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=timeout,
+                                          connect=config.TRANSPORT_CONNECT_TIMEOUT),
+        )
+        _sessions[target] = session
+    return session
+
+
+async def _read_upload(upload: UploadFile) -> AsyncIterator[bytes]:
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(config.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def upload_payload(upload: UploadFile):
+    """body of an upload, read in chunks as aiohttp sends it.
+
+    starlette spools uploads to a temporary file, reading it chunk by chunk
+    avoids copying the whole upload in memory.
+    """
+    return aiohttp.AsyncIterablePayload(_read_upload(upload),
+                                        content_type=upload.content_type or "application/octet-stream")
+
+
+def relay_payload(request: Request):
+    """body of a gateway request, to be sent to a driver as it is received."""
+    return aiohttp.AsyncIterablePayload(request.stream(),
+                                        content_type=request.headers.get("content-type", "application/json"))
+
+
+def ndjson_payload(rows):
+    """body with one JSON document per row."""
+    body = "".join(json.dumps(row) + "\n" for row in rows)
+    return aiohttp.BytesPayload(body.encode(), content_type="application/x-ndjson")
+
+
+def is_upload_list(data):
+    return isinstance(data, list) and bool(data) and all(isinstance(x, UploadFile) for x in data)
+
+
+async def request(target: str, method: str, url: str, limit: Optional[int] = None,
+                  timeout: Optional[float] = None, **kwargs) -> Tuple[int, str]:
+    """execute a request over the target session and return status and body.
+
+    aiohttp.ClientError and asyncio.TimeoutError are left to the caller, so
+    each caller can map them to its own errors.ServiceException.
+    """
+    session = get_session(target, limit, timeout)
+    async with session.request(method.upper(), url, **kwargs) as resp:
+        return resp.status, await resp.text()
+
+
+class StreamError(Exception):
+    """non 200 response to a streamed request, with its status and body."""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(text)
+        self.status = status
+        self.text = text
+
+
+async def stream(target: str, method: str, url: str, limit: Optional[int] = None,
+                 timeout: Optional[float] = None, **kwargs) -> AsyncIterator[bytes]:
+    """execute a request over the target session and yield its body in chunks.
+
+    timeout bounds the wait for each chunk instead of the whole body, a
+    stream lasts as long as the driver keeps sending data.
+    """
+    session = get_session(target, limit, timeout)
+    read_timeout = aiohttp.ClientTimeout(total=None, sock_read=timeout or config.TRANSPORT_TIMEOUT,
+                                         connect=config.TRANSPORT_CONNECT_TIMEOUT)
+    async with session.request(method.upper(), url, timeout=read_timeout, **kwargs) as resp:
+        if resp.status != 200:
+            raise StreamError(resp.status, await resp.text())
+        async for chunk in resp.content.iter_any():
+            yield chunk
+
+
+async def close():
+    """close every pooled session, used on application shutdown."""
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    await asyncio.gather(*[session.close() for session in sessions if not session.closed])